@@ -2,10 +2,24 @@ import streamlit as st
 
 import math
 
+import re
+
 import datetime
 
 import pandas as pd
 
+import numpy as np
+
+import scipy.sparse as sp
+
+from scipy.sparse.linalg import splu
+
+from scipy.sparse.csgraph import connected_components
+
+from scipy.linalg import cho_factor, cho_solve
+
+from scipy.optimize import least_squares
+
 import base64
 
 from datetime import datetime, timedelta
@@ -24,6 +38,20 @@ import os
 
 import traceback
 
+import tempfile
+
+import hashlib
+
+import json
+
+import itertools
+
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from concurrent.futures.process import BrokenProcessPool
+
 st.set_page_config(page_title="CES-Electrical", page_icon="🔌", layout="wide")
 
 # ========== PAKISTAN TIME HELPER FUNCTIONS ==========
@@ -178,10 +206,89 @@ LOAD_TYPE_FACTORS = {
     'Standby': {'diversity': 0.1, 'description': 'Stand-by (10%) - Emergency/backup only', 'cb_factor': 1.25, 'color': '#DC3545'}
 }
 
+# ========== LOAD SHEET AGGREGATION ==========
+
+# Aggregations kept per load-sheet hash (oldest dropped first)
+LOAD_AGG_CACHE_SIZE = 32
+
+class LoadSheetAggregator:
+    def __init__(self):
+        pass
+    
+    @staticmethod
+    def sheet_key(loads):
+        return hashlib.sha1(pd.util.hash_pandas_object(loads, index=False).to_numpy().tobytes()
+                            + "|".join(map(str, loads.columns)).encode()).hexdigest()
+    
+    @staticmethod
+    def motor_mask(loads):
+        # Motor flag from the load sheet; older sheets without the column fall back to the description
+        if 'Motor' in loads.columns:
+            return loads['Motor'].fillna(False).astype(bool).to_numpy()
+        return loads['Load Description'].astype(str).str.contains('motor', case=False).to_numpy()
+    
+    @staticmethod
+    def aggregate(loads):
+        # Peak = connected x load-type diversity (as the load sheet demand); operating also applies the diversity factor
+        qty = pd.to_numeric(loads['Quantity'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        kw = pd.to_numeric(loads['Rating (kW)'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        pf = np.clip(pd.to_numeric(loads['Power Factor'], errors='coerce').fillna(0.85).to_numpy(dtype=float), 0.05, 1.0)
+        type_div = loads['Load Type'].map(lambda t: LOAD_TYPE_FACTORS.get(t, LOAD_TYPE_FACTORS['Continuous'])['diversity']).to_numpy(dtype=float)
+        div = pd.to_numeric(loads['Diversity Factor'], errors='coerce').fillna(1.0).to_numpy(dtype=float)
+        tan_phi = np.tan(np.arccos(pf))
+        pk_p = kw * qty * type_div
+        op_p = pk_p * div
+        df = pd.DataFrame({
+            'Bus (V)': pd.to_numeric(loads['Voltage (V)'], errors='coerce').fillna(0).astype(int).to_numpy(),
+            'Load': loads['Load Description'].astype(str).to_numpy(),
+            'kW': np.where(qty > 0, kw, 0.0), 'PF': pf, 'Connected (kW)': kw * qty,
+            'Motor': LoadSheetAggregator.motor_mask(loads),
+            'Operating P (kW)': op_p, 'Operating Q (kVAR)': op_p * tan_phi,
+            'Peak P (kW)': pk_p, 'Peak Q (kVAR)': pk_p * tan_phi
+        })
+        g = df.groupby('Bus (V)', sort=True)
+        bus = g[['Connected (kW)', 'Operating P (kW)', 'Operating Q (kVAR)', 'Peak P (kW)', 'Peak Q (kVAR)']].sum()
+        bus.insert(0, 'Loads', g.size())
+        bus['Operating S (kVA)'] = np.hypot(bus['Operating P (kW)'], bus['Operating Q (kVAR)'])
+        bus['Peak S (kVA)'] = np.hypot(bus['Peak P (kW)'], bus['Peak Q (kVAR)'])
+        s = bus['Operating S (kVA)']
+        bus['PF'] = (bus['Operating P (kW)'] / s.where(s > 0, 1.0)).where(s > 0, 1.0)
+        # Largest single motor on each bus; buses without motors leave the motor fields empty
+        motors = df[df['Motor']]
+        largest = motors.loc[motors.groupby('Bus (V)')['kW'].idxmax()].set_index('Bus (V)')
+        bus['Largest Motor'] = largest['Load']
+        bus['Largest Motor (kW)'] = largest['kW']
+        bus['Motor PF'] = largest['PF']
+        return bus.reset_index().round(2)
+    
+    @classmethod
+    def cached(cls, loads, cache):
+        key = cls.sheet_key(loads)
+        if key not in cache:
+            cache[key] = cls.aggregate(loads)
+            while len(cache) > LOAD_AGG_CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+        return key, cache[key]
+    
+    @staticmethod
+    def bus_feed(agg, bus_v):
+        row = agg[agg['Bus (V)'] == bus_v].iloc[0]
+        feed = {'op_p': round(float(row['Operating P (kW)']), 1), 'pk_p': round(float(row['Peak P (kW)']), 1),
+                'pf': round(min(max(float(row['PF']), 0.5), 1.0), 2)}
+        # A bus with no motor loads resets the motor check instead of keeping another bus's motor
+        if pd.notna(row['Largest Motor (kW)']):
+            feed.update(motor_kw=round(float(row['Largest Motor (kW)']), 1), motor_pf=round(min(max(float(row['Motor PF']), 0.5), 1.0), 2))
+        else:
+            feed.update(motor_kw=0.0, motor_pf=0.85, no_motor=True)
+        return feed
+
 # ========== TRANSFORMER SIZING - R10 SERIES & CALCULATOR ==========
 
 R10_SERIES = [100, 125, 160, 200, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000, 10000]
 
+# Starting current (% of rated) by starting method
+MOTOR_START_OPTIONS = {"DOL": 650, "Star-Delta (Y-Delta)": 350, "Soft Starter": 400, "VFD": 150}
+
 class TransformerSizingCalculator:
     def __init__(self):
         pass
@@ -208,6 +315,11 @@ class TransformerSizingCalculator:
                 return rating
         return R10_SERIES[-1]
     
+    @staticmethod
+    def harmonic_derated_kva(required_kva, factor_k=1.0):
+        # BS 7821 factor-K: a standard transformer carries only 1/K of its rating with harmonic load
+        return required_kva * max(factor_k, 1.0)
+    
     @staticmethod
     def calc_motor_starting_vd(transformer_kva, impedance_pct, max_demand_kva, 
                                 motor_power_kw, starting_current_pct, motor_pf=0.85, voltage_v=433):
@@ -228,6 +340,685 @@ class TransformerSizingCalculator:
             'voltage_drop_pct': round(vd_pct, 2),
             'is_acceptable': vd_pct <= 15.0
         }
+    
+    @staticmethod
+    def size_batch(rows):
+        # One row per substation; same build-up as the single-unit page, vectorised over all rows
+        pf = rows['PF'].to_numpy(dtype=float)
+        bad = ~((pf > 0) & (pf <= 1))
+        if bad.any():
+            names = (rows['Substation'] if 'Substation' in rows else rows.index.to_series()).astype(str).to_numpy()[bad]
+            raise ValueError(f"PF must be between 0 and 1 for every substation - check: {', '.join(names)}")
+        pk_s = rows['Peak P (kW)'].to_numpy(dtype=float) / pf
+        op_s = rows['Op P (kW)'].to_numpy(dtype=float) / pf
+        peak_with_margin = pk_s * rows['Loading Factor'].to_numpy(dtype=float)
+        required = peak_with_margin * 1.2
+        series = np.asarray(R10_SERIES)
+        idx = np.searchsorted(series, required, side='left')
+        selected = series[np.minimum(idx, len(series) - 1)]
+        
+        motor_pf = rows['Motor PF'].to_numpy(dtype=float) if 'Motor PF' in rows else np.full(len(rows), 0.85)
+        motor_kw = rows['Largest Motor (kW)'].to_numpy(dtype=float)
+        motor_kva = np.where(motor_pf > 0, motor_kw / np.where(motor_pf > 0, motor_pf, 1), motor_kw)
+        start_pct = rows['Start Method'].map(MOTOR_START_OPTIONS).fillna(MOTOR_START_OPTIONS["DOL"]).to_numpy(dtype=float)
+        starting_kva = motor_kva * start_pct / 100.0
+        v = rows['LV Voltage (V)'].to_numpy(dtype=float)
+        sc_current = selected * 1000 / (1.732 * v * rows['Z (%)'].to_numpy(dtype=float) / 100.0)
+        sc_kva = 1.732 * v * sc_current / 1000
+        vd_pct = (peak_with_margin + starting_kva) / sc_kva * 100.0
+        fits = idx < len(series)
+        ok = fits & (vd_pct <= 15.0)
+        
+        out = rows.copy()
+        out['Op S (kVA)'] = np.round(op_s, 1)
+        out['Peak S (kVA)'] = np.round(pk_s, 1)
+        out['Required (kVA)'] = np.round(required, 1)
+        out['Selected (kVA)'] = selected
+        out['Starting kVA'] = np.round(starting_kva, 1)
+        out['Isc (A)'] = np.round(sc_current, 0)
+        out['Motor Start VD (%)'] = np.round(vd_pct, 2)
+        out['Status'] = np.where(ok, 'PASS', np.where(fits, 'VD > 15%', 'EXCEEDS R10'))
+        return out
+
+# ========== LOAD PROFILE ENGINE (TRANSFORMER SIZING) ==========
+
+LOAD_PROFILE_PERCENTILES = [50, 90, 95, 99, 99.9, 100]
+
+class LoadProfile:
+    def __init__(self, p_kw, q_kvar=None, pf=None, step_h=None, source=None):
+        self.p = np.asarray(p_kw, dtype=float)
+        if q_kvar is not None:
+            self.q = np.asarray(q_kvar, dtype=float)
+        else:
+            pf = 1.0 if pf is None else pf
+            self.q = self.p * math.tan(math.acos(min(pf, 1.0)))
+        # Hourly for 8760/8784 points, 15-minute for 35040/35136, otherwise spread over a year
+        self.step_h = step_h or (8760.0 / len(self.p) if len(self.p) else 1.0)
+        self.source = source
+    
+    @staticmethod
+    def _find_column(columns, *keys):
+        # Whole-token match so "timestamp_utc" is not read as P and "Reactive Power" not as active power
+        for col in columns:
+            tokens = set(re.findall(r'[a-z0-9]+', str(col).lower()))
+            if tokens.intersection(keys):
+                return col
+        return None
+    
+    @classmethod
+    def from_csv(cls, path_or_buffer, p_col=None, q_col=None, time_col=None, chunksize=8760):
+        # Streamed in chunks of the needed columns only
+        head = pd.read_csv(path_or_buffer, nrows=0)
+        cols = list(head.columns)
+        if hasattr(path_or_buffer, 'seek'):
+            path_or_buffer.seek(0)
+        p_col = p_col or cls._find_column(cols, 'kw', 'p', 'active')
+        q_col = q_col or cls._find_column(cols, 'kvar', 'q', 'reactive')
+        time_col = time_col or cls._find_column(cols, 'time', 'date', 'timestamp', 'datetime')
+        if p_col is None:
+            raise ValueError("No kW column found in the load profile")
+        usecols = [c for c in (time_col, p_col, q_col) if c is not None]
+        
+        p_parts, q_parts, t_first = [], [], []
+        for chunk in pd.read_csv(path_or_buffer, usecols=usecols, chunksize=chunksize,
+                                 dtype={c: np.float64 for c in (p_col, q_col) if c is not None}):
+            p_parts.append(chunk[p_col].to_numpy())
+            if q_col is not None:
+                q_parts.append(chunk[q_col].to_numpy())
+            if time_col is not None and len(t_first) < 2:
+                t_first.extend(chunk[time_col].iloc[:2 - len(t_first)].tolist())
+        
+        step_h = None
+        if len(t_first) == 2:
+            dt = pd.to_datetime(t_first[1]) - pd.to_datetime(t_first[0])
+            step_h = dt.total_seconds() / 3600.0 or None
+        p = np.nan_to_num(np.concatenate(p_parts))
+        q = np.nan_to_num(np.concatenate(q_parts)) if q_parts else None
+        return cls(p, q, step_h=step_h, source=getattr(path_or_buffer, 'name', path_or_buffer))
+    
+    @property
+    def s(self):
+        return np.hypot(self.p, self.q)
+    
+    @property
+    def n_points(self):
+        return len(self.p)
+    
+    def percentiles(self, ps=LOAD_PROFILE_PERCENTILES):
+        s = self.s
+        return pd.DataFrame({
+            'Percentile': ps,
+            'S (kVA)': np.round(np.percentile(s, ps), 1),
+            'P (kW)': np.round(np.percentile(self.p, ps), 1),
+            'Q (kvar)': np.round(np.percentile(self.q, ps), 1),
+        })
+    
+    def duration_curve(self, points=500):
+        # Sorted descending demand against cumulative hours, thinned to a plotting resolution
+        s_sorted = np.sort(self.s)[::-1]
+        hours = np.arange(1, len(s_sorted) + 1) * self.step_h
+        idx = np.unique(np.linspace(0, len(s_sorted) - 1, min(points, len(s_sorted))).astype(int))
+        return pd.DataFrame({'Hours': hours[idx], 'S (kVA)': s_sorted[idx]}).set_index('Hours')
+    
+    def summary(self):
+        s = self.s
+        energy = self.p.sum() * self.step_h
+        return {
+            'points': self.n_points, 'step_h': self.step_h,
+            'peak_s': float(s.max()), 'peak_p': float(self.p.max()), 'mean_p': float(self.p.mean()),
+            'energy_kwh': float(energy),
+            'load_factor': float(self.p.mean() / self.p.max()) if self.p.max() > 0 else 0.0,
+            'pf': float(self.p.sum() / s.sum()) if s.sum() > 0 else 1.0,
+        }
+    
+    def size(self, percentile=99.0, loading_factor=1.0, headroom=1.2):
+        # Same build-up as the manual mode, with the design demand taken from the profile percentile
+        s_design = float(np.percentile(self.s, percentile))
+        required = s_design * loading_factor * headroom
+        selected = TransformerSizingCalculator.get_r10_rating(required)
+        s = self.s
+        return {
+            'percentile': percentile, 's_design': s_design, 'required_kva': required, 'selected_kva': selected,
+            'hours_over_rating': float((s > selected).sum() * self.step_h),
+            'peak_loading_pct': float(s.max() / selected * 100),
+        }
+
+# ========== TRANSFORMER THERMAL AGEING (IEC 60076-7) ==========
+
+# Thermal characteristics - IEC 60076-7 Table 4
+IEC60076_7_COOLING = {
+    'ONAN (distribution)': {'R': 5.0, 'x': 0.8, 'y': 1.6, 'k11': 1.0, 'k21': 1.0, 'k22': 2.0, 'tau_o': 180.0, 'tau_w': 4.0, 'd_oil': 55.0, 'd_hs': 23.0},
+    'ONAN (power)': {'R': 6.0, 'x': 0.8, 'y': 1.3, 'k11': 0.5, 'k21': 2.0, 'k22': 2.0, 'tau_o': 210.0, 'tau_w': 10.0, 'd_oil': 52.0, 'd_hs': 26.0},
+    'ONAF': {'R': 6.0, 'x': 0.8, 'y': 1.3, 'k11': 0.5, 'k21': 2.0, 'k22': 2.0, 'tau_o': 150.0, 'tau_w': 7.0, 'd_oil': 45.0, 'd_hs': 35.0},
+}
+# Normal cyclic loading limits - IEC 60076-7 Table 3
+IEC60076_7_HOTSPOT_LIMIT = 120.0
+IEC60076_7_TOP_OIL_LIMIT = 105.0
+
+class TransformerThermalModel:
+    def __init__(self, cooling='ONAN (distribution)', upgraded_paper=False):
+        self.cooling = cooling
+        self.c = IEC60076_7_COOLING[cooling]
+        self.upgraded_paper = upgraded_paper
+    
+    def ageing_rate(self, theta_h):
+        # Relative ageing rate V - IEC 60076-7 Equations 2 and 3
+        if self.upgraded_paper:
+            return np.exp(15000.0 / (110 + 273) - 15000.0 / (theta_h + 273))
+        return 2.0 ** ((theta_h - 98.0) / 6.0)
+    
+    def simulate(self, s_kva, ambient, ratings, step_h=1.0, warmup_cycles=0):
+        # Difference-equation solution (IEC 60076-7 Annex C), one state per candidate rating so every rating steps together
+        c = self.c
+        s_kva = np.asarray(s_kva, dtype=float)
+        ambient = np.broadcast_to(np.asarray(ambient, dtype=float), s_kva.shape)
+        inv_rating = 1.0 / np.asarray(ratings, dtype=float)
+        # Time step no larger than half the smallest time constant
+        dt = min(step_h * 60.0, c['tau_w'] / c['k22'] / 2.0)
+        n_sub = int(math.ceil(step_h * 60.0 / dt))
+        dt = step_h * 60.0 / n_sub
+        a_o = dt / (c['k11'] * c['tau_o'])
+        a_h1 = dt / (c['k22'] * c['tau_w'])
+        a_h2 = dt / (c['tau_o'] / c['k22'])
+        
+        K0 = s_kva[0] * inv_rating
+        theta_o = ambient[0] + c['d_oil'] * ((1 + K0**2 * c['R']) / (1 + c['R'])) ** c['x']
+        dh1 = c['k21'] * c['d_hs'] * K0 ** c['y']
+        dh2 = (c['k21'] - 1) * c['d_hs'] * K0 ** c['y']
+        
+        n = len(s_kva)
+        hot_spot = np.empty((n, len(inv_rating)))
+        top_oil = np.empty((n, len(inv_rating)))
+        ageing = np.zeros(len(inv_rating))
+        # Inputs are constant within a profile step, so the n_sub explicit updates x += a(target - x) collapse to
+        # x_j = target + (x_0 - target)(1 - a)^j - same values as stepping one sub-step at a time
+        j = np.arange(1, n_sub + 1)[:, None]
+        g_o, g_h1, g_h2 = (1 - a_o) ** j, (1 - a_h1) ** j, (1 - a_h2) ** j
+        for cycle in range(warmup_cycles + 1):
+            record = cycle == warmup_cycles
+            for t in range(n):
+                K = s_kva[t] * inv_rating
+                oil_target = ambient[t] + c['d_oil'] * ((1 + K**2 * c['R']) / (1 + c['R'])) ** c['x']
+                Ky = c['d_hs'] * K ** c['y']
+                h1_target = c['k21'] * Ky
+                h2_target = (c['k21'] - 1) * Ky
+                to_j = oil_target + (theta_o - oil_target) * g_o
+                hs_j = to_j + h1_target + (dh1 - h1_target) * g_h1 - (h2_target + (dh2 - h2_target) * g_h2)
+                theta_o = to_j[-1]
+                dh1 = h1_target + (dh1 - h1_target) * g_h1[-1]
+                dh2 = h2_target + (dh2 - h2_target) * g_h2[-1]
+                if record:
+                    ageing += self.ageing_rate(hs_j).sum(axis=0) * dt
+                    top_oil[t] = theta_o
+                    hot_spot[t] = hs_j[-1]
+        hours = n * step_h
+        return {'hot_spot': hot_spot, 'top_oil': top_oil, 'hours': hours,
+                'loss_of_life_h': ageing / 60.0, 'mean_ageing_rate': ageing / 60.0 / hours}
+    
+    def evaluate(self, s_kva, ambient, ratings=R10_SERIES, step_h=1.0, ageing_target=1.0, warmup_cycles=0):
+        sim = self.simulate(s_kva, ambient, ratings, step_h, warmup_cycles)
+        max_hs = sim['hot_spot'].max(axis=0)
+        max_to = sim['top_oil'].max(axis=0)
+        ok = (max_hs <= IEC60076_7_HOTSPOT_LIMIT) & (max_to <= IEC60076_7_TOP_OIL_LIMIT) & (sim['mean_ageing_rate'] <= ageing_target)
+        table = pd.DataFrame({
+            'Rating (kVA)': ratings, 'Peak K': np.round(np.max(s_kva) / np.asarray(ratings, dtype=float), 3),
+            'Max Top-Oil (°C)': np.round(max_to, 1), 'Max Hot-Spot (°C)': np.round(max_hs, 1),
+            'Mean Ageing Rate V': np.round(sim['mean_ageing_rate'], 4),
+            'Loss of Life (h)': np.round(sim['loss_of_life_h'], 2),
+            'Status': np.where(ok, 'PASS', 'FAIL')
+        })
+        passing = np.flatnonzero(ok)
+        best = int(passing[np.argmin(np.asarray(ratings)[passing])]) if len(passing) else None
+        return {'table': table, 'selected_kva': None if best is None else ratings[best],
+                'hot_spot': sim['hot_spot'], 'top_oil': sim['top_oil'], 'best_index': best}
+
+# ========== TRANSFORMER LOSSES & TOTAL COST OF OWNERSHIP ==========
+
+TX_LOSS_CATALOGUE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transformer_losses.csv")
+
+class TransformerLossModel:
+    def __init__(self, catalogue):
+        # catalogue: Rating (kVA), No-Load Loss (W), Load Loss (W), Price
+        self.catalogue = catalogue.sort_values('Rating (kVA)').reset_index(drop=True)
+    
+    @classmethod
+    def load(cls, path_or_buffer=TX_LOSS_CATALOGUE):
+        return cls(pd.read_csv(path_or_buffer, comment='#'))
+    
+    @staticmethod
+    def pv_factor(rate_pct, years):
+        i = rate_pct / 100.0
+        return years if i == 0 else (1 - (1 + i) ** -years) / i
+    
+    def candidates(self, required_kva, n_larger=4):
+        # The R10 selection for the demand and the next few larger units (lower load losses at part load)
+        first = TransformerSizingCalculator.get_r10_rating(required_kva)
+        ratings = self.catalogue['Rating (kVA)'].to_numpy()
+        return self.catalogue[ratings >= first].head(n_larger + 1).reset_index(drop=True)
+    
+    def evaluate(self, profile, required_kva, energy_price=0.15, rate_pct=8.0, years=25, n_larger=4):
+        cand = self.candidates(required_kva, n_larger)
+        sr = cand['Rating (kVA)'].to_numpy(dtype=float)
+        p0 = cand['No-Load Loss (W)'].to_numpy(dtype=float)
+        pk = cand['Load Loss (W)'].to_numpy(dtype=float)
+        # Load losses scale with (S/Sr)², so one pass over the profile serves every candidate
+        hours = profile.n_points * profile.step_h
+        sum_s2 = float(np.sum(profile.s ** 2)) * profile.step_h
+        e_nl = p0 * hours / 1e6
+        e_ll = pk * sum_s2 / sr ** 2 / 1e6
+        e_loss = e_nl + e_ll
+        e_out = float(profile.p.sum()) * profile.step_h / 1000.0
+        # Scale to a year when the profile is shorter or longer than 8760 h
+        annual = 8760.0 / hours if hours > 0 else 1.0
+        loss_cost = e_loss * annual * 1000.0 * energy_price
+        capitalised = loss_cost * self.pv_factor(rate_pct, years)
+        price = cand['Price'].to_numpy(dtype=float)
+        tco = price + capitalised
+        table = pd.DataFrame({
+            'Rating (kVA)': sr.astype(int),
+            'No-Load Loss (W)': p0.astype(int),
+            'Load Loss (W)': pk.astype(int),
+            'Peak Loading (%)': np.round(profile.s.max() / sr * 100.0, 1),
+            'No-Load Energy (MWh/yr)': np.round(e_nl * annual, 2),
+            'Load Loss Energy (MWh/yr)': np.round(e_ll * annual, 2),
+            'Efficiency (%)': np.round(e_out / (e_out + e_loss) * 100.0, 3) if e_out > 0 else np.nan,
+            'Loss Cost / yr': np.round(loss_cost),
+            'Capitalised Losses': np.round(capitalised),
+            'Price': np.round(price),
+            'TCO': np.round(tco)
+        })
+        best = int(np.argmin(tco)) if len(tco) else None
+        return {'table': table, 'best_index': best, 'selected_kva': int(sr[0]) if len(sr) else None,
+                'tco_kva': int(sr[best]) if best is not None else None}
+
+# ========== HARMONIC DERATING (K-FACTOR / FACTOR-K) ==========
+
+# Typical current spectra: harmonic order -> (% of fundamental, angle in degrees at zero displacement)
+HARMONIC_SPECTRA = {
+    'Linear': {},
+    'VFD': {5: (33.0, 180), 7: (10.0, 0), 11: (7.5, 180), 13: (4.5, 0), 17: (3.5, 180), 19: (2.5, 0), 23: (2.0, 180), 25: (1.5, 0)},
+    'SMPS / LED': {3: (80.0, 0), 5: (60.0, 180), 7: (40.0, 0), 9: (20.0, 180), 11: (10.0, 0), 13: (5.0, 180)},
+}
+HARMONIC_ORDERS = sorted({h for spectrum in HARMONIC_SPECTRA.values() for h in spectrum})
+# Only VFD starters leave a converter in circuit once running
+HARMONIC_SOURCE_BY_START = {m: ('VFD' if m == 'VFD' else 'Linear') for m in MOTOR_START_OPTIONS}
+# BS 7821 / EN 50464-3 factor-K: eddy-current loss ratio e and exponent q
+HARMONIC_EDDY_LOSS_RATIO = 0.1
+HARMONIC_EXPONENT_Q = 1.7
+
+class HarmonicAnalysis:
+    def __init__(self, loads, e=HARMONIC_EDDY_LOSS_RATIO, q=HARMONIC_EXPONENT_Q):
+        # loads: Load, Bus (V), kW, PF, Harmonic Source
+        self.loads = loads.reset_index(drop=True)
+        self.e = e
+        self.q = q
+    
+    def phasors(self):
+        # Fundamental and harmonic current phasors for every load, rotated by h x displacement angle
+        kw = self.loads['kW'].to_numpy(dtype=float)
+        v = self.loads['Bus (V)'].to_numpy(dtype=float)
+        pf = np.clip(self.loads['PF'].to_numpy(dtype=float), 0.05, 1.0)
+        theta = -np.arccos(pf)
+        i1 = kw * 1000.0 / (math.sqrt(3) * v * pf)
+        orders = np.asarray(HARMONIC_ORDERS, dtype=float)
+        mag = np.zeros((len(self.loads), len(orders)))
+        ang = np.zeros_like(mag)
+        for src, spectrum in HARMONIC_SPECTRA.items():
+            rows = (self.loads['Harmonic Source'] == src).to_numpy()
+            for h, (m, a) in spectrum.items():
+                col = HARMONIC_ORDERS.index(h)
+                mag[rows, col] = m / 100.0
+                ang[rows, col] = math.radians(a)
+        ih = i1[:, None] * mag * np.exp(1j * (ang + orders[None, :] * theta[:, None]))
+        return i1 * np.exp(1j * theta), ih
+    
+    def bus_spectra(self):
+        i1, ih = self.phasors()
+        buses, codes = np.unique(self.loads['Bus (V)'].to_numpy(dtype=float), return_inverse=True)
+        I1 = np.zeros(len(buses), dtype=complex)
+        Ih = np.zeros((len(buses), len(HARMONIC_ORDERS)), dtype=complex)
+        np.add.at(I1, codes, i1)
+        np.add.at(Ih, codes, ih)
+        return buses, np.abs(I1), np.abs(Ih)
+    
+    @staticmethod
+    def cable_factor(rms_ratio, third_pct):
+        # BS 7671 Appendix 4 (Table 4Aa): above 33 % third harmonic the cable is sized on the neutral current
+        # third_pct is of the fundamental; the bands are on the line rms current, design currents stay on the I1 base
+        band = third_pct / rms_ratio
+        neutral = 3 * third_pct / 100.0
+        design = np.select([band <= 15, band <= 33, band <= 45],
+                           [rms_ratio, rms_ratio / 0.86, neutral / 0.86], neutral)
+        return 1.0 / np.maximum(design, rms_ratio)
+    
+    def evaluate(self):
+        buses, I1, Ih = self.bus_spectra()
+        orders = np.asarray(HARMONIC_ORDERS, dtype=float)
+        ratio = Ih / np.where(I1 > 0, I1, 1.0)[:, None]
+        thd = np.sqrt(np.sum(ratio ** 2, axis=1))
+        rms_ratio = np.sqrt(1.0 + thd ** 2)
+        # UL 1561 K-factor on rms-normalised currents, BS 7821 factor-K for standard transformers
+        k_factor = (1.0 + np.sum(ratio ** 2 * orders ** 2, axis=1)) / rms_ratio ** 2
+        factor_k = np.sqrt(1.0 + self.e / (1.0 + self.e) / rms_ratio ** 2 * np.sum(ratio ** 2 * orders ** self.q, axis=1))
+        third = ratio[:, HARMONIC_ORDERS.index(3)] * 100.0 if 3 in HARMONIC_ORDERS else np.zeros(len(buses))
+        table = pd.DataFrame({
+            'Bus (V)': buses.astype(int),
+            'I1 (A)': np.round(I1, 1),
+            'I rms (A)': np.round(I1 * rms_ratio, 1),
+            'THDi (%)': np.round(thd * 100.0, 1),
+            '3rd Harmonic (%)': np.round(third, 1),
+            'K-Factor': np.round(k_factor, 2),
+            'Factor-K': np.round(factor_k, 3),
+            'Transformer Derating (%)': np.round(100.0 / factor_k, 1),
+            'Cable Factor': np.round(self.cable_factor(rms_ratio, third), 3)
+        })
+        spectrum = pd.DataFrame(np.round(ratio * 100.0, 2), columns=[f"H{h}" for h in HARMONIC_ORDERS], index=buses.astype(int))
+        return {'table': table, 'spectrum': spectrum, 'loads': self.load_factors()}
+    
+    def load_factors(self):
+        # Cable factor of each harmonic-source load on its own circuit - linear loads keep their fundamental current
+        i1, ih = self.phasors()
+        ratio = np.abs(ih) / np.where(np.abs(i1) > 0, np.abs(i1), 1.0)[:, None]
+        thd = np.sqrt(np.sum(ratio ** 2, axis=1))
+        third = ratio[:, HARMONIC_ORDERS.index(3)] * 100.0 if 3 in HARMONIC_ORDERS else np.zeros(len(self.loads))
+        rows = thd > 0
+        return pd.DataFrame({
+            'Load': self.loads['Load'].astype(str)[rows],
+            'Bus (V)': self.loads['Bus (V)'].astype(int)[rows],
+            'Harmonic Source': self.loads['Harmonic Source'][rows],
+            'THDi (%)': np.round(thd[rows] * 100.0, 1),
+            '3rd Harmonic (%)': np.round(third[rows], 1),
+            'Cable Factor': np.round(self.cable_factor(np.sqrt(1.0 + thd[rows] ** 2), third[rows]), 3)
+        }).reset_index(drop=True)
+
+# ========== GENERATOR RATINGS ==========
+
+# Standard generator ratings
+GEN_RATINGS = [10, 15, 20, 30, 40, 50, 63, 75, 100, 125, 150, 200, 250, 315, 400, 500, 625, 750, 1000, 1250, 1500, 1875, 2000, 2500]
+
+def get_gen_rating(required_kva):
+    for rating in GEN_RATINGS:
+        if rating >= required_kva:
+            return rating
+    return GEN_RATINGS[-1]
+
+# ========== MOTOR STARTING SEQUENCE SIMULATION ==========
+
+# Orders simulated per block in the sequence search
+MOTOR_SEQ_CHUNK = 5000
+
+class MotorStartSequence:
+    def __init__(self, motors, base_kva, tx_kva, tx_z_pct, lv_voltage, gen_kva, gen_xd_pct,
+                 tx_limit=15.0, gen_limit=20.0):
+        # motors: Motor, kW, PF, Start Method, Start Time (s) - start time slots are kept, the order of motors is free
+        self.motors = motors.reset_index(drop=True)
+        kw = self.motors['kW'].to_numpy(dtype=float)
+        pf = self.motors['PF'].to_numpy(dtype=float)
+        self.run_kva = np.where(pf > 0, kw / np.where(pf > 0, pf, 1), kw)
+        self.start_kva = self.run_kva * self.motors['Start Method'].map(MOTOR_START_OPTIONS).fillna(MOTOR_START_OPTIONS["DOL"]).to_numpy() / 100.0
+        self.times = np.sort(self.motors['Start Time (s)'].to_numpy(dtype=float))
+        # Simultaneous starts share one step
+        self.step_starts = np.flatnonzero(np.r_[True, np.diff(self.times) > 0])
+        self.base_kva = base_kva
+        # Source impedances computed once: transformer short-circuit kVA and generator subtransient reactance
+        self.sc_kva = TransformerSizingCalculator.calc_motor_starting_vd(tx_kva, tx_z_pct, 0.0, 0.0, 0.0, 1.0, lv_voltage)['sc_kva']
+        self.gen_kva = gen_kva
+        self.gen_xd = gen_xd_pct / 100.0
+        self.tx_limit = tx_limit
+        self.gen_limit = gen_limit
+    
+    @property
+    def n_motors(self):
+        return len(self.run_kva)
+    
+    def evaluate(self, orders):
+        # orders: (n_orders, n_motors) permutations - motor orders[k, j] takes the j-th start slot
+        orders = np.atleast_2d(orders)
+        run = self.run_kva[orders]
+        start = np.add.reduceat(self.start_kva[orders], self.step_starts, axis=1)
+        running_before = self.base_kva + np.concatenate([np.zeros((len(orders), 1)), np.cumsum(run, axis=1)], axis=1)[:, self.step_starts]
+        # Transformer: as calc_motor_starting_vd, (running + starting kVA) / short-circuit kVA
+        tx_dip = (running_before + start) / self.sc_kva * 100.0
+        # Generator: subtransient voltage divider for the starting kVA step
+        gen_dip = self.gen_xd * start / (self.gen_kva + self.gen_xd * start) * 100.0
+        return tx_dip, gen_dip
+    
+    def candidate_orders(self, max_orders=5000, seed=None, chunk=MOTOR_SEQ_CHUNK):
+        # Yields blocks of at most chunk orders so memory stays bounded whatever max_orders is
+        n = self.n_motors
+        if math.factorial(n) <= max_orders:
+            perms = itertools.permutations(range(n))
+            while True:
+                block = np.array(list(itertools.islice(perms, chunk)), dtype=int)
+                if len(block) == 0:
+                    return
+                yield block
+        rng = np.random.default_rng(seed)
+        # Largest-first and as-entered orders always included, the rest sampled
+        fixed = np.vstack([np.argsort(-self.start_kva, kind='stable'), np.arange(n)])
+        yield fixed
+        left = max_orders - len(fixed)
+        while left > 0:
+            k = min(chunk, left)
+            yield rng.permuted(np.tile(np.arange(n), (k, 1)), axis=1)
+            left -= k
+    
+    def optimise(self, max_orders=5000, seed=None):
+        best, evaluated, n_feasible = None, 0, 0
+        for orders in self.candidate_orders(max_orders, seed):
+            tx_dip, gen_dip = self.evaluate(orders)
+            worst_tx = tx_dip.max(axis=1)
+            worst_gen = gen_dip.max(axis=1)
+            feasible = (worst_tx <= self.tx_limit) & (worst_gen <= self.gen_limit)
+            # Feasible first, then the smallest margin-normalised worst dip - running best over the chunks
+            score = np.maximum(worst_tx / self.tx_limit, worst_gen / self.gen_limit)
+            score = np.where(feasible, score, score + 1e6)
+            i = int(np.argmin(score))
+            if best is None or score[i] < best[0]:
+                best = (score[i], orders[i].copy(), float(worst_tx[i]), float(worst_gen[i]))
+            evaluated += len(orders)
+            n_feasible += int(feasible.sum())
+        as_entered = self.evaluate(np.arange(self.n_motors))
+        return {'order': best[1], 'evaluated': evaluated, 'feasible': n_feasible,
+                'worst_tx': best[2], 'worst_gen': best[3],
+                'table': self.steps_table(best[1]),
+                'as_entered_worst': (float(as_entered[0].max()), float(as_entered[1].max()))}
+    
+    def steps_table(self, order):
+        tx_dip, gen_dip = self.evaluate(order)
+        names = self.motors['Motor'].to_numpy()[order]
+        groups = np.split(np.arange(self.n_motors), self.step_starts[1:])
+        return pd.DataFrame({
+            'Step': np.arange(1, len(groups) + 1),
+            'Time (s)': self.times[self.step_starts],
+            'Motors Started': [", ".join(map(str, names[g])) for g in groups],
+            'Starting kVA': np.round(np.add.reduceat(self.start_kva[order], self.step_starts), 1),
+            'Transformer Dip (%)': np.round(tx_dip[0], 2),
+            'Generator Dip (%)': np.round(gen_dip[0], 2),
+            'Status': np.where((tx_dip[0] <= self.tx_limit) & (gen_dip[0] <= self.gen_limit), 'OK', 'EXCEEDS')
+        })
+
+# ========== GENERATOR STEP-LOAD TRANSIENT SIMULATION (ISO 8528-5) ==========
+
+# ISO 8528-5 performance class G2 limits for load acceptance
+ISO8528_G2_LIMITS = {'freq_dip': 10.0, 'volt_dip': 20.0, 'freq_recovery': 5.0, 'volt_recovery': 6.0,
+                     'freq_band': 3.5, 'volt_band': 2.0}
+
+class GeneratorTransientSimulator:
+    def __init__(self, ratings=None, xd_pct=15.0, H=1.0, T_engine=0.25, Kp=8.0, Ki=4.0, T_avr=0.4,
+                 rated_pf=0.8, overload=1.1, dt=0.01, limits=None):
+        self.ratings = np.asarray(GEN_RATINGS if ratings is None else ratings, dtype=float)
+        self.xd = xd_pct / 100.0
+        self.H = H
+        self.T_engine = T_engine
+        self.Kp = Kp
+        self.Ki = Ki
+        self.T_avr = T_avr
+        self.rated_pf = rated_pf
+        self.overload = overload
+        self.dt = dt
+        self.limits = dict(ISO8528_G2_LIMITS, **(limits or {}))
+    
+    def simulate(self, times, step_kw, step_kva, t_end):
+        # Fixed-step Euler, every candidate rating advanced together (per-unit on each rating)
+        dt = self.dt
+        n_t = int(round(t_end / dt)) + 1
+        kw_rating = self.ratings * self.rated_pf
+        idx = np.minimum(np.round(np.asarray(times) / dt).astype(int), n_t - 1)
+        load_kw = np.cumsum(np.bincount(idx, weights=step_kw, minlength=n_t))
+        pe = load_kw[:, None] / kw_rating[None, :]
+        # Subtransient dip on each step: Xd''·ΔS / (S + Xd''·ΔS)
+        dip = self.xd * np.asarray(step_kva)[:, None] / (self.ratings[None, :] + self.xd * np.asarray(step_kva)[:, None])
+        # Simultaneous steps combine into one voltage drop
+        dip_at = {}
+        for k, i in enumerate(idx):
+            dip_at[i] = dip_at.get(i, 1.0) * (1.0 - dip[k])
+        n_c = len(self.ratings)
+        f = np.ones(n_c)
+        v = np.ones(n_c)
+        pm = pe[0].copy()
+        xi = np.zeros(n_c)
+        f_hist = np.empty((n_t, n_c))
+        v_hist = np.empty((n_t, n_c))
+        for i in range(n_t):
+            if i in dip_at:
+                v = v * dip_at[i]
+            f_hist[i] = f
+            v_hist[i] = v
+            err = 1.0 - f
+            # Isochronous PI governor (clamped at the engine overload limit) driving a first-order engine lag
+            xi = np.clip(xi + self.Ki * err * dt, -self.overload, self.overload)
+            p_ref = np.clip(pe[0] + self.Kp * err + xi, 0.0, self.overload)
+            pm = pm + (p_ref - pm) * dt / self.T_engine
+            # Swing equation 2H·df/dt = Pm - Pe, AVR restoring terminal voltage
+            f = np.maximum(f + (pm - pe[i]) * dt / (2.0 * self.H), 0.0)
+            v = v + (1.0 - v) * dt / self.T_avr
+        return np.arange(n_t) * dt, f_hist, v_hist, load_kw
+    
+    def recovery_times(self, deviation, band, starts):
+        # Time from each step until the deviation stays inside the band (inf when it never settles)
+        out = deviation > band
+        bounds = np.r_[starts, len(out)]
+        rec = np.zeros((len(starts), out.shape[1]))
+        for k in range(len(starts)):
+            w = out[bounds[k]:bounds[k + 1]]
+            if len(w) == 0:
+                continue
+            last = len(w) - 1 - np.argmax(w[::-1], axis=0)
+            rec[k] = np.where(w.any(axis=0), (last + 1) * self.dt, 0.0)
+            rec[k][w[-1]] = np.inf
+        return rec
+    
+    def evaluate(self, steps, settle=15.0):
+        # steps: Time (s), Load (kW), Step kVA - load acceptance sequence
+        steps = steps.sort_values('Time (s)').reset_index(drop=True)
+        times = steps['Time (s)'].to_numpy(dtype=float)
+        step_kw = steps['Load (kW)'].to_numpy(dtype=float)
+        step_kva = steps['Step kVA'].to_numpy(dtype=float)
+        t, f, v, load_kw = self.simulate(times, step_kw, step_kva, times.max() + settle)
+        starts = np.unique(np.minimum(np.round(times / self.dt).astype(int), len(t) - 1))
+        f_dev = np.abs(1.0 - f) * 100.0
+        v_dev = np.abs(1.0 - v) * 100.0
+        lim = self.limits
+        freq_dip = (1.0 - f.min(axis=0)) * 100.0
+        volt_dip = (1.0 - v.min(axis=0)) * 100.0
+        freq_rec = self.recovery_times(f_dev, lim['freq_band'], starts).max(axis=0)
+        volt_rec = self.recovery_times(v_dev, lim['volt_band'], starts).max(axis=0)
+        loading = load_kw.max() / (self.ratings * self.rated_pf) * 100.0
+        checks = {'OVERLOAD': loading > 100.0, 'FREQ DIP': freq_dip > lim['freq_dip'],
+                  'VOLT DIP': volt_dip > lim['volt_dip'], 'FREQ RECOVERY': freq_rec > lim['freq_recovery'],
+                  'VOLT RECOVERY': volt_rec > lim['volt_recovery']}
+        fails = np.column_stack(list(checks.values()))
+        status = np.array([", ".join(np.array(list(checks))[row]) or "PASS" for row in fails])
+        ok = np.flatnonzero(~fails.any(axis=1))
+        best = int(ok[0]) if len(ok) else len(self.ratings) - 1
+        table = pd.DataFrame({
+            'Rating (kVA)': self.ratings.astype(int),
+            'Peak Loading (%)': np.round(loading, 1),
+            'Freq Dip (%)': np.round(freq_dip, 2),
+            'Freq Recovery (s)': np.round(freq_rec, 2),
+            'Volt Dip (%)': np.round(volt_dip, 2),
+            'Volt Recovery (s)': np.round(volt_rec, 2),
+            'Status': status
+        })
+        return {'table': table, 'selected_kva': int(self.ratings[best]) if len(ok) else None, 'best_index': best,
+                't': t, 'freq': f, 'volt': v}
+
+# ========== GENERATOR PARALLELING & N+1 SIZING ==========
+
+# Indicative installed cost per genset (economies of scale) and synchronising gear per paralleled unit
+GEN_UNIT_COST = {r: round(6000 + 180 * r ** 0.85, -2) for r in GEN_RATINGS}
+GEN_PARALLEL_COST_PER_UNIT = 4000.0
+
+class GeneratorParallelSizer:
+    def __init__(self, required_kva, starting_kva=0.0, xd_pct=15.0, dip_limit=20.0, redundancy=1,
+                 max_units=8, max_loading=100.0, unit_cost=None, parallel_cost=GEN_PARALLEL_COST_PER_UNIT):
+        self.required_kva = required_kva
+        self.starting_kva = starting_kva
+        self.xd = xd_pct / 100.0
+        self.dip_limit = dip_limit
+        self.redundancy = int(redundancy)
+        self.max_units = int(max_units)
+        self.max_loading = max_loading / 100.0
+        self.unit_cost = unit_cost or GEN_UNIT_COST
+        self.parallel_cost = parallel_cost
+        self._feasible = {}
+    
+    def cost(self, unit_kva, count):
+        return count * (self.unit_cost[unit_kva] + (self.parallel_cost if count > 1 else 0.0))
+    
+    def check(self, unit_kva, count):
+        # Cached per (unit size, count): the redundant units are assumed out of service
+        key = (unit_kva, count)
+        if key not in self._feasible:
+            firm = (count - self.redundancy) * unit_kva
+            loading = self.required_kva / firm * 100.0 if firm > 0 else np.inf
+            # Subtransient voltage divider with only the firm units online
+            dip = self.xd * self.starting_kva / (firm + self.xd * self.starting_kva) * 100.0 if firm > 0 else 100.0
+            self._feasible[key] = {'firm': firm, 'loading': loading, 'dip': dip,
+                                   'ok': firm > 0 and loading <= self.max_loading * 100.0 and dip <= self.dip_limit}
+        return self._feasible[key]
+    
+    def search(self, ratings=None, top_k=10):
+        ratings = sorted(ratings or GEN_RATINGS)
+        # Firm kVA needed for the running load and for the motor dip (Xd''·S·(1 - L)/L), whichever is larger
+        L = self.dip_limit / 100.0
+        firm_needed = max(self.required_kva / self.max_loading, self.xd * self.starting_kva * (1 - L) / L if L > 0 else np.inf)
+        found = []
+        evaluated = 0
+        cutoff = np.inf
+        # Cheapest lower bound first so the cost cutoff tightens early
+        bounds = [(self.cost(u, max(int(math.ceil(firm_needed / u - 1e-9)), 1) + self.redundancy), u) for u in ratings]
+        for lb, u in sorted(bounds):
+            if lb > cutoff:
+                break
+            n_min = max(int(math.ceil(firm_needed / u - 1e-9)), 1) + self.redundancy
+            for n in range(n_min, self.max_units + 1):
+                c = self.cost(u, n)
+                if c > cutoff:
+                    break
+                evaluated += 1
+                chk = self.check(u, n)
+                if chk['ok']:
+                    # More units of the same size only add cost
+                    found.append((c, u, n, chk))
+                    break
+            if len(found) >= top_k:
+                cutoff = sorted(f[0] for f in found)[top_k - 1]
+        
+        found = sorted(found, key=lambda f: (f[0], f[2]))[:top_k]
+        label = f"N+{self.redundancy}" if self.redundancy else "N"
+        table = pd.DataFrame({
+            'Configuration': [f"{n} x {u} kVA ({label})" for _, u, n, _ in found],
+            'Units': [n for _, _, n, _ in found],
+            'Unit (kVA)': [u for _, u, _, _ in found],
+            'Installed (kVA)': [n * u for _, u, n, _ in found],
+            'Firm (kVA)': [chk['firm'] for _, _, _, chk in found],
+            'Loading (%)': [round(chk['loading'], 1) for _, _, _, chk in found],
+            'Motor Dip (%)': [round(chk['dip'], 2) for _, _, _, chk in found],
+            'Cost': [round(c) for c, _, _, _ in found]
+        })
+        return {'table': table, 'evaluated': evaluated, 'combinations': len(ratings) * self.max_units}
 
 # ========== TEMPERATURE DERATING FACTORS ==========
 
@@ -1048,7 +1839,7 @@ class CircuitBreakerCalculator:
         
         return results, detailed_reasons
     
-    def calculate_main_cb_by_voltage(self, loads_df, design_factor=1.25):
+    def calculate_main_cb_by_voltage(self, loads_df, design_factor=1.25, harmonic_factors=None):
         voltage_groups = loads_df.groupby('Voltage (V)')
         
         results = {}
@@ -1075,6 +1866,8 @@ class CircuitBreakerCalculator:
                 current = total_power * 1000 / (1.732 * voltage * avg_pf)
                 system_type = "LV (Low Voltage)"
                 voltage_range = f"{int(voltage)}V"
+            # Bus feeder carries the summed harmonic rms / neutral current of the whole bus
+            current = current / (harmonic_factors or {}).get(int(voltage), 1.0)
             
             required = current * design_factor
             selected, _ = self.get_standard_rating(current, design_factor)
@@ -1148,6 +1941,1599 @@ FINAL SELECTION: {selected} A {breaker_type} for {voltage_range} System
         
         return results, detailed_reasons
 
+# ========== FAULT LEVEL PROPAGATION & BREAKING CAPACITY ==========
+
+# IEC 60909 voltage factor c_max for LV systems (+/-10% tolerance) and typical distribution transformer X/R
+FAULT_VOLTAGE_FACTOR = 1.10
+TX_XR_RATIO = 6.0
+# Standard ultimate breaking capacities Icu (kA) available per breaker type
+CB_BREAKING_CAPACITY_KA = {'MCB': [6, 10, 15, 25], 'MCCB': [25, 36, 50, 70, 100], 'ACB': [42, 65, 85, 100], 'MV Circuit Breaker': [25, 31.5, 40]}
+
+class FaultLevelPropagation:
+    def __init__(self, tx_kva, z_pct, lv_voltage=433, xr_ratio=TX_XR_RATIO, c_factor=FAULT_VOLTAGE_FACTOR):
+        self.lv_voltage = lv_voltage
+        self.c = c_factor
+        # Transformer short-circuit current from the sizing calculator, split into R + jX at the given X/R
+        self.sc_current_a = TransformerSizingCalculator.calc_motor_starting_vd(tx_kva, z_pct, 0.0, 0.0, 0.0, 1.0, lv_voltage)['sc_current_a']
+        z_tx = lv_voltage / (math.sqrt(3) * self.sc_current_a)
+        self.z_source = z_tx * complex(1.0, xr_ratio) / math.hypot(1.0, xr_ratio)
+    
+    @staticmethod
+    def cable_impedance(cable_type, size_mm2, phase, formation='flat'):
+        # mV/A/m from the BS 7671 tables; small sizes are tabulated as |Z| only and taken as resistive
+        vd = get_voltage_drop_values(cable_type, size_mm2, phase, formation)
+        if vd['type'] == 'rx':
+            return vd['R'], vd['X']
+        return vd['value'], 0.0
+    
+    def busbar_fault_ka(self):
+        return self.c * self.lv_voltage / (math.sqrt(3) * abs(self.z_source)) / 1000.0
+    
+    def feeder_faults(self, feeders):
+        # feeders: Load, Voltage (V), Phase, Cable Type, Size (mm²), Length (m), Formation, Selected CB (A), Breaker Type
+        rx = np.array([self.cable_impedance(f['Cable Type'], f['Size (mm²)'], f['Phase'], f.get('Formation', 'flat'))
+                       for _, f in feeders.iterrows()], dtype=float).reshape(-1, 2)
+        length = feeders['Length (m)'].to_numpy(dtype=float)
+        three_phase = (feeders['Phase'] == '3-phase').to_numpy()
+        fed = (feeders['Voltage (V)'].to_numpy(dtype=float) <= 1000)
+        # Three-phase mV/A/m are line values (divide by √3 for a phase); single-phase values already cover the loop
+        z_cable = (rx[:, 0] + 1j * rx[:, 1]) * length / 1000.0 / np.where(three_phase, math.sqrt(3), 1.0)
+        # Dyn transformer: phase-to-neutral fault at the terminals is close to the three-phase level
+        ik_load = np.where(fed, self.c * self.lv_voltage / math.sqrt(3) / np.abs(self.z_source + z_cable) / 1000.0, np.nan)
+        # The feeder breaker sits on the board, so it must break the full busbar fault
+        ik_board = np.where(fed, self.busbar_fault_ka(), np.nan)
+        
+        types = feeders['Breaker Type'].to_numpy()
+        icu = np.full(len(feeders), np.nan)
+        status = np.where(fed, "PASS", "N/A (MV)").astype(object)
+        for b_type, caps in CB_BREAKING_CAPACITY_KA.items():
+            sel = fed & (types == b_type)
+            if not sel.any():
+                continue
+            caps = np.asarray(caps, dtype=float)
+            i = np.searchsorted(caps, ik_board[sel])
+            icu[sel] = np.where(i >= len(caps), np.nan, caps[np.minimum(i, len(caps) - 1)])
+            status[sel] = np.where(i >= len(caps), "EXCEEDS " + b_type, "PASS")
+        return pd.DataFrame({
+            'Load': feeders['Load'].to_numpy(),
+            'Selected CB (A)': feeders['Selected CB (A)'].to_numpy(),
+            'Breaker Type': types,
+            'Cable': [f"{s} mm² x {l:g} m" for s, l in zip(feeders['Size (mm²)'], length)],
+            'Cable Z (mΩ)': np.round(np.abs(z_cable) * 1000.0, 2),
+            'Ik Board (kA)': np.round(ik_board, 2),
+            'Ik Load End (kA)': np.round(ik_load, 2),
+            'Selected Icu (kA)': icu,
+            'Status': status
+        })
+
+# ========== LIGHTNING STRIKE MONTE CARLO SIMULATION (IEC 62305-1 ANNEX A) ==========
+
+LPL_SPHERE_RADIUS = {"Class I": 20, "Class II": 30, "Class III": 45, "Class IV": 60}
+
+# First negative stroke peak current (kA) - IEC 62305-1 Table A.3, two-part log-normal (median, sigma_log10)
+STROKE_CURRENT_LOW = (61.1, 0.576)
+STROKE_CURRENT_HIGH = (33.3, 0.263)
+STROKE_CURRENT_BREAK_KA = 20.0
+# Below this many strikes the vectorised in-process path beats forking a worker pool from the script run
+STRIKE_MC_PARALLEL_MIN_SAMPLES = 5_000_000
+
+def _strike_chunk(task):
+    """Simulate one batch of strikes and count hits / bypasses per structure"""
+    seed_seq, n, bounds, cx, cy, half_l, half_w, h, sphere = task
+    rng = np.random.default_rng(seed_seq)
+    x = rng.uniform(bounds[0], bounds[2], n)
+    y = rng.uniform(bounds[1], bounds[3], n)
+    current = LightningStrikeSimulator.sample_peak_current(rng, n)
+    r = LightningStrikeSimulator.striking_distance(current)
+    
+    # Lateral attractive distance of each structure for each strike (n x structures)
+    r_col = r[:, None]
+    lateral = np.where(h < r_col, np.sqrt(np.maximum(2 * r_col * h - h**2, 0)), r_col)
+    dx = np.maximum(np.abs(x[:, None] - cx) - half_l, 0)
+    dy = np.maximum(np.abs(y[:, None] - cy) - half_w, 0)
+    margin = lateral - np.hypot(dx, dy)
+    
+    hit = margin.max(axis=1) >= 0
+    target = margin.argmax(axis=1)[hit]
+    bypass = r[hit] < sphere[target]
+    
+    n_struct = len(cx)
+    strikes = np.bincount(target, minlength=n_struct)
+    bypassed = np.bincount(target[bypass], minlength=n_struct)
+    return strikes, bypassed
+
+class LightningStrikeSimulator:
+    def __init__(self, structures, ng, margin=None):
+        # structures: list of dicts with name, x, y (centre, m), length, width, height and lpl (or None)
+        self.structures = structures
+        self.ng = ng
+        self.cx = np.array([s.get('x', 0.0) for s in structures], dtype=float)
+        self.cy = np.array([s.get('y', 0.0) for s in structures], dtype=float)
+        self.half_l = np.array([s['length'] for s in structures], dtype=float) / 2
+        self.half_w = np.array([s['width'] for s in structures], dtype=float) / 2
+        self.h = np.array([s['height'] for s in structures], dtype=float)
+        # Unprotected structures get an infinite sphere so every strike to them counts as a bypass
+        self.sphere = np.array([LPL_SPHERE_RADIUS.get(s.get('lpl'), np.inf) for s in structures], dtype=float)
+        if margin is None:
+            r_max = self.striking_distance(200.0)
+            margin = float(np.max(np.where(self.h < r_max, np.sqrt(np.maximum(2 * r_max * self.h - self.h**2, 0)), r_max)))
+        self.bounds = (float(np.min(self.cx - self.half_l)) - margin, float(np.min(self.cy - self.half_w)) - margin,
+                       float(np.max(self.cx + self.half_l)) + margin, float(np.max(self.cy + self.half_w)) + margin)
+        self.area_km2 = (self.bounds[2] - self.bounds[0]) * (self.bounds[3] - self.bounds[1]) * 1e-6
+    
+    @staticmethod
+    def striking_distance(current_ka):
+        # Electro-geometric model, IEC 62305-1 Annex A: r = 10 x I^0.65
+        return 10.0 * np.power(current_ka, 0.65)
+    
+    @staticmethod
+    def sample_peak_current(rng, n):
+        z = rng.standard_normal(n)
+        mu_lo, sig_lo = math.log(STROKE_CURRENT_LOW[0]), STROKE_CURRENT_LOW[1] * math.log(10)
+        mu_hi, sig_hi = math.log(STROKE_CURRENT_HIGH[0]), STROKE_CURRENT_HIGH[1] * math.log(10)
+        z_break = (math.log(STROKE_CURRENT_BREAK_KA) - mu_lo) / sig_lo
+        return np.where(z < z_break, np.exp(mu_lo + sig_lo * z), np.exp(mu_hi + sig_hi * z))
+    
+    @staticmethod
+    def current_cdf(current_ka):
+        mu_lo, sig_lo = math.log(STROKE_CURRENT_LOW[0]), STROKE_CURRENT_LOW[1] * math.log(10)
+        mu_hi, sig_hi = math.log(STROKE_CURRENT_HIGH[0]), STROKE_CURRENT_HIGH[1] * math.log(10)
+        if current_ka <= STROKE_CURRENT_BREAK_KA:
+            z = (math.log(current_ka) - mu_lo) / sig_lo
+        else:
+            z = (math.log(current_ka) - mu_hi) / sig_hi
+        return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+    
+    def run(self, n_samples=10_000_000, seed=0, chunk_size=500_000, workers=None):
+        n_chunks = max(1, math.ceil(n_samples / chunk_size))
+        seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+        tasks = []
+        for i, ss in enumerate(seeds):
+            n = min(chunk_size, n_samples - i * chunk_size)
+            tasks.append((ss, n, self.bounds, self.cx, self.cy, self.half_l, self.half_w, self.h, self.sphere))
+        
+        parts = None
+        if workers and workers > 1 and n_samples >= STRIKE_MC_PARALLEL_MIN_SAMPLES and len(tasks) > 1:
+            try:
+                ctx = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+                with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=ctx) as pool:
+                    parts = list(pool.map(_strike_chunk, tasks))
+            except (OSError, BrokenProcessPool):
+                parts = None
+        if parts is None:
+            parts = [_strike_chunk(t) for t in tasks]
+        
+        strikes = np.sum([p[0] for p in parts], axis=0)
+        bypassed = np.sum([p[1] for p in parts], axis=0)
+        years = n_samples / (self.ng * self.area_km2) if self.ng > 0 else float('inf')
+        
+        rows = []
+        for i, s in enumerate(self.structures):
+            lpl = s.get('lpl')
+            if lpl:
+                i_min = (self.sphere[i] / 10.0) ** (1 / 0.65)
+                iec_bypass = self.current_cdf(i_min)
+            else:
+                iec_bypass = 1.0
+            rows.append({
+                'Structure': s.get('name', f'Structure {i+1}'),
+                'Protection Level': lpl or 'None',
+                'Sphere (m)': self.sphere[i] if np.isfinite(self.sphere[i]) else None,
+                'Strikes': int(strikes[i]),
+                'Bypassed': int(bypassed[i]),
+                'Bypass Probability': bypassed[i] / strikes[i] if strikes[i] > 0 else 0.0,
+                'IEC Bypass (P(I < Imin))': iec_bypass,
+                'Nd simulated (/yr)': strikes[i] / years,
+                'Bypass Frequency (/yr)': bypassed[i] / years
+            })
+        return {
+            'table': pd.DataFrame(rows),
+            'samples': n_samples,
+            'years': years,
+            'area_km2': self.area_km2,
+            'bounds': self.bounds
+        }
+
+# ========== GROUND FLASH DENSITY MAP (GRIDDED NG / TD RASTER) ==========
+
+NG_MAP_CACHE_DIR = os.path.join(tempfile.gettempdir(), "ces_ng_maps")
+
+class GroundFlashDensityMap:
+    # Regular north-up grid: row 0 is the top edge (y_top), columns run east from x0
+    def __init__(self, grid, x0, y_top, dx, dy, kind='ng', source=''):
+        self.grid = grid
+        self.x0 = x0
+        self.y_top = y_top
+        self.dx = dx
+        self.dy = dy
+        self.kind = kind
+        self.source = source
+    
+    @staticmethod
+    def _read_ascii_grid(path):
+        # Header lines run until the first numeric token - NODATA_value is optional
+        header = {}
+        n_header = 0
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 2 or not parts[0][:1].isalpha():
+                    break
+                header[parts[0].lower()] = float(parts[1])
+                n_header += 1
+        grid = np.loadtxt(path, skiprows=n_header, dtype=np.float32, ndmin=2)
+        nodata = header.get('nodata_value')
+        if nodata is not None:
+            grid[grid == nodata] = np.nan
+        cell = header['cellsize']
+        # xllcenter / yllcenter give the centre of the lower-left cell
+        x0 = header['xllcorner'] if 'xllcorner' in header else header['xllcenter'] - cell / 2
+        y0 = header['yllcorner'] if 'yllcorner' in header else header['yllcenter'] - cell / 2
+        return grid, x0, y0 + header['nrows'] * cell, cell, cell
+    
+    @staticmethod
+    def _read_csv_grid(path):
+        # Long format: x, y, value on a regular spacing (cell centres)
+        pts = pd.read_csv(path)
+        pts.columns = [c.strip().lower() for c in pts.columns]
+        value_col = [c for c in pts.columns if c not in ('x', 'y')][0]
+        xs = np.unique(pts['x'].to_numpy(dtype=float))
+        ys = np.unique(pts['y'].to_numpy(dtype=float))
+        dx = float(np.min(np.diff(xs))) if len(xs) > 1 else 1.0
+        dy = float(np.min(np.diff(ys))) if len(ys) > 1 else 1.0
+        x0 = xs[0] - dx / 2
+        y_top = ys[-1] + dy / 2
+        cols = np.rint((pts['x'].to_numpy(dtype=float) - xs[0]) / dx).astype(int)
+        rows = np.rint((ys[-1] - pts['y'].to_numpy(dtype=float)) / dy).astype(int)
+        grid = np.full((rows.max() + 1, cols.max() + 1), np.nan, dtype=np.float32)
+        grid[rows, cols] = pts[value_col].to_numpy(dtype=np.float32)
+        return grid, x0, y_top, dx, dy
+    
+    @staticmethod
+    def _read_geotiff(path):
+        from PIL import Image
+        with Image.open(path) as img:
+            grid = np.asarray(img, dtype=np.float32)
+            tags = img.tag_v2
+            scale = tags.get(33550)       # ModelPixelScaleTag (sx, sy, sz)
+            tie = tags.get(33922)         # ModelTiepointTag (i, j, k, x, y, z)
+            nodata = tags.get(42113)      # GDAL_NODATA
+        if scale is None or tie is None:
+            raise ValueError("GeoTIFF has no ModelPixelScale/ModelTiepoint tags")
+        if nodata not in (None, ''):
+            grid = np.where(grid == float(str(nodata).strip('\x00')), np.nan, grid).astype(np.float32)
+        dx, dy = float(scale[0]), float(scale[1])
+        x0 = float(tie[3]) - float(tie[0]) * dx
+        y_top = float(tie[4]) + float(tie[1]) * dy
+        return grid, x0, y_top, dx, dy
+    
+    @classmethod
+    def from_file(cls, path, kind='ng', cache=None):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{kind}"
+        if cache is not None and key in cache:
+            return cache[key]
+        
+        os.makedirs(NG_MAP_CACHE_DIR, exist_ok=True)
+        stem = os.path.join(NG_MAP_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest())
+        if os.path.exists(stem + '.npy') and os.path.exists(stem + '.json'):
+            with open(stem + '.json') as f:
+                meta = json.load(f)
+        else:
+            ext = os.path.splitext(path)[1].lower()
+            if ext in ('.tif', '.tiff'):
+                grid, x0, y_top, dx, dy = cls._read_geotiff(path)
+            elif ext == '.csv':
+                grid, x0, y_top, dx, dy = cls._read_csv_grid(path)
+            else:
+                grid, x0, y_top, dx, dy = cls._read_ascii_grid(path)
+            np.save(stem + '.npy', np.ascontiguousarray(grid, dtype=np.float32))
+            meta = {'x0': x0, 'y_top': y_top, 'dx': dx, 'dy': dy}
+            with open(stem + '.json', 'w') as f:
+                json.dump(meta, f)
+        
+        grid = np.load(stem + '.npy', mmap_mode='r')
+        ng_map = cls(grid, meta['x0'], meta['y_top'], meta['dx'], meta['dy'], kind, path)
+        if cache is not None:
+            cache[key] = ng_map
+        return ng_map
+    
+    @property
+    def extent(self):
+        rows, cols = self.grid.shape
+        return (self.x0, self.y_top - rows * self.dy, self.x0 + cols * self.dx, self.y_top)
+    
+    def lookup(self, x, y):
+        # Direct cell index per coordinate - O(1) per structure, NaN outside the raster
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        rows, cols = self.grid.shape
+        col = np.floor((x - self.x0) / self.dx).astype(int)
+        row = np.floor((self.y_top - y) / self.dy).astype(int)
+        inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+        values = np.full(x.shape, np.nan)
+        values[inside] = self.grid[row[inside], col[inside]]
+        # Td rasters are converted with NG = 0.1 x Td (IEC 62305-2 Equation A.1)
+        return values * 0.1 if self.kind == 'td' else values
+
+# ========== LIGHTNING PROTECTION WHAT-IF SWEEP (IEC 62305-2) ==========
+
+ENVIRONMENT_CD = {"Surrounded": 0.25, "Similar height": 0.5, "Isolated": 1, "Hilltop": 2}
+
+# Probability of physical damage by LPS class - IEC 62305-2 Table B.2
+LPS_PB = {"None": 1.0, "Class IV": 0.2, "Class III": 0.1, "Class II": 0.05, "Class I": 0.02}
+
+# Probability of internal system failure with coordinated SPDs - IEC 62305-2 Table B.3
+SPD_PSPD = {"None": 1.0, "LPL III-IV": 0.05, "LPL II": 0.02, "LPL I": 0.01}
+
+# Fire protection reduction factor rp - IEC 62305-2 Table C.4
+FIRE_RP = {"None": 1.0, "Manual": 0.5, "Automatic": 0.2}
+
+DEFAULT_PROTECTION_COSTS = {
+    'lps': {"None": 0, "Class IV": 8000, "Class III": 10000, "Class II": 14000, "Class I": 20000},
+    'spd': {"None": 0, "LPL III-IV": 3000, "LPL II": 5000, "LPL I": 8000},
+    'fire': {"None": 0, "Manual": 2000, "Automatic": 12000}
+}
+
+class LightningRiskSweep:
+    def __init__(self, cache=None):
+        # Risk tables keyed per structure / environment set - costs are applied afterwards
+        self.cache = cache if cache is not None else {}
+    
+    @staticmethod
+    def collection_areas(length, width, height):
+        if width == 0:
+            ad = math.pi * 9 * height**2
+        else:
+            ad = length * width + 2 * (3 * height) * (length + width) + math.pi * (3 * height)**2
+        am = 2 * 500 * (length + width) + math.pi * 500**2
+        return ad, am
+    
+    def risk_table(self, length, width, height, ng, environments, c2_values, c3_values, c4_values, c5_values):
+        key = (round(length, 3), round(width, 3), round(height, 3), round(ng, 4), tuple(environments),
+               tuple(c2_values), tuple(c3_values), tuple(c4_values), tuple(c5_values))
+        if key in self.cache:
+            return self.cache[key]
+        
+        lps_names, spd_names, fire_names = list(LPS_PB), list(SPD_PSPD), list(FIRE_RP)
+        axes = [np.arange(len(lps_names)), np.arange(len(spd_names)), np.arange(len(fire_names)),
+                np.arange(len(environments)), np.asarray(c2_values, dtype=float), np.asarray(c3_values, dtype=float),
+                np.asarray(c4_values, dtype=float), np.asarray(c5_values, dtype=float)]
+        i_lps, i_spd, i_fire, i_env, c2, c3, c4, c5 = [a.ravel() for a in np.meshgrid(*axes, indexing='ij')]
+        
+        ad, am = self.collection_areas(length, width, height)
+        cd = np.array([ENVIRONMENT_CD[e] for e in environments], dtype=float)[i_env]
+        nd = ng * ad * cd * 1e-6
+        nc = 1e-4 / (cd * c2 * c3 * c4 * c5)
+        pb = np.array(list(LPS_PB.values()))[i_lps]
+        pspd = np.array(list(SPD_PSPD.values()))[i_spd]
+        rp = np.array(list(FIRE_RP.values()))[i_fire]
+        
+        # Residual damaging-event frequency: physical damage (RB ~ Nd.PB.rp) + internal systems (RC ~ Nd.PSPD)
+        r_physical = nd * pb * rp
+        r_internal = nd * pspd
+        residual = r_physical + r_internal
+        
+        table = pd.DataFrame({
+            'LPS': np.array(lps_names, dtype=object)[i_lps],
+            'SPD': np.array(spd_names, dtype=object)[i_spd],
+            'Fire Protection': np.array(fire_names, dtype=object)[i_fire],
+            'Environment': np.array(environments, dtype=object)[i_env],
+            'CD': cd, 'C2': c2, 'C3': c3, 'C4': c4, 'C5': c5,
+            'Nd (/yr)': nd,
+            'Nc Tolerable (/yr)': nc,
+            'R Physical (/yr)': r_physical,
+            'R Internal (/yr)': r_internal,
+            'Residual Risk (/yr)': residual,
+            'Risk Ratio': residual / nc,
+        })
+        self.cache[key] = table
+        return table
+    
+    @staticmethod
+    def apply_costs(table, costs):
+        out = table.copy()
+        out['Cost'] = (out['LPS'].map(costs['lps']).astype(float) + out['SPD'].map(costs['spd']).astype(float)
+                       + out['Fire Protection'].map(costs['fire']).astype(float))
+        out['Status'] = np.where(out['Residual Risk (/yr)'] <= out['Nc Tolerable (/yr)'], 'PASS', 'FAIL')
+        
+        # Pareto front per environment scenario: cheapest option for each attainable risk level
+        scenario = ['Environment', 'C2', 'C3', 'C4', 'C5']
+        out = out.sort_values(scenario + ['Cost', 'Residual Risk (/yr)']).reset_index(drop=True)
+        best_before = out.groupby(scenario)['Residual Risk (/yr)'].transform(lambda r: r.cummin().shift(fill_value=np.inf))
+        out['Pareto'] = out['Residual Risk (/yr)'] < best_before
+        return out
+    
+    def run(self, length, width, height, ng, costs=None, environments=None,
+            c2_values=(1.0,), c3_values=(3.0,), c4_values=(1.0,), c5_values=(5.0,), pareto_only=True):
+        table = self.risk_table(length, width, height, ng, list(environments or ENVIRONMENT_CD),
+                                c2_values, c3_values, c4_values, c5_values)
+        table = self.apply_costs(table, costs or DEFAULT_PROTECTION_COSTS)
+        return table[table['Pareto']].reset_index(drop=True) if pareto_only else table
+
+# ========== DOWN CONDUCTORS & SEPARATION DISTANCE (IEC 62305-3) ==========
+
+# Typical distance between down conductors (m) - IEC 62305-3 Table 4
+LPL_DOWN_CONDUCTOR_SPACING = {"Class I": 10, "Class II": 10, "Class III": 15, "Class IV": 20}
+
+# Maximum air-termination mesh size (m) - IEC 62305-3 Table 2
+LPL_MESH_SIZE = {"Class I": 5, "Class II": 10, "Class III": 15, "Class IV": 20}
+
+# Separation distance coefficients - IEC 62305-3 Tables 10 and 11
+LPL_KI = {"Class I": 0.08, "Class II": 0.06, "Class III": 0.04, "Class IV": 0.04}
+SEPARATION_KM = {"Air": 1.0, "Concrete/Bricks": 0.5}
+
+# 10/350 us first stroke approximated at the front-time equivalent frequency f = 1 / (4 x T1), T1 = 10 us
+IMPULSE_EQUIVALENT_FREQ_HZ = 25e3
+
+class LPSNetwork:
+    def __init__(self, length, width, height, lpl, conductor_mm2=50.0, resistivity=1.72e-8, earth_resistance=10.0,
+                 inductance_per_m=1.0e-6):
+        self.length, self.width, self.height, self.lpl = length, width, height, lpl
+        self.conductor_mm2 = conductor_mm2
+        self.resistivity = resistivity
+        self.earth_resistance = earth_resistance
+        self.inductance_per_m = inductance_per_m
+        
+        # Roof air-termination mesh nodes (row-major, i along length, j along width)
+        mesh = LPL_MESH_SIZE[lpl]
+        self.nx = max(2, math.ceil(length / mesh) + 1)
+        self.ny = max(1, math.ceil(width / mesh) + 1) if width > 0 else 1
+        gx = np.linspace(0, length, self.nx)
+        gy = np.linspace(0, width, self.ny)
+        self.node_x = np.repeat(gx, self.ny)
+        self.node_y = np.tile(gy, self.nx)
+        idx = np.arange(self.nx * self.ny).reshape(self.nx, self.ny)
+        self.edges = np.vstack([
+            np.column_stack([idx[:-1, :].ravel(), idx[1:, :].ravel()]),
+            np.column_stack([idx[:, :-1].ravel(), idx[:, 1:].ravel()])
+        ])
+        self.edge_length = np.hypot(self.node_x[self.edges[:, 0]] - self.node_x[self.edges[:, 1]],
+                                    self.node_y[self.edges[:, 0]] - self.node_y[self.edges[:, 1]])
+        
+        # Down conductors evenly spaced along the perimeter ring of the mesh
+        ring = self._perimeter_nodes(idx)
+        perimeter = 2 * (length + width)
+        n_dc = min(len(ring), max(2, math.ceil(perimeter / LPL_DOWN_CONDUCTOR_SPACING[lpl])))
+        picks = np.unique(np.floor(np.arange(n_dc) * len(ring) / n_dc).astype(int))
+        self.dc_nodes = ring[picks]
+        self.dc_resistance = np.full(len(self.dc_nodes), resistivity * height / (conductor_mm2 * 1e-6) + earth_resistance)
+    
+    @staticmethod
+    def _perimeter_nodes(idx):
+        nx, ny = idx.shape
+        if ny == 1:
+            return idx[:, 0]
+        return np.concatenate([idx[:, 0], idx[-1, 1:], idx[-2::-1, -1], idx[0, -2:0:-1]])
+    
+    @property
+    def n_nodes(self):
+        return len(self.node_x)
+    
+    @property
+    def n_down_conductors(self):
+        return len(self.dc_nodes)
+    
+    def nearest_node(self, x, y):
+        return int(np.argmin(np.hypot(self.node_x - x, self.node_y - y)))
+    
+    def edge_admittance(self, freq_hz=0.0):
+        omega = 2 * math.pi * freq_hz
+        length = np.maximum(self.edge_length, 1e-6)
+        r_edge = self.resistivity * length / (self.conductor_mm2 * 1e-6)
+        return 1.0 / (r_edge + 1j * omega * self.inductance_per_m * length) if freq_hz > 0 else 1.0 / r_edge
+    
+    def dc_impedance(self, freq_hz=0.0):
+        omega = 2 * math.pi * freq_hz
+        return self.dc_resistance + 1j * omega * self.inductance_per_m * self.height if freq_hz > 0 else self.dc_resistance
+    
+    def admittance_matrix(self, freq_hz=0.0):
+        # Nodal matrix Y = A' diag(1/Z) A for the roof mesh plus down-conductor branches to earth
+        y_edge = self.edge_admittance(freq_hz)
+        a, b = self.edges[:, 0], self.edges[:, 1]
+        rows = np.concatenate([a, b, a, b, self.dc_nodes])
+        cols = np.concatenate([a, b, b, a, self.dc_nodes])
+        vals = np.concatenate([y_edge, y_edge, -y_edge, -y_edge, 1.0 / self.dc_impedance(freq_hz)])
+        return sp.csc_matrix((vals, (rows, cols)), shape=(self.n_nodes, self.n_nodes))
+    
+    def conductance_matrix(self):
+        return self.admittance_matrix(0.0)
+    
+    def current_sharing(self, freq_hz=0.0):
+        # Column k: share of a 1 A strike at the top of down conductor k carried by each down conductor
+        lu = splu(self.admittance_matrix(freq_hz))
+        rhs = np.zeros((self.n_nodes, self.n_down_conductors), dtype=complex if freq_hz > 0 else float)
+        rhs[self.dc_nodes, np.arange(self.n_down_conductors)] = 1.0
+        v = lu.solve(rhs)
+        return np.abs(v[self.dc_nodes, :] / self.dc_impedance(freq_hz)[:, None])
+    
+    def kc(self, freq_hz=0.0):
+        # Worst case for each conductor: strike at its own top
+        return np.diag(self.current_sharing(freq_hz)).copy()
+
+class SeparationDistanceCalculator:
+    def __init__(self, network, freq_hz=IMPULSE_EQUIVALENT_FREQ_HZ):
+        self.network = network
+        self.kc_network = network.kc(freq_hz)
+        # Never below the IEC 62305-3 Annex C value for the same arrangement
+        self.kc_annex_c = self.annex_c_kc(network)
+        self.kc = np.minimum(np.maximum(self.kc_network, self.kc_annex_c), 1.0)
+        self.ki = LPL_KI[network.lpl]
+    
+    @staticmethod
+    def annex_c_kc(network):
+        # kc = 1/(2n) + 0.1 + 0.2 x (c/h)^(1/3), c = distance to the nearest down conductor (IEC 62305-3 Annex C)
+        n = network.n_down_conductors
+        x, y = network.node_x[network.dc_nodes], network.node_y[network.dc_nodes]
+        if n < 2:
+            return np.ones(n)
+        d = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+        np.fill_diagonal(d, np.inf)
+        c = d.min(axis=1)
+        return 1 / (2 * n) + 0.1 + 0.2 * np.cbrt(c / max(network.height, 1e-6))
+    
+    def down_conductor_table(self):
+        net = self.network
+        return pd.DataFrame({
+            'Down Conductor': [f'DC{i+1}' for i in range(net.n_down_conductors)],
+            'X (m)': np.round(net.node_x[net.dc_nodes], 2),
+            'Y (m)': np.round(net.node_y[net.dc_nodes], 2),
+            'kc (Network)': np.round(self.kc_network, 4),
+            'kc (Annex C)': np.round(self.kc_annex_c, 4),
+            'kc': np.round(self.kc, 4)
+        })
+    
+    def pair_matrices(self, x, y, z, km):
+        # s = ki x kc x l / km for every (down conductor, installation) pair, l measured down to ground bonding
+        net = self.network
+        dxy = np.hypot(net.node_x[net.dc_nodes][:, None] - x[None, :], net.node_y[net.dc_nodes][:, None] - y[None, :])
+        l = np.minimum(z, net.height)[None, :]
+        s_req = self.ki * self.kc[:, None] * l / km[None, :]
+        d = np.sqrt(dxy**2 + np.maximum(z - net.height, 0)[None, :]**2)
+        return s_req, d
+    
+    def evaluate(self, installations):
+        x = installations['X (m)'].to_numpy(dtype=float)
+        y = installations['Y (m)'].to_numpy(dtype=float)
+        z = installations['Z (m)'].to_numpy(dtype=float)
+        km = installations['Medium'].map(SEPARATION_KM).fillna(1.0).to_numpy(dtype=float)
+        s_req, d = self.pair_matrices(x, y, z, km)
+        
+        # Governing pair per installation: smallest margin d - s
+        gov = np.argmin(d - s_req, axis=0)
+        cols = np.arange(len(x))
+        s_gov, d_gov = s_req[gov, cols], d[gov, cols]
+        return pd.DataFrame({
+            'Installation': installations['Name'].to_numpy(),
+            'Governing DC': [f'DC{i+1}' for i in gov],
+            'kc': np.round(self.kc[gov], 4),
+            'l (m)': np.round(np.minimum(z, self.network.height), 2),
+            'km': km,
+            'Required s (m)': np.round(s_gov, 3),
+            'Actual d (m)': np.round(d_gov, 3),
+            'Status': np.where(d_gov >= s_gov, 'PASS', 'BOND / RELOCATE')
+        })
+
+# ========== LIGHTNING CURRENT DISTRIBUTION OVER THE LPS NETWORK ==========
+
+# First positive stroke peak current (kA) and specific energy (MJ/ohm) - IEC 62305-1 Table 3
+LPL_PEAK_CURRENT_KA = {"Class I": 200, "Class II": 150, "Class III": 100, "Class IV": 100}
+LPL_SPECIFIC_ENERGY = {"Class I": 10.0, "Class II": 5.6, "Class III": 2.5, "Class IV": 2.5}
+
+class LightningCurrentSolver:
+    def __init__(self, network, freq_hz=IMPULSE_EQUIVALENT_FREQ_HZ):
+        self.network = network
+        self.freq_hz = freq_hz
+        # One factorisation of the nodal matrix, reused for every strike point and LPL current level
+        self.lu = splu(network.admittance_matrix(freq_hz))
+        self.y_edge = network.edge_admittance(freq_hz)
+        self.z_dc = network.dc_impedance(freq_hz)
+    
+    def solve(self, strike_node):
+        net = self.network
+        levels = list(LPL_PEAK_CURRENT_KA)
+        rhs = np.zeros((net.n_nodes, len(levels)), dtype=complex)
+        rhs[strike_node, :] = [LPL_PEAK_CURRENT_KA[lvl] for lvl in levels]
+        v = self.lu.solve(rhs)
+        i_dc = np.abs(v[net.dc_nodes, :] / self.z_dc[:, None])
+        i_edge = np.abs((v[net.edges[:, 0], :] - v[net.edges[:, 1], :]) * self.y_edge[:, None])
+        share = i_dc[:, 0] / LPL_PEAK_CURRENT_KA[levels[0]]
+        
+        table = pd.DataFrame({
+            'Down Conductor': [f'DC{i+1}' for i in range(net.n_down_conductors)],
+            'X (m)': np.round(net.node_x[net.dc_nodes], 2),
+            'Y (m)': np.round(net.node_y[net.dc_nodes], 2),
+            'Current Share': np.round(share, 4),
+        })
+        for k, lvl in enumerate(levels):
+            table[f'{lvl} Peak (kA)'] = np.round(i_dc[:, k], 2)
+        # Same waveform in every branch, so W/R scales with the square of the share
+        table['W/R Class I (kJ/Ω)'] = np.round(share**2 * LPL_SPECIFIC_ENERGY["Class I"] * 1000, 1)
+        return {
+            'table': table,
+            'strike_node': strike_node,
+            'strike_xy': (float(net.node_x[strike_node]), float(net.node_y[strike_node])),
+            'max_share': float(share.max()),
+            'max_mesh_current_ka': {lvl: float(i_edge[:, k].max()) for k, lvl in enumerate(levels)}
+        }
+    
+    def kc(self):
+        return self.network.kc(self.freq_hz)
+
+# ========== ROD ARRAY RESISTANCE - MATRIX METHOD ==========
+
+class RodArraySolver:
+    def __init__(self):
+        pass
+    
+    @staticmethod
+    def line_layout(n, spacing):
+        return np.arange(n) * spacing, np.zeros(n)
+    
+    @staticmethod
+    def grid_layout(length, width, spacing):
+        gx = np.linspace(0, length, max(2, int(round(length / spacing)) + 1))
+        gy = np.linspace(0, width, max(2, int(round(width / spacing)) + 1))
+        x, y = np.meshgrid(gx, gy, indexing='ij')
+        return x.ravel(), y.ravel()
+    
+    @staticmethod
+    def perimeter_layout(length, width, spacing):
+        x, y = RodArraySolver.grid_layout(length, width, spacing)
+        edge = np.isclose(x, 0) | np.isclose(x, length) | np.isclose(y, 0) | np.isclose(y, width)
+        return x[edge], y[edge]
+    
+    @staticmethod
+    def ring_layout(n, radius):
+        theta = 2 * np.pi * np.arange(n) / n
+        return radius * np.cos(theta), radius * np.sin(theta)
+    
+    @staticmethod
+    def resistance_matrix(x, y, rho, L, d_m):
+        # Average-potential mutual resistance of two vertical rods driven from the surface:
+        # Rm = rho/(2piL) x [asinh(2L/D) - sqrt(1 + (D/2L)^2) + D/2L], diagonal = BS 7430 single rod Rr
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        D = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+        D = np.maximum(D, d_m / 2)
+        u = D / (2 * L)
+        R = rho / (2 * np.pi * L) * (np.arcsinh(1 / u) - np.sqrt(1 + u**2) + u)
+        np.fill_diagonal(R, rho / (2 * np.pi * L) * (math.log(8 * L / d_m) - 1))
+        return R
+    
+    @staticmethod
+    def equivalent_resistance(x, y, rho, L, d_m):
+        # All rods bonded (equal potential V): R.I = V.1  ->  Req = 1 / (1' R^-1 1)
+        R = RodArraySolver.resistance_matrix(x, y, rho, L, d_m)
+        ones = np.ones(len(R))
+        try:
+            currents = cho_solve(cho_factor(R, lower=True, check_finite=False), ones, check_finite=False)
+        except np.linalg.LinAlgError:
+            currents = np.linalg.solve(R, ones)
+        R_eq = 1.0 / currents.sum()
+        return {
+            'R': float(R_eq),
+            'n': len(R),
+            'Rr': float(R[0, 0]),
+            'current_share': currents / currents.sum(),
+            'utilisation': float(R[0, 0] / (len(R) * R_eq))
+        }
+
+# ========== EARTHING CALCULATOR (BS 7430 / IEEE 80) ==========
+
+EARTH_MAT_K = {"Copper": 226, "Aluminium": 148, "Steel": 78}
+EARTH_MAT_BETA = {"Copper": 234.5, "Aluminium": 228, "Steel": 202}
+EARTH_CONDUCTOR_SIZES = [16, 25, 35, 50, 70, 95, 120, 150, 185, 240, 300, 400]
+EARTH_RESISTANCE_LIMIT = 5.0
+EARTH_PLATE_AREA = 1.0
+
+# Group factor lambda for rods in a hollow square - BS 7430 Table 2
+HOLLOW_SQUARE_LAMBDA = {2: 2.71, 3: 4.51, 4: 5.46, 5: 6.14, 6: 6.63, 7: 7.03, 8: 7.30, 9: 7.65, 10: 7.90,
+                        12: 8.22, 14: 8.67, 16: 8.95, 18: 9.22, 20: 9.40}
+
+class EarthingCalculator:
+    def __init__(self):
+        pass
+    
+    @staticmethod
+    def conductor_size(mat, T1, T2, I_f, t_f):
+        K = EARTH_MAT_K[mat]; beta = EARTH_MAT_BETA[mat]
+        temp_ratio = (T2 + beta) / (T1 + beta)
+        k_val = K * math.sqrt(math.log(temp_ratio))
+        I_sqrt_t = I_f * 1000 * math.sqrt(t_f)
+        s_req = I_sqrt_t / k_val
+        sel_s = next((s for s in EARTH_CONDUCTOR_SIZES if s >= s_req), EARTH_CONDUCTOR_SIZES[-1])
+        return {
+            "mat": mat, "K": K, "beta": beta, "T1": T1, "T2": T2,
+            "k_val": round(k_val, 1), "I": I_f, "t": t_f,
+            "s_req": round(s_req, 1), "selected": sel_s,
+            "temp_ratio": temp_ratio, "sqrt_t": math.sqrt(t_f), "I_sqrt_t": I_sqrt_t
+        }
+    
+    @staticmethod
+    def conductor_sizes(mat, T1, T2, I_f, t_f):
+        # Adiabatic S = I x sqrt(t) / k broadcast over fault current (kA) and duration (s) arrays
+        K = EARTH_MAT_K[mat]; beta = EARTH_MAT_BETA[mat]
+        k_val = K * math.sqrt(math.log((T2 + beta) / (T1 + beta)))
+        I_f, t_f = np.broadcast_arrays(np.asarray(I_f, dtype=float), np.asarray(t_f, dtype=float))
+        s_req = I_f * 1000 * np.sqrt(t_f) / k_val
+        sizes = np.asarray(EARTH_CONDUCTOR_SIZES)
+        idx = np.searchsorted(sizes, s_req, side='left')
+        return {"k_val": k_val, "s_req": s_req, "selected": sizes[np.minimum(idx, len(sizes) - 1)], "adequate": idx < len(sizes)}
+    
+    @staticmethod
+    def conductor_size_sweep(mat, T1, T2, currents, durations):
+        I_g, t_g = np.meshgrid(np.asarray(currents, dtype=float), np.asarray(durations, dtype=float), indexing='ij')
+        res = EarthingCalculator.conductor_sizes(mat, T1, T2, I_g, t_g)
+        sel = np.where(res['adequate'], res['selected'], -1)
+        table = pd.DataFrame(sel, index=pd.Index(currents, name='I (kA)'), columns=[f"{t:g} s" for t in durations])
+        return table.replace(-1, f">{EARTH_CONDUCTOR_SIZES[-1]}")
+    
+    @staticmethod
+    def conductor_size_table(buses, T1, T2):
+        # buses: Bus, Material, I (kA), t (s) - one vectorised pass per material
+        out = buses.copy()
+        out['k'] = 0.0; out['S req (mm²)'] = 0.0; out['Selected (mm²)'] = 0; out['Status'] = ''
+        for mat, grp in out.groupby('Material'):
+            res = EarthingCalculator.conductor_sizes(mat, T1, T2, grp['I (kA)'].to_numpy(), grp['t (s)'].to_numpy())
+            out.loc[grp.index, 'k'] = round(res['k_val'], 1)
+            out.loc[grp.index, 'S req (mm²)'] = np.round(res['s_req'], 1)
+            out.loc[grp.index, 'Selected (mm²)'] = res['selected']
+            out.loc[grp.index, 'Status'] = np.where(res['adequate'], 'OK', 'PARALLEL CONDUCTORS')
+        return out
+    
+    @staticmethod
+    def rod_resistance(rho, L, d_m):
+        # Single rod - BS 7430 Section 9.5.3: Rr = rho/(2piL) x [ln(8L/d) - 1]
+        rho, L, d_m = np.asarray(rho, dtype=float), np.asarray(L, dtype=float), np.asarray(d_m, dtype=float)
+        ok = (L > 0) & (d_m > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ok, rho / (2 * np.pi * L) * (np.log(8 * L / d_m) - 1), 0.0)
+    
+    @staticmethod
+    def hollow_square_lambda(n):
+        # Rods per side below 1 (or not a number) give no group factor, as rod_resistance gives 0 for invalid rods
+        n = np.asarray(n, dtype=float)
+        ok = np.isfinite(n) & (n >= 1)
+        n = np.where(ok, n, 1).astype(int)
+        table = np.array([HOLLOW_SQUARE_LAMBDA.get(i, 5.46) for i in range(21)])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(ok, np.where(n <= 20, table[np.clip(n, 0, 20)], 2 * np.log(1.781 * n / 2.718)), 0.0)
+    
+    @staticmethod
+    def line_lambda(n):
+        # lambda = 2 x (1/2 + 1/3 + ... + 1/n) via the harmonic numbers H(n) - 1; 0 for fewer than one rod
+        n = np.asarray(n, dtype=int)
+        ok = n >= 1
+        n = np.where(ok, n, 1)
+        harmonic = np.concatenate([[0.0], np.cumsum(1.0 / np.arange(1, max(int(n.max(initial=1)), 1) + 1))])
+        return np.where(ok, 2 * (harmonic[n] - 1), 0.0)
+    
+    @staticmethod
+    def calculate_areas(areas):
+        # All areas of a method are evaluated together; intermediates are kept for the views and the report
+        n_areas = len(areas)
+        method = areas['Method'].to_numpy()
+        rho = areas['rho'].to_numpy(dtype=float); L = areas['L'].to_numpy(dtype=float)
+        d_m = areas['d'].to_numpy(dtype=float) / 1000.0; s = areas['s'].to_numpy(dtype=float)
+        pl = areas['Plot_L'].to_numpy(dtype=float); pw = areas['Plot_W'].to_numpy(dtype=float)
+        n_r = areas['n_rods'].to_numpy(dtype=float).astype(int)
+        
+        R = np.zeros(n_areas); lam = np.full(n_areas, np.nan); alpha = np.full(n_areas, np.nan)
+        N_val = np.full(n_areas, np.nan); ns = np.full(n_areas, np.nan); perim = np.full(n_areas, np.nan)
+        util = np.full(n_areas, np.nan); lam_alpha = np.full(n_areas, np.nan); two_pi_Rr_s = np.full(n_areas, np.nan)
+        lam_L_s = np.full(n_areas, np.nan); bracket = np.full(n_areas, np.nan)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Single rod terms shared by every rod method - BS 7430 Section 9.5.3
+            ok = (L > 0) & (d_m > 0)
+            two_pi_L = 2 * np.pi * L
+            eight_L_d = np.where(ok, 8 * L / d_m, np.nan)
+            ln8Ld = np.log(eight_L_d)
+            rho_2piL = np.where(ok, rho / two_pi_L, np.nan)
+            Rr = np.where(ok, rho_2piL * (ln8Ld - 1), 0.0)
+            
+            m = method == "Single Rod"
+            R[m] = Rr[m]
+            
+            m = method == "Hollow Square"
+            if m.any():
+                perim[m] = 2 * (pl[m] + pw[m])
+                N_val[m] = perim[m] / s[m]
+                ns[m] = N_val[m] / 4 + 1
+                lam[m] = EarthingCalculator.hollow_square_lambda(ns[m])
+                two_pi_Rr_s[m] = 2 * np.pi * Rr[m] * s[m]
+                alpha[m] = np.where(s[m] > 0, rho[m] / two_pi_Rr_s[m], 0.0)
+                lam_alpha[m] = lam[m] * alpha[m]
+                R[m] = Rr[m] * ((1 + lam_alpha[m]) / N_val[m])
+            
+            m = method == "Multiple Rods in Line"
+            if m.any():
+                lam[m] = EarthingCalculator.line_lambda(n_r[m])
+                lam_L_s[m] = lam[m] * L[m] / s[m]
+                bracket[m] = ln8Ld[m] - 1 + lam_L_s[m]
+                R[m] = np.where(n_r[m] >= 1, rho_2piL[m] * bracket[m] / np.maximum(n_r[m], 1), 0.0)
+            
+            m = method == "Plate Earthing"
+            sqrt_pi_A = math.sqrt(math.pi / EARTH_PLATE_AREA)
+            R[m] = (rho[m] / 4) * sqrt_pi_A
+        
+        # Rod grids need their own n x n mutual-resistance matrix each
+        for i in np.flatnonzero(method == "Rod Grid (Matrix)"):
+            x, y = RodArraySolver.grid_layout(pl[i], pw[i], s[i])
+            arr = RodArraySolver.equivalent_resistance(x, y, rho[i], L[i], d_m[i])
+            R[i] = arr['R']; N_val[i] = arr['n']; util[i] = arr['utilisation']
+        
+        results = pd.DataFrame({
+            "Area": areas['Name'].to_numpy(), "Method": method, "R": np.round(R, 3),
+            "Status": np.where(R < EARTH_RESISTANCE_LIMIT, "PASS", "FAIL")
+        })
+        details = pd.DataFrame({
+            "rho": rho, "L": L, "d": areas['d'].to_numpy(dtype=float), "d_m": d_m, "s": s,
+            "Plot_L": pl, "Plot_W": pw, "n_rods": n_r,
+            "two_pi_L": two_pi_L, "eight_L_d": eight_L_d, "ln8Ld": ln8Ld, "rho_2piL": rho_2piL,
+            "Rr": Rr, "lam": lam, "alpha": alpha, "two_pi_Rr_s": two_pi_Rr_s, "lam_alpha": lam_alpha,
+            "lam_L_s": lam_L_s, "bracket": bracket, "rho_4": rho / 4, "sqrt_pi_A": sqrt_pi_A, "N": N_val, "n": ns, "Perimeter": perim,
+            "Utilisation": util, "R": R
+        })
+        return results, details
+
+# Symbol sets for rendering an earthing trace on screen (unicode) or into the Word report (plain text)
+EARTH_TRACE_UNICODE = {'rho': 'ρ', 'pi': 'π', 'lam': 'λ', 'alpha': 'α', 'beta': 'β', 'sqrt': '√',
+                       'sum': 'Σ', 'ohm': 'Ω', 'm2': 'm²', 'mm2': 'mm²', 'degC': '°C', 'T1': 'T₁', 'T2': 'T₂',
+                       'Rtot': 'Rₜₒₜ', 'Rt': 'Rₜ', 'sq': '²', 'tr': 'ᵀ', 'inv': '⁻¹', 'to': '→'}
+EARTH_TRACE_TEXT = {'rho': 'rho', 'pi': 'pi', 'lam': 'lambda', 'alpha': 'alpha', 'beta': 'beta', 'sqrt': 'sqrt',
+                    'sum': 'Sum', 'ohm': 'ohm', 'm2': 'm2', 'mm2': 'mm2', 'degC': 'degC', 'T1': 'T1', 'T2': 'T2',
+                    'Rtot': 'RTOT', 'Rt': 'Rt', 'sq': '^2', 'tr': 'T', 'inv': '^-1', 'to': '->'}
+
+EARTH_METHOD_STANDARD = {
+    "Hollow Square": "BS 7430 Section 9.5.8.5 - Vertical rods in a hollow square",
+    "Multiple Rods in Line": "BS 7430 Section 9.5.4 - Multiple rods in a line",
+    "Single Rod": "BS 7430 Section 9.5.3 - Rod electrode",
+    "Rod Grid (Matrix)": "Rod grid - mutual resistance matrix method",
+    "Plate Earthing": "BS 7430 Section 9.5.2 - Plate electrode",
+}
+
+class EarthingTrace:
+    # One per area, built once per calculation from the stored intermediates; the Detailed tab and the
+    # Word report only format these values, they never recompute them
+    def __init__(self, area, method, R, status, values):
+        self.area = area
+        self.method = method
+        self.R = R
+        self.status = status
+        self.v = values
+    
+    @classmethod
+    def from_calculation(cls, results, details):
+        return [cls(row['Area'], row['Method'], row['R'], row['Status'], details.iloc[i].to_dict())
+                for i, row in results.reset_index(drop=True).iterrows()]
+    
+    @property
+    def standard(self):
+        return EARTH_METHOD_STANDARD.get(self.method, self.method)
+    
+    def inputs(self, S):
+        v = self.v
+        lines = [f"Soil Resistivity {S['rho']} = {v['rho']} {S['ohm']}.m"]
+        if self.method != "Plate Earthing":
+            lines += [f"Rod Length L = {v['L']} m", f"Rod Diameter d = {v['d']} mm ({v['d_m']:.4f} m)"]
+        if self.method == "Multiple Rods in Line":
+            lines += [f"Number of Rods n = {int(v['n_rods'])}", f"Rod Spacing s = {v['s']} m"]
+        elif self.method in ("Hollow Square", "Rod Grid (Matrix)"):
+            lines += [f"Rod Spacing s = {v['s']} m", f"Plot Plan: {v['Plot_L']:.0f}m x {v['Plot_W']:.0f}m"]
+        elif self.method == "Plate Earthing":
+            lines += [f"Plate Area A = {EARTH_PLATE_AREA:.1f} {S['m2']}"]
+        return lines
+    
+    def _rod_step(self, S, title):
+        v = self.v
+        return {'title': title, 'formula': f"Rr = {S['rho']}/(2{S['pi']}L) x [ln(8L/d) - 1]",
+                'lines': [f"Rr = {v['rho']}/(2{S['pi']} x {v['L']}) x [ln(8 x {v['L']}/{v['d_m']:.4f}) - 1]",
+                          f"Rr = {v['rho']}/{v['two_pi_L']:.3f} x [ln({v['eight_L_d']:.2f}) - 1]",
+                          f"Rr = {v['rho_2piL']:.3f} x [{v['ln8Ld']:.4f} - 1]"],
+                'result': f"Rr = {v['Rr']:.3f} {S['ohm']}"}
+    
+    def steps(self, S):
+        v = self.v
+        if self.method == "Hollow Square":
+            return [
+                {'title': "Step 1 - Perimeter and Number of Electrodes", 'formula': None,
+                 'lines': [f"Perimeter = 2 x (L + W) = 2 x ({v['Plot_L']:.0f} + {v['Plot_W']:.0f}) = {v['Perimeter']:.0f} m",
+                           f"N = Perimeter / s = {v['Perimeter']:.0f} / {v['s']} = {v['N']:.1f} electrodes",
+                           f"n = N/4 + 1 = {v['N']:.1f}/4 + 1 = {v['n']:.1f}"],
+                 'result': f"{S['lam']} (from Table 2, n={v['n']:.0f}) = {v['lam']:.3f}"},
+                self._rod_step(S, "Step 2 - Single Rod Resistance (BS 7430 Section 9.5.3)"),
+                {'title': f"Step 3 - Factor {S['alpha']}", 'formula': f"{S['alpha']} = {S['rho']}/(2{S['pi']} x Rr x s)",
+                 'lines': [f"{S['alpha']} = {v['rho']}/(2{S['pi']} x {v['Rr']:.3f} x {v['s']})",
+                           f"{S['alpha']} = {v['rho']}/{v['two_pi_Rr_s']:.3f}"],
+                 'result': f"{S['alpha']} = {v['alpha']:.4f}"},
+                {'title': "Step 4 - Total Resistance", 'formula': f"{S['Rtot']} = Rr x (1 + {S['lam']} x {S['alpha']}) / N",
+                 'lines': [f"{S['Rtot']} = {v['Rr']:.3f} x (1 + {v['lam']:.3f} x {v['alpha']:.4f}) / {v['N']:.1f}",
+                           f"{S['Rtot']} = {v['Rr']:.3f} x (1 + {v['lam_alpha']:.4f}) / {v['N']:.1f}",
+                           f"{S['Rtot']} = {v['Rr']:.3f} x {1 + v['lam_alpha']:.4f} / {v['N']:.1f}"],
+                 'result': f"{S['Rtot']} = {self.R} {S['ohm']}"},
+            ]
+        if self.method == "Multiple Rods in Line":
+            n_r = int(v['n_rods'])
+            parts = " + ".join(f"1/{i}" for i in range(2, n_r + 1))
+            return [
+                {'title': f"Step 1 - Group Factor {S['lam']}", 'formula': f"{S['lam']} = 2 x {S['sum']}(1/2 + 1/3 + ... + 1/n)",
+                 'lines': [f"{S['lam']} = 2 x ({parts})", f"{S['lam']} = 2 x {v['lam'] / 2:.5f}"],
+                 'result': f"{S['lam']} = {v['lam']:.5f}"},
+                self._rod_step(S, "Step 2 - Single Rod Resistance"),
+                {'title': "Step 3 - Total Resistance",
+                 'formula': f"{S['Rt']} = 1/n x {S['rho']}/(2{S['pi']}L) x [ln(8L/d) - 1 + {S['lam']} x L/s]",
+                 'lines': [f"{S['Rt']} = 1/{n_r} x {v['rho']}/(2{S['pi']} x {v['L']}) x [ln(8L/d) - 1 + {v['lam']:.5f} x {v['L']}/{v['s']}]",
+                           f"{S['Rt']} = 1/{n_r} x {v['rho_2piL']:.3f} x [{v['ln8Ld'] - 1:.4f} + {v['lam_L_s']:.4f}]",
+                           f"{S['Rt']} = 1/{n_r} x {v['rho_2piL']:.3f} x {v['bracket']:.4f}"],
+                 'result': f"{S['Rt']} = {self.R} {S['ohm']}"},
+            ]
+        if self.method == "Single Rod":
+            return [self._rod_step(S, "Single Rod Resistance")]
+        if self.method == "Rod Grid (Matrix)":
+            rod = self._rod_step(S, "Step 1 - Self Resistance")
+            return [
+                rod,
+                {'title': "Step 2 - Mutual Resistance",
+                 'formula': f"Rm = {S['rho']}/(2{S['pi']}L) x [asinh(2L/D) - {S['sqrt']}(1 + (D/2L){S['sq']}) + D/2L]",
+                 'lines': [f"{S['rho']}/(2{S['pi']}L) = {v['rho_2piL']:.3f} {S['ohm']}, evaluated for every rod pair of the {v['N']:.0f}-rod grid"],
+                 'result': None},
+                {'title': "Step 3 - Equivalent Resistance", 'formula': f"R = 1 / (1{S['tr']} R{S['inv']} 1)",
+                 'lines': [f"Utilisation Rr/(nR) = {v['Utilisation']:.3f}"],
+                 'result': f"R = {self.R} {S['ohm']}"},
+            ]
+        if self.method == "Plate Earthing":
+            return [{'title': "Plate Resistance", 'formula': f"R = {S['rho']}/4 x {S['sqrt']}({S['pi']}/A)",
+                     'lines': [f"R = {v['rho']}/4 x {S['sqrt']}({S['pi']}/{EARTH_PLATE_AREA:.1f})",
+                               f"R = {v['rho_4']:.3f} x {v['sqrt_pi_A']:.4f}"],
+                     'result': f"R = {self.R} {S['ohm']}"}]
+        return []
+    
+    def status_line(self, S):
+        ok = self.status == 'PASS'
+        return f"Status: {self.R} {S['ohm']} {'<' if ok else '>='} {EARTH_RESISTANCE_LIMIT:g} {S['ohm']} {S['to']} {'PASS' if ok else 'FAIL'}"
+    
+    @staticmethod
+    def conductor_steps(c, S):
+        return [
+            {'title': "Current Density Factor k", 'formula': f"k = K x {S['sqrt']}(ln(({S['T2']} + {S['beta']})/({S['T1']} + {S['beta']})))",
+             'lines': [f"k = {c['K']} x {S['sqrt']}(ln(({c['T2']} + {c['beta']})/({c['T1']} + {c['beta']})))",
+                       f"k = {c['K']} x {S['sqrt']}(ln({c['T2'] + c['beta']}/{c['T1'] + c['beta']}))",
+                       f"k = {c['K']} x {S['sqrt']}(ln({c['temp_ratio']:.4f}))"],
+             'result': f"k = {c['k_val']} A/{S['mm2']}"},
+            {'title': "Minimum Cross-Sectional Area s", 'formula': f"s = (I x 1000 x {S['sqrt']}(t)) / k",
+             'lines': [f"s = ({c['I']} x 1000 x {S['sqrt']}({c['t']})) / {c['k_val']}",
+                       f"s = ({c['I'] * 1000} x {c['sqrt_t']:.4f}) / {c['k_val']}",
+                       f"s = {c['I_sqrt_t']:.2f} / {c['k_val']}"],
+             'result': f"s = {c['s_req']} {S['mm2']}"},
+        ]
+
+# ========== SUBSTATION GROUNDING GRID DESIGN (IEEE 80) ==========
+
+# Body-weight constant for tolerable touch / step voltage - IEEE 80 Equations 29 to 33
+IEEE80_BODY_K = {50: 0.116, 70: 0.157}
+
+class GroundingGridDesigner:
+    def __init__(self):
+        pass
+    
+    @staticmethod
+    def conductor_diameter(size_mm2):
+        return 2 * np.sqrt(np.asarray(size_mm2, dtype=float) / np.pi) / 1000.0
+    
+    @staticmethod
+    def tolerable_voltages(rho, rho_s, h_s, t_s, body_kg=70):
+        rho, rho_s, h_s = np.asarray(rho, dtype=float), np.asarray(rho_s, dtype=float), np.asarray(h_s, dtype=float)
+        cs = np.where(h_s > 0, 1 - 0.09 * (1 - rho / rho_s) / (2 * h_s + 0.09), 1.0)
+        rho_top = np.where(h_s > 0, rho_s, rho)
+        k = IEEE80_BODY_K[body_kg] / np.sqrt(t_s)
+        return {'Cs': cs, 'E_touch': (1000 + 1.5 * cs * rho_top) * k, 'E_step': (1000 + 6.0 * cs * rho_top) * k}
+    
+    @staticmethod
+    def evaluate(Lx, Ly, spacing, h, d_c, n_rods, L_rod, rho, I_g):
+        # Every argument may be an array - designs are broadcast against each other
+        Lx, Ly, D = np.asarray(Lx, dtype=float), np.asarray(Ly, dtype=float), np.asarray(spacing, dtype=float)
+        h, d_c = np.asarray(h, dtype=float), np.asarray(d_c, dtype=float)
+        n_rods, L_rod = np.asarray(n_rods, dtype=float), np.asarray(L_rod, dtype=float)
+        rho, I_g = np.asarray(rho, dtype=float), np.asarray(I_g, dtype=float)
+        
+        n_x = np.round(Ly / D) + 1
+        n_y = np.round(Lx / D) + 1
+        L_C = n_x * Lx + n_y * Ly
+        L_R = n_rods * L_rod
+        L_T = L_C + L_R
+        A = Lx * Ly
+        L_p = 2 * (Lx + Ly)
+        
+        # Grid resistance - Sverak, IEEE 80 Equation 52
+        Rg = rho * (1 / L_T + 1 / np.sqrt(20 * A) * (1 + 1 / (1 + h * np.sqrt(20 / A))))
+        
+        # Geometric factors - IEEE 80 Equations 84 to 89 (rectangular grid: nc = nd = 1)
+        n = (2 * L_C / L_p) * np.sqrt(L_p / (4 * np.sqrt(A)))
+        Kh = np.sqrt(1 + h / 1.0)
+        Kii = np.where(n_rods > 0, 1.0, 1 / np.power(2 * n, 2 / n))
+        Km = 1 / (2 * np.pi) * (np.log(D**2 / (16 * h * d_c) + (D + 2 * h)**2 / (8 * D * d_c) - h / (4 * d_c))
+                                + Kii / Kh * np.log(8 / (np.pi * (2 * n - 1))))
+        Ki = 0.644 + 0.148 * n
+        L_M = np.where(n_rods > 0, L_C + (1.55 + 1.22 * L_rod / np.sqrt(Lx**2 + Ly**2)) * L_R, L_C + L_R)
+        Em = rho * Km * Ki * I_g / L_M
+        
+        Ks = 1 / np.pi * (1 / (2 * h) + 1 / (D + h) + 1 / D * (1 - np.power(0.5, n - 2)))
+        L_S = 0.75 * L_C + 0.85 * L_R
+        Es = rho * Ks * Ki * I_g / L_S
+        return {'L_C': L_C, 'L_R': L_R, 'L_T': L_T, 'A': A, 'Rg': Rg, 'GPR': I_g * Rg,
+                'n': n, 'Km': Km, 'Ki': Ki, 'Ks': Ks, 'Em': Em, 'Es': Es}
+    
+    @staticmethod
+    def rod_positions(Lx, Ly, n_rods):
+        # Rods spread evenly round the perimeter, starting at a corner
+        if n_rods <= 0:
+            return np.zeros(0), np.zeros(0)
+        p = np.arange(int(n_rods)) * 2 * (Lx + Ly) / n_rods
+        x = np.select([p < Lx, p < Lx + Ly, p < 2 * Lx + Ly], [p, Lx, 2 * Lx + Ly - p], 0.0)
+        y = np.select([p < Lx, p < Lx + Ly, p < 2 * Lx + Ly], [0.0, p - Lx, Ly], 2 * (Lx + Ly) - p)
+        return x, y
+    
+    @staticmethod
+    def line_sources(Lx, Ly, spacing, h, n_rods, L_rod, seg_len=1.0):
+        # Grid conductors and rods broken into short segments, each a point source at its midpoint
+        xs, ys, zs, ls = [], [], [], []
+        for y0 in np.linspace(0, Ly, int(round(Ly / spacing)) + 1):
+            k = max(1, int(math.ceil(Lx / seg_len)))
+            xs.append((np.arange(k) + 0.5) * Lx / k); ys.append(np.full(k, y0)); zs.append(np.full(k, h)); ls.append(np.full(k, Lx / k))
+        for x0 in np.linspace(0, Lx, int(round(Lx / spacing)) + 1):
+            k = max(1, int(math.ceil(Ly / seg_len)))
+            xs.append(np.full(k, x0)); ys.append((np.arange(k) + 0.5) * Ly / k); zs.append(np.full(k, h)); ls.append(np.full(k, Ly / k))
+        rx, ry = GroundingGridDesigner.rod_positions(Lx, Ly, n_rods)
+        if len(rx) and L_rod > 0:
+            k = max(1, int(math.ceil(L_rod / seg_len)))
+            xs.append(np.repeat(rx, k)); ys.append(np.repeat(ry, k))
+            zs.append(np.tile(h + (np.arange(k) + 0.5) * L_rod / k, len(rx))); ls.append(np.full(k * len(rx), L_rod / k))
+        return np.concatenate(xs), np.concatenate(ys), np.concatenate(zs), np.concatenate(ls)
+    
+    @staticmethod
+    def kernel(px, py, pz, sources, d_c=0.01):
+        # Potential per ampere (x 4pi/rho) at the points from each segment: point source + image in a half-space
+        sx, sy, sz, sl = sources
+        rxy2 = (px[:, None] - sx[None, :])**2 + (py[:, None] - sy[None, :])**2
+        r1 = np.sqrt(rxy2 + (pz[:, None] - sz[None, :])**2)
+        r2 = np.sqrt(rxy2 + (pz[:, None] + sz[None, :])**2)
+        # Own segment: mean of 1/r along a segment of length l seen from its midpoint at the conductor radius
+        near = r1 < sl[None, :] / 2
+        inv_r1 = np.where(near, (2 / sl[None, :]) * np.arcsinh(sl[None, :] / d_c), 1 / np.maximum(r1, d_c / 2))
+        return inv_r1 + 1 / r2
+    
+    @staticmethod
+    def potential_at(px, py, pz, sources, rho, currents, d_c=0.01, chunk=2048):
+        # Evaluated in chunks of points so memory stays bounded for large maps
+        out = np.empty(len(px))
+        for start in range(0, len(px), chunk):
+            stop = start + chunk
+            out[start:stop] = GroundingGridDesigner.kernel(px[start:stop], py[start:stop], pz[start:stop], sources, d_c) @ currents
+        return rho / (4 * np.pi) * out
+    
+    @staticmethod
+    def leakage_distribution(sources, d_c=0.01, max_segments=4000):
+        # Equipotential electrode: solve K.q = 1 for the segment leakage shares (uniform per metre if too large)
+        sx, sy, sz, sl = sources
+        if len(sx) > max_segments:
+            return sl / sl.sum()
+        K = GroundingGridDesigner.kernel(sx, sy, sz + d_c / 2, sources, d_c)
+        q = np.linalg.solve(0.5 * (K + K.T), np.ones(len(sx)))
+        return q / q.sum()
+    
+    @staticmethod
+    def surface_map(Lx, Ly, spacing, h, d_c, n_rods, L_rod, rho, gpr, nx=60, ny=60, margin=5.0, chunk=2048):
+        sources = GroundingGridDesigner.line_sources(Lx, Ly, spacing, h, n_rods, L_rod)
+        q = GroundingGridDesigner.leakage_distribution(sources, d_c)
+        # Scale the unit-current potentials so the mean conductor potential equals the GPR
+        v_cond = GroundingGridDesigner.potential_at(sources[0], sources[1], sources[2] + d_c / 2, sources, rho, q, d_c, chunk)
+        scale = gpr / v_cond.mean()
+        gx = np.linspace(-margin, Lx + margin, nx)
+        gy = np.linspace(-margin, Ly + margin, ny)
+        X, Y = np.meshgrid(gx, gy, indexing='ij')
+        V = GroundingGridDesigner.potential_at(X.ravel(), Y.ravel(), np.zeros(X.size), sources, rho, q, d_c, chunk).reshape(X.shape) * scale
+        
+        inside = (X >= 0) & (X <= Lx) & (Y >= 0) & (Y <= Ly)
+        touch = np.where(inside, gpr - V, np.nan)
+        gvx, gvy = np.gradient(V, gx, gy)
+        step = np.hypot(gvx, gvy) * 1.0
+        return {'x': gx, 'y': gy, 'V': V, 'touch': touch, 'step': step,
+                'max_touch': float(np.nanmax(touch)), 'max_step': float(step.max())}
+
+# ========== EARTHING LAYOUT OPTIMIZER ==========
+
+# Installed cost per metre of rod by diameter (mm), per rod / pit, and per metre of bare conductor
+EARTH_ROD_COST_PER_M = {12.7: 15.0, 14.2: 18.0, 16.0: 22.0, 19.0: 28.0, 25.0: 40.0}
+EARTH_PIT_COST = 60.0
+EARTH_CONDUCTOR_COST_PER_M = 12.0
+
+class EarthingLayoutOptimizer:
+    def __init__(self, rho, target_r=EARTH_RESISTANCE_LIMIT, plot_l=0.0, plot_w=0.0,
+                 rod_cost_per_m=None, pit_cost=EARTH_PIT_COST, conductor_cost_per_m=EARTH_CONDUCTOR_COST_PER_M, fault=None):
+        self.rho = rho
+        self.target_r = target_r
+        self.plot_l, self.plot_w = plot_l, plot_w
+        self.rod_cost_per_m = rod_cost_per_m or EARTH_ROD_COST_PER_M
+        self.pit_cost = pit_cost
+        self.conductor_cost_per_m = conductor_cost_per_m
+        # fault: {'I_g', 't_s', 'rho_s', 'h_s', 'h', 'd_c', 'body_kg'} - adds IEEE 80 touch/step limits for grids
+        self.fault = fault
+    
+    def candidates(self, methods, lengths, diameters, counts, spacings):
+        parts = []
+        for method in methods:
+            if method == "Single Rod":
+                L, d = np.meshgrid(lengths, diameters, indexing='ij')
+                n, s = np.ones(L.size), np.zeros(L.size)
+            elif method == "Multiple Rods in Line":
+                L, d, n, s = np.meshgrid(lengths, diameters, [c for c in counts if c >= 2], spacings, indexing='ij')
+            elif method == "Hollow Square":
+                if self.plot_l <= 0 or self.plot_w <= 0:
+                    continue
+                L, d, s = np.meshgrid(lengths, diameters, spacings, indexing='ij')
+                # Whole rods only: the spacing is closed up so the rods costed are the rods evaluated
+                n = np.ceil(2 * (self.plot_l + self.plot_w) / s)
+                s = 2 * (self.plot_l + self.plot_w) / n
+            elif method == "Grid (IEEE 80)":
+                if self.plot_l <= 0 or self.plot_w <= 0:
+                    continue
+                L, d, n, s = np.meshgrid(lengths, diameters, counts, spacings, indexing='ij')
+            else:
+                continue
+            parts.append(pd.DataFrame({'Method': method, 'L': np.ravel(L).astype(float), 'd': np.ravel(d).astype(float),
+                                       'n_rods': np.ravel(n).astype(int), 's': np.ravel(s).astype(float)}))
+        if not parts:
+            return pd.DataFrame(columns=['Method', 'L', 'd', 'n_rods', 's'])
+        cand = pd.concat(parts, ignore_index=True)
+        if self.plot_l > 0 and self.plot_w > 0:
+            # A line of rods has to fit around the plot boundary
+            too_long = (cand['Method'] == "Multiple Rods in Line") & ((cand['n_rods'] - 1) * cand['s'] > 2 * (self.plot_l + self.plot_w))
+            cand = cand[~too_long].reset_index(drop=True)
+        return cand
+    
+    def cost(self, cand):
+        rod_cost = cand['d'].map(self.rod_cost_per_m).fillna(max(self.rod_cost_per_m.values())).to_numpy()
+        rods = cand['n_rods'].to_numpy() * (cand['L'].to_numpy() * rod_cost + self.pit_cost)
+        method = cand['Method'].to_numpy()
+        s = cand['s'].to_numpy()
+        perim = 2 * (self.plot_l + self.plot_w)
+        n_x = np.round(self.plot_w / np.maximum(s, 1e-9)) + 1
+        n_y = np.round(self.plot_l / np.maximum(s, 1e-9)) + 1
+        conductor = np.select(
+            [method == "Multiple Rods in Line", method == "Hollow Square", method == "Grid (IEEE 80)"],
+            [(cand['n_rods'].to_numpy() - 1) * s, np.full(len(s), perim), n_x * self.plot_l + n_y * self.plot_w], 0.0)
+        return rods + conductor * self.conductor_cost_per_m
+    
+    def resistance_lower_bound(self, cand):
+        # Rods in parallel with no mutual interference - never above the true resistance
+        Rr = EarthingCalculator.rod_resistance(self.rho, cand['L'].to_numpy(), cand['d'].to_numpy() / 1000.0)
+        bound = Rr / np.maximum(cand['n_rods'].to_numpy(), 1)
+        # Grids are set by the mesh, not the rods: Sverak with unlimited conductor length (1/L_T -> 0)
+        A = self.plot_l * self.plot_w
+        if A > 0:
+            h = (self.fault or {}).get('h', 0.5)
+            grid_lb = self.rho / math.sqrt(20 * A) * (1 + 1 / (1 + h * math.sqrt(20 / A)))
+            bound = np.where(cand['Method'].to_numpy() == "Grid (IEEE 80)", grid_lb, bound)
+        return bound
+    
+    def evaluate(self, cand):
+        out = cand.copy()
+        out['R'] = np.nan; out['Em'] = np.nan; out['Es'] = np.nan
+        rods = out['Method'] != "Grid (IEEE 80)"
+        if rods.any():
+            areas = pd.DataFrame({
+                'Name': '', 'Method': out.loc[rods, 'Method'], 'rho': self.rho, 'L': out.loc[rods, 'L'],
+                'd': out.loc[rods, 'd'], 's': out.loc[rods, 's'], 'Plot_L': self.plot_l, 'Plot_W': self.plot_w,
+                'n_rods': out.loc[rods, 'n_rods']
+            })
+            out.loc[rods, 'R'] = EarthingCalculator.calculate_areas(areas)[1]['R'].to_numpy()
+        grid = ~rods
+        if grid.any():
+            f = self.fault or {}
+            ev = GroundingGridDesigner.evaluate(self.plot_l, self.plot_w, out.loc[grid, 's'].to_numpy(), f.get('h', 0.5),
+                                                f.get('d_c', 0.01), out.loc[grid, 'n_rods'].to_numpy(), out.loc[grid, 'L'].to_numpy(),
+                                                self.rho, f.get('I_g', 0.0))
+            out.loc[grid, 'R'] = ev['Rg']
+            # Mesh and step voltages only mean something with a fault current
+            if self.fault:
+                out.loc[grid, 'Em'] = ev['Em']; out.loc[grid, 'Es'] = ev['Es']
+        
+        feasible = out['R'].to_numpy() <= self.target_r
+        if self.fault:
+            tol = GroundingGridDesigner.tolerable_voltages(self.rho, self.fault['rho_s'], self.fault['h_s'],
+                                                           self.fault['t_s'], self.fault.get('body_kg', 70))
+            feasible &= ~grid.to_numpy() | ((out['Em'].to_numpy() <= tol['E_touch']) & (out['Es'].to_numpy() <= tol['E_step']))
+        out['Feasible'] = feasible
+        return out
+    
+    def search(self, methods=("Single Rod", "Multiple Rods in Line", "Hollow Square", "Grid (IEEE 80)"),
+               lengths=(1.2, 1.8, 2.4, 3.0, 3.6, 4.8, 6.0), diameters=tuple(EARTH_ROD_COST_PER_M),
+               counts=tuple(range(0, 61)), spacings=(2.0, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0, 12.0, 15.0, 20.0),
+               batch_size=4096, top_k=10):
+        cand = self.candidates(methods, lengths, diameters, counts, spacings)
+        cand['Cost'] = self.cost(cand)
+        cand['R_lb'] = self.resistance_lower_bound(cand)
+        total = len(cand)
+        # Branch and bound: cheapest first, skip anything whose optimistic resistance already misses the target
+        cand = cand[cand['R_lb'] <= self.target_r].sort_values('Cost', kind='stable').reset_index(drop=True)
+        
+        found = []
+        evaluated = 0
+        cost_cutoff = np.inf
+        for start in range(0, len(cand), batch_size):
+            batch = cand.iloc[start:start + batch_size]
+            batch = batch[batch['Cost'] <= cost_cutoff]
+            if batch.empty:
+                break
+            res = self.evaluate(batch)
+            evaluated += len(res)
+            found.append(res[res['Feasible']])
+            n_found = sum(len(f) for f in found)
+            if n_found >= top_k:
+                cost_cutoff = pd.concat(found)['Cost'].nsmallest(top_k).iloc[-1]
+        
+        best = pd.concat(found, ignore_index=True) if found else pd.DataFrame(columns=list(cand.columns) + ['R', 'Em', 'Es', 'Feasible'])
+        best = best.sort_values(['Cost', 'R']).head(top_k).reset_index(drop=True)
+        best = best.drop(columns=['R_lb', 'Feasible']).rename(columns={'L': 'L (m)', 'd': 'd (mm)', 's': 's (m)', 'n_rods': 'Rods'})
+        best['R'] = best['R'].astype(float).round(3)
+        return {'table': best, 'candidates': total, 'evaluated': evaluated}
+
+# ========== TWO-LAYER SOIL MODEL (WENNER SURVEY) ==========
+
+SOIL_MODEL_CACHE_DIR = os.path.join(tempfile.gettempdir(), "ces_soil_models")
+# Bump when the fit or the image series changes so stale cached models on disk are not reused
+SOIL_MODEL_VERSION = 2
+# Image terms are summed in blocks until the remaining tail |K|^n / (1 - |K|) drops below the tolerance
+SOIL_IMAGE_TERMS = 200
+SOIL_IMAGE_TOL = 1e-6
+SOIL_IMAGE_MAX_TERMS = 100_000
+
+class TwoLayerSoilModel:
+    def __init__(self, rho1, rho2, h, rms_pct=None):
+        self.rho1, self.rho2, self.h = rho1, rho2, h
+        self.rms_pct = rms_pct
+    
+    @property
+    def K(self):
+        return (self.rho2 - self.rho1) / (self.rho2 + self.rho1)
+    
+    @staticmethod
+    def apparent_resistivity(a, rho1, rho2, h, block=SOIL_IMAGE_TERMS, tol=SOIL_IMAGE_TOL):
+        # Wenner image series: rho_a = rho1 [1 + 4 sum K^n (1/sqrt(1+(2nh/a)^2) - 1/sqrt(4+(2nh/a)^2))]
+        a = np.asarray(a, dtype=float)
+        K = (rho2 - rho1) / (rho2 + rho1)
+        series = np.zeros_like(a)
+        start = 1
+        while True:
+            n = np.arange(start, start + block).reshape((-1,) + (1,) * a.ndim)
+            x = (2 * n * h / a) ** 2
+            series = series + np.sum(K ** n * (1 / np.sqrt(1 + x) - 1 / np.sqrt(4 + x)), axis=0)
+            start += block
+            # Each term is below |K|^n, so the tail after n terms is bounded by |K|^n / (1 - |K|)
+            if abs(K) ** (start - 1) < tol * (1 - abs(K)) or start > SOIL_IMAGE_MAX_TERMS:
+                break
+        return rho1 * (1 + 4 * series)
+    
+    @staticmethod
+    def survey_to_rho(survey):
+        a = survey['Spacing a (m)'].to_numpy(dtype=float)
+        if 'Resistance R (Ω)' in survey.columns:
+            rho_a = 2 * math.pi * a * survey['Resistance R (Ω)'].to_numpy(dtype=float)
+        else:
+            rho_a = survey['Apparent ρ (Ω.m)'].to_numpy(dtype=float)
+        ok = np.isfinite(a) & np.isfinite(rho_a) & (a > 0) & (rho_a > 0)
+        order = np.argsort(a[ok])
+        return a[ok][order], rho_a[ok][order]
+    
+    @staticmethod
+    def survey_key(a, rho_a):
+        data = np.round(np.column_stack([a, rho_a]), 6).tobytes()
+        return hashlib.sha1(f"v{SOIL_MODEL_VERSION}:".encode() + data).hexdigest()
+    
+    @classmethod
+    def fit(cls, a, rho_a, cache=None):
+        a = np.asarray(a, dtype=float)
+        rho_a = np.asarray(rho_a, dtype=float)
+        key = cls.survey_key(a, rho_a)
+        if cache is not None and key in cache:
+            return cache[key]
+        
+        os.makedirs(SOIL_MODEL_CACHE_DIR, exist_ok=True)
+        path = os.path.join(SOIL_MODEL_CACHE_DIR, key + '.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                model = cls(**json.load(f))
+        else:
+            model = cls._least_squares(a, rho_a)
+            with open(path, 'w') as f:
+                json.dump({'rho1': model.rho1, 'rho2': model.rho2, 'h': model.h, 'rms_pct': model.rms_pct}, f)
+        if cache is not None:
+            cache[key] = model
+        return model
+    
+    @classmethod
+    def _least_squares(cls, a, rho_a):
+        # Fit in log space so shallow and deep readings carry equal weight; a few starting depths avoid local minima
+        def residual(p):
+            return np.log(cls.apparent_resistivity(a, math.exp(p[0]), math.exp(p[1]), math.exp(p[2]))) - np.log(rho_a)
+        
+        lo = [math.log(rho_a.min() / 10), math.log(rho_a.min() / 10), math.log(0.05)]
+        hi = [math.log(rho_a.max() * 10), math.log(rho_a.max() * 10), math.log(a.max() * 5)]
+        best = None
+        for h0 in np.geomspace(a.min(), a.max(), 4):
+            p0 = np.clip([math.log(rho_a[0]), math.log(rho_a[-1]), math.log(h0)], lo, hi)
+            sol = least_squares(residual, p0, bounds=(lo, hi), method='trf')
+            if best is None or sol.cost < best.cost:
+                best = sol
+        rho1, rho2, h = np.exp(best.x)
+        rms = float(np.sqrt(np.mean(np.expm1(best.fun) ** 2)) * 100)
+        return cls(float(rho1), float(rho2), float(h), rms)
+    
+    def equivalent_rho(self, depth):
+        # Parallel-layer average (horizontal current through both layers) over the electrode depth - rod or grid wholly in the top layer sees rho1
+        depth = np.asarray(depth, dtype=float)
+        deep = depth > self.h
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho_eq = np.where(deep, depth / (self.h / self.rho1 + (depth - self.h) / self.rho2), self.rho1)
+        return rho_eq if rho_eq.ndim else float(rho_eq)
+    
+    def curve(self, a):
+        return self.apparent_resistivity(a, self.rho1, self.rho2, self.h)
+
+# ========== EARTH POTENTIAL RISE MAP EXPORT ==========
+
+# Kernel elements (points x segments) evaluated per chunk - about 64 MB of float64 working arrays
+EPR_MAP_CHUNK_ELEMENTS = 2_000_000
+# IEEE 80 touch reach: a person standing up to 1 m from the electrode footprint
+TOUCH_REACH_M = 1.0
+
+class EarthPotentialMap:
+    def __init__(self):
+        pass
+    
+    @staticmethod
+    def rod_sources(x, y, L, seg_len=1.0, top=0.0):
+        # Vertical rods driven from the surface, each split into segments along its length
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        k = max(1, int(math.ceil(L / seg_len)))
+        z = top + (np.arange(k) + 0.5) * L / k
+        return np.repeat(x, k), np.repeat(y, k), np.tile(z, len(x)), np.full(k * len(x), L / k)
+    
+    @staticmethod
+    def area_sources(area, seg_len=1.0):
+        method = area['Method']
+        L = float(area['L']); s = float(area['s'])
+        if method == "Multiple Rods in Line":
+            x, y = RodArraySolver.line_layout(int(area['n_rods']), s)
+        elif method == "Hollow Square":
+            x, y = RodArraySolver.perimeter_layout(float(area['Plot_L']), float(area['Plot_W']), s)
+        elif method == "Rod Grid (Matrix)":
+            x, y = RodArraySolver.grid_layout(float(area['Plot_L']), float(area['Plot_W']), s)
+        elif method == "Plate Earthing":
+            # 1 m plate set on edge, represented as a short vertical electrode below 0.6 m cover
+            return EarthPotentialMap.rod_sources([0.0], [0.0], 1.0, 0.25, top=0.6)
+        else:
+            x, y = np.zeros(1), np.zeros(1)
+        return EarthPotentialMap.rod_sources(x, y, L, seg_len)
+    
+    @staticmethod
+    def compute(sources, rho, gpr, nx=200, ny=200, margin=10.0, d_c=0.016):
+        sx, sy = sources[0], sources[1]
+        q = GroundingGridDesigner.leakage_distribution(sources, d_c)
+        chunk = max(64, EPR_MAP_CHUNK_ELEMENTS // len(sx))
+        v_cond = GroundingGridDesigner.potential_at(sx, sy, sources[2] + d_c / 2, sources, rho, q, d_c, chunk)
+        scale = gpr / v_cond.mean()
+        
+        gx = np.linspace(sx.min() - margin, sx.max() + margin, nx)
+        gy = np.linspace(sy.min() - margin, sy.max() + margin, ny)
+        # Row blocks keep only one chunk of kernel values alive; the map itself is float32
+        V = np.empty((ny, nx), dtype=np.float32)
+        rows = max(1, chunk // nx)
+        for r0 in range(0, ny, rows):
+            r1 = min(ny, r0 + rows)
+            X, Y = np.meshgrid(gx, gy[r0:r1])
+            V[r0:r1] = GroundingGridDesigner.potential_at(X.ravel(), Y.ravel(), np.zeros(X.size), sources, rho, q, d_c, chunk).reshape(X.shape) * scale
+        
+        gvy, gvx = np.gradient(V, gy, gx)
+        step = np.hypot(gvx, gvy).astype(np.float32)
+        # Touch zone: electrode footprint plus the reach, and at least half a map cell so it is never empty
+        rx = max(TOUCH_REACH_M, 0.5 * (gx[1] - gx[0]))
+        ry = max(TOUCH_REACH_M, 0.5 * (gy[1] - gy[0]))
+        inside = ((gx[None, :] >= sx.min() - rx) & (gx[None, :] <= sx.max() + rx) &
+                  (gy[:, None] >= sy.min() - ry) & (gy[:, None] <= sy.max() + ry))
+        return {'x': gx, 'y': gy, 'V': V, 'step': step, 'gpr': gpr,
+                'max_touch': float(gpr - V[inside].min()),
+                'max_step': float(step.max())}
+    
+    @staticmethod
+    def save_npz(path, result):
+        np.savez_compressed(path, x=result['x'], y=result['y'], V=result['V'], step=result['step'], gpr=result['gpr'])
+        return path
+    
+    @staticmethod
+    def colourise(V, vmin=None, vmax=None):
+        # Blue (low) - green - red (high) ramp; rows flipped so north is up in the image
+        vmin = float(np.nanmin(V)) if vmin is None else vmin
+        vmax = float(np.nanmax(V)) if vmax is None else vmax
+        t = np.clip((V - vmin) / max(vmax - vmin, 1e-12), 0, 1)[::-1]
+        rgb = np.empty(t.shape + (3,), dtype=np.uint8)
+        rgb[..., 0] = np.clip(510 * t - 255, 0, 255)
+        rgb[..., 1] = 255 - np.abs(510 * t - 255)
+        rgb[..., 2] = np.clip(255 - 510 * t, 0, 255)
+        return rgb
+    
+    @staticmethod
+    def save_png(path, result):
+        from PIL import Image
+        Image.fromarray(EarthPotentialMap.colourise(result['V'], 0.0, result['gpr'])).save(path, optimize=True)
+        return path
+
+# ========== SEASONAL SOIL RESISTIVITY MONTE CARLO ==========
+
+# Monthly multipliers on the surveyed resistivity (dry pre-monsoon peak, wet monsoon trough)
+SEASONAL_RHO_FACTORS = {'Jan': 1.0, 'Feb': 1.0, 'Mar': 1.1, 'Apr': 1.3, 'May': 1.5, 'Jun': 1.6,
+                        'Jul': 1.1, 'Aug': 0.9, 'Sep': 1.0, 'Oct': 1.1, 'Nov': 1.1, 'Dec': 1.0}
+# Log-spaced bins on R / R_nominal for chunked percentiles
+RHO_FACTOR_BINS = np.geomspace(0.01, 100.0, 2001)
+
+class EarthingReliabilityMC:
+    def __init__(self, results, details, cov, seasonal=None, limit=EARTH_RESISTANCE_LIMIT):
+        # Every method is linear in rho, so R per sample is R_nominal x (sampled rho / nominal rho)
+        self.names = results['Area'].to_numpy()
+        self.methods = results['Method'].to_numpy()
+        self.rho = details['rho'].to_numpy(dtype=float)
+        self.R = details['R'].to_numpy(dtype=float)
+        self.cov = np.broadcast_to(np.asarray(cov, dtype=float), self.R.shape)
+        self.seasonal = None if seasonal is None else np.asarray(list(seasonal.values()) if isinstance(seasonal, dict) else seasonal, dtype=float)
+        self.limit = limit
+    
+    def sample_log_factors(self, rng, n):
+        # Lognormal scatter with unit mean per area, times one season drawn per sample (common to the whole site)
+        sigma = np.sqrt(np.log1p(self.cov**2)).astype(np.float32)
+        log_f = rng.standard_normal((n, len(self.R)), dtype=np.float32) * sigma - sigma**2 / 2
+        if self.seasonal is not None:
+            log_f += np.log(self.seasonal).astype(np.float32)[rng.integers(0, len(self.seasonal), n)][:, None]
+        return log_f
+    
+    def run(self, n_samples=100_000, seed=None, chunk_elements=4_000_000):
+        n_areas = len(self.R)
+        rng = np.random.default_rng(seed)
+        chunk = max(1, chunk_elements // max(n_areas, 1))
+        nb = len(RHO_FACTOR_BINS) + 1
+        log_lo = math.log(RHO_FACTOR_BINS[0])
+        dlog = math.log(RHO_FACTOR_BINS[1] / RHO_FACTOR_BINS[0])
+        with np.errstate(divide='ignore'):
+            # R >= limit  <=>  log(f) >= log(limit / R_nominal)
+            log_thresh = np.log(self.limit / self.R).astype(np.float32)
+        inv_R = np.where(self.R > 0, 1 / np.where(self.R > 0, self.R, 1), 0.0).astype(np.float32)
+        exceed = np.zeros(n_areas); total = np.zeros(n_areas); peak = np.full(n_areas, -np.inf)
+        counts = np.zeros(n_areas * nb, dtype=np.int64)
+        sys_exceed = 0
+        offsets = np.arange(n_areas) * nb
+        
+        for start in range(0, n_samples, chunk):
+            m = min(chunk, n_samples - start)
+            log_f = self.sample_log_factors(rng, m)
+            exceed += (log_f >= log_thresh).sum(axis=0)
+            peak = np.maximum(peak, log_f.max(axis=0))
+            idx = np.clip(np.floor((log_f - log_lo) / dlog) + 1, 0, nb - 1).astype(np.int64)
+            counts += np.bincount((idx + offsets).ravel(), minlength=n_areas * nb)
+            # Bonded site: 1/R_sys = sum over areas of 1/(R_nominal f)
+            inv_f = np.exp(-log_f)
+            sys_exceed += int((inv_f @ inv_R <= 1 / self.limit).sum())
+            total += (1 / inv_f).sum(axis=0)
+            del log_f, idx, inv_f
+        
+        # 95th percentile from the per-area histogram of R / R_nominal (upper bin edge)
+        cdf = np.cumsum(counts.reshape(n_areas, nb), axis=1) / n_samples
+        edges = np.append(RHO_FACTOR_BINS, RHO_FACTOR_BINS[-1])
+        p95 = edges[np.argmax(cdf >= 0.95, axis=1)] * self.R
+        
+        table = pd.DataFrame({
+            'Area': self.names, 'Method': self.methods, 'ρ nominal (Ω.m)': self.rho,
+            'R nominal (Ω)': np.round(self.R, 3), 'Mean R (Ω)': np.round(total / n_samples * self.R, 3),
+            'P95 R (Ω)': np.round(p95, 3), 'Max R (Ω)': np.round(np.exp(peak) * self.R, 3),
+            f'P(R ≥ {self.limit:g} Ω)': np.round(exceed / n_samples, 5)
+        })
+        return {'table': table, 'samples': n_samples, 'system_exceed': sys_exceed / n_samples}
+
+# ========== EARTHING BONDING NETWORK ==========
+
+# Conductor resistivity at 20 degC (ohm.m) for buried bonding conductors
+EARTH_MAT_RESISTIVITY = {"Copper": 1.72e-8, "Aluminium": 2.82e-8, "Steel": 1.38e-7}
+# Bonding continuity between an area and the main earthing terminal
+BONDING_CONTINUITY_LIMIT = 0.2
+
+class EarthBondingNetwork:
+    def __init__(self, names, R_area, links):
+        # links: From, To, Length (m), Size (mm²), Material - area names as node labels
+        self.names = list(names)
+        # Links refer to areas by name, so names must be unique or links would merge onto one node
+        dup = sorted({str(n) for n in pd.Index(self.names)[pd.Index(self.names).duplicated()]})
+        if dup:
+            raise ValueError(f"Area names must be unique for the bonding network - duplicated: {', '.join(dup)}")
+        self.R_area = np.asarray(R_area, dtype=float)
+        index = {n: i for i, n in enumerate(self.names)}
+        links = links[links['From'].isin(index) & links['To'].isin(index) & (links['From'] != links['To'])]
+        self.links = links.reset_index(drop=True)
+        self.i = self.links['From'].map(index).to_numpy(dtype=int)
+        self.j = self.links['To'].map(index).to_numpy(dtype=int)
+        rho_c = self.links['Material'].map(EARTH_MAT_RESISTIVITY).fillna(EARTH_MAT_RESISTIVITY["Copper"]).to_numpy()
+        self.R_link = rho_c * self.links['Length (m)'].to_numpy(dtype=float) / (self.links['Size (mm²)'].to_numpy(dtype=float) * 1e-6)
+    
+    @property
+    def n_nodes(self):
+        return len(self.names)
+    
+    def laplacian(self):
+        # Conductor-only nodal matrix: series resistance of every bonding link
+        g = 1 / np.maximum(self.R_link, 1e-12)
+        n = self.n_nodes
+        rows = np.concatenate([self.i, self.j, self.i, self.j])
+        cols = np.concatenate([self.j, self.i, self.i, self.j])
+        vals = np.concatenate([-g, -g, g, g])
+        return sp.csc_matrix((vals, (rows, cols)), shape=(n, n))
+    
+    def earth_conductance(self):
+        # Zero, negative or infinite area resistance ties nothing to remote earth
+        ok = (self.R_area > 0) & np.isfinite(self.R_area)
+        return np.where(ok, 1 / np.where(ok, self.R_area, 1), 0.0)
+    
+    def conductance_matrix(self):
+        # Each area electrode ties its node to remote earth
+        return (self.laplacian() + sp.diags(self.earth_conductance())).tocsc()
+    
+    def continuity(self, met_node):
+        # Conductor path resistance from each node to the MET: diagonal of the inverse of the grounded Laplacian
+        n = self.n_nodes
+        keep = np.setdiff1d(np.arange(n), [met_node])
+        r = np.zeros(n)
+        if len(keep) == 0:
+            return r
+        Lr = self.laplacian()[keep][:, keep].tocsc()
+        _, labels = connected_components(self.laplacian(), directed=False)
+        bonded = labels[keep] == labels[met_node]
+        # Islands make the grounded Laplacian singular; a tiny leak keeps it factorable and they are reported as unbonded
+        lu = splu((Lr + sp.identity(len(keep)) * 1e-9).tocsc())
+        diag = np.empty(len(keep))
+        for start in range(0, len(keep), 256):
+            cols = np.arange(start, min(start + 256, len(keep)))
+            rhs = np.zeros((len(keep), len(cols)))
+            rhs[cols, np.arange(len(cols))] = 1.0
+            diag[cols] = lu.solve(rhs)[cols, np.arange(len(cols))]
+        r[keep] = np.where(bonded, diag, np.inf)
+        return r
+    
+    def solve(self, met_node=0):
+        # 1 A injected at the MET node: node potential = combined resistance seen there
+        # Only areas bonded to the MET carry current; islands stay at 0 V and are left out of the solve, as in continuity
+        g_earth = self.earth_conductance()
+        _, labels = connected_components(self.laplacian(), directed=False)
+        live = np.flatnonzero(labels == labels[met_node])
+        if not (g_earth[live] > 0).any():
+            raise ValueError(f"No area bonded to {self.names[met_node]} has a finite earth resistance above 0 Ω.")
+        lu = splu(self.conductance_matrix()[live][:, live].tocsc())
+        rhs = (live == met_node).astype(float)
+        v = np.zeros(self.n_nodes)
+        v[live] = lu.solve(rhs)
+        i_earth = v * g_earth
+        cont = self.continuity(met_node)
+        table = pd.DataFrame({
+            'Area': self.names, 'R Area (Ω)': np.round(self.R_area, 3), 'Potential (V/A)': np.round(v, 4),
+            'Current Share (%)': np.round(i_earth / i_earth.sum() * 100, 2),
+            'Continuity to MET (Ω)': np.round(cont, 4),
+            'Bonding': np.where(np.isinf(cont), 'NOT BONDED', np.where(cont <= BONDING_CONTINUITY_LIMIT, 'OK', 'HIGH'))
+        })
+        links = self.links.copy()
+        links['R Link (Ω)'] = np.round(self.R_link, 5)
+        links['Current (A/A)'] = np.round((v[self.i] - v[self.j]) / np.maximum(self.R_link, 1e-12), 4)
+        valid = g_earth > 0
+        return {'table': table, 'links': links, 'R_combined': float(v[met_node]),
+                'R_parallel': float(1 / np.sum(g_earth)) if valid.any() else float('nan'),
+                'met': self.names[met_node]}
+
 # ========== LIGHTNING PROTECTION WORD REPORT CLASS (replacement) ==========
 
 class LightningWordReport:
@@ -1189,8 +3575,11 @@ class LightningWordReport:
         
         # 4. Lightning Density
         self.doc.add_heading('1.4 Lightning Ground Flash Density (NG)', level=1)
-        self.doc.add_paragraph('Formula: NG = 0.1 × Td')
-        self.doc.add_paragraph('Reference: IEC 62305-2 Annex A.1, Equation A.1')
+        if inputs.get('ng_source'):
+            self.doc.add_paragraph(f'Source: Ground flash density map - {inputs["ng_source"]}')
+        else:
+            self.doc.add_paragraph('Formula: NG = 0.1 × Td')
+            self.doc.add_paragraph('Reference: IEC 62305-2 Annex A.1, Equation A.1')
         p = self.doc.add_paragraph()
         p.add_run('Result: ').bold = True
         p.add_run(f'NG = {results.get("ng", 1)} flashes/km²/year')
@@ -1337,7 +3726,8 @@ class TransformerWordReport:
         )
         
         p = self.doc.add_paragraph()
-        p.add_run('Transformer Size (kVA) = 1.2 x ' + str(round(r["peak_with_margin_kva"],1)) + ' = ').bold = False
+        k_text = ' x ' + str(round(r["factor_k"], 3)) + ' (Factor-K)' if r.get("factor_k", 1.0) > 1 else ''
+        p.add_run('Transformer Size (kVA) = 1.2 x ' + str(round(r["peak_with_margin_kva"],1)) + k_text + ' = ').bold = False
         p.add_run(str(round(r["tx_required_kva"],1)) + ' kVA').bold = True
         
         p = self.doc.add_paragraph()
@@ -1989,7 +4379,8 @@ if 'universal_loads' not in st.session_state:
         'Voltage (V)': [415, 3300],
         'Power Factor': [0.85, 0.85],
         'Load Type': ['Continuous', 'Continuous'],
-        'Diversity Factor': [0.8, 0.8]
+        'Diversity Factor': [0.8, 0.8],
+        'Motor': [True, True]
     })
 
 if 'loads_df' not in st.session_state:
@@ -2028,6 +4419,9 @@ if 'calc_results' not in st.session_state:
 if 'calc_done' not in st.session_state:
     st.session_state.calc_done = False
 
+if 'load_agg_cache' not in st.session_state:
+    st.session_state.load_agg_cache = {}
+
 # Transformer Sizing session states
 if 'tx_calc_done' not in st.session_state:
     st.session_state.tx_calc_done = False
@@ -2096,7 +4490,8 @@ if st.session_state.selected_calculator == "LOAD SHEET":
                 'Voltage (V)': [415],
                 'Power Factor': [0.85],
                 'Load Type': ['Continuous'],
-                'Diversity Factor': [0.8]
+                'Diversity Factor': [0.8],
+                'Motor': [False]
             })
             st.session_state.universal_loads = pd.concat([st.session_state.universal_loads, new_row], ignore_index=True)
             st.rerun()
@@ -2132,7 +4527,8 @@ if st.session_state.selected_calculator == "LOAD SHEET":
             "Voltage (V)": st.column_config.NumberColumn("Voltage (v)", min_value=0, max_value=11000, step=100),
             "Power Factor": st.column_config.NumberColumn("Pf", min_value=0.5, max_value=1.0, step=0.05),
             "Load Type": st.column_config.SelectboxColumn("Load type", options=['Continuous', 'Intermittent', 'Standby']),
-            "Diversity Factor": st.column_config.NumberColumn("Diversity", min_value=0.0, max_value=1.0, step=0.05)
+            "Diversity Factor": st.column_config.NumberColumn("Diversity", min_value=0.0, max_value=1.0, step=0.05),
+            "Motor": st.column_config.CheckboxColumn("Motor")
         }
     )
     st.session_state.universal_loads = edited_loads
@@ -2180,6 +4576,7 @@ elif st.session_state.selected_calculator == "Lightning Protection":
         "📊 Risk Assessment", 
         "🔧 Protection Design", 
         "📋 Calculations",
+        "🎯 Strike Simulation",
         "📥 Download Report"
     ])
     
@@ -2209,10 +4606,34 @@ elif st.session_state.selected_calculator == "Lightning Protection":
             
             td_days = st.number_input("Thunderstorm Days/Year", value=10, step=1)
             environment = st.selectbox("Environment", ["Surrounded", "Similar height", "Isolated", "Hilltop"])
+            
+            ng_map = None
+            with st.expander("🗺️ Ground Flash Density Map (optional)"):
+                st.caption("Local ESRI ASCII grid (.asc), CSV grid (x, y, value) or GeoTIFF. Overrides NG = 0.1 × Td.")
+                ng_map_path = st.text_input("Raster File Path", value="", key="ng_map_path")
+                ng_map_kind = st.radio("Raster Values", ["NG (flashes/km²/year)", "Td (thunderstorm days)"], horizontal=True, key="ng_map_kind")
+                site_x = st.number_input("Structure X (easting)", value=0.0, step=100.0, key="ng_site_x")
+                site_y = st.number_input("Structure Y (northing)", value=0.0, step=100.0, key="ng_site_y")
+                if ng_map_path:
+                    if 'ng_map_cache' not in st.session_state:
+                        st.session_state.ng_map_cache = {}
+                    try:
+                        ng_map = GroundFlashDensityMap.from_file(
+                            ng_map_path, 'td' if ng_map_kind.startswith('Td') else 'ng', st.session_state.ng_map_cache
+                        )
+                        map_ng = float(ng_map.lookup(site_x, site_y)[0])
+                        if math.isnan(map_ng):
+                            st.warning("Structure lies outside the raster - using NG = 0.1 × Td")
+                            ng_map = None
+                        else:
+                            st.success(f"NG from map = {map_ng:.2f} flashes/km²/year")
+                    except Exception as e:
+                        st.error(f"Could not load raster: {str(e)}")
+                        ng_map = None
         
         with col2:
             st.markdown("### 📊 Environmental Factor (CD)")
-            cd_values = {"Surrounded": 0.25, "Similar height": 0.5, "Isolated": 1, "Hilltop": 2}
+            cd_values = ENVIRONMENT_CD
             cd = cd_values[environment]
             
             st.markdown("**IEC 62305-2 Table A.1 Values:**")
@@ -2245,7 +4666,12 @@ elif st.session_state.selected_calculator == "Lightning Protection":
             # Am Calculation
             am = 2 * 500 * (length + width) + math.pi * 500**2
             
-            ng = 0.1 * td_days
+            if ng_map is not None:
+                ng = round(float(ng_map.lookup(site_x, site_y)[0]), 3)
+                ng_source = f"Map: {os.path.basename(ng_map.source)} at ({site_x:.0f}, {site_y:.0f})"
+            else:
+                ng = 0.1 * td_days
+                ng_source = ""
             nd = ng * ad * cd * 1e-6
             nm = ng * am * 1e-6
             
@@ -2298,9 +4724,57 @@ elif st.session_state.selected_calculator == "Lightning Protection":
             }
             st.session_state.input_values = {
                 'length': length, 'width': width, 'height': height,
-                'td_days': td_days, 'environment': environment, 'cd': cd
+                'td_days': td_days, 'environment': environment, 'cd': cd,
+                'ng_source': ng_source
             }
             st.session_state.calc_done = True
+            st.session_state.mc_results = None
+            st.session_state.lps_separation = None
+            st.session_state.lps_current_split = None
+        
+        st.markdown("---")
+        with st.expander("🔀 Protection What-If Sweep (LPS × SPD × Fire Protection)"):
+            st.caption("Evaluates every combination of protection measures and environment factors in one pass and keeps "
+                       "the Pareto-optimal options (lowest residual risk for the cost). Changing costs reuses the cached risk table.")
+            sweep_envs = st.multiselect("Environments", list(ENVIRONMENT_CD), default=[environment], key="sweep_envs")
+            cc1, cc2, cc3, cc4 = st.columns(4)
+            with cc1:
+                sweep_c2 = st.text_input("C2 values", value=f"{c2}", key="sweep_c2")
+            with cc2:
+                sweep_c3 = st.text_input("C3 values", value=f"{c3}", key="sweep_c3")
+            with cc3:
+                sweep_c4 = st.text_input("C4 values", value=f"{c4}", key="sweep_c4")
+            with cc4:
+                sweep_c5 = st.text_input("C5 values", value=f"{c5}", key="sweep_c5")
+            
+            st.markdown("**Costs**")
+            if 'sweep_costs' not in st.session_state:
+                st.session_state.sweep_costs = pd.DataFrame(
+                    [{'Measure': grp.upper(), 'Option': opt, 'Cost': cost}
+                     for grp, opts in DEFAULT_PROTECTION_COSTS.items() for opt, cost in opts.items()]
+                )
+            cost_df = st.data_editor(st.session_state.sweep_costs, num_rows="fixed", use_container_width=True,
+                                     disabled=['Measure', 'Option'], key="sweep_cost_editor")
+            sweep_pareto_only = st.checkbox("Show Pareto-optimal options only", value=True, key="sweep_pareto")
+            
+            if st.button("🔀 RUN SWEEP", use_container_width=True):
+                try:
+                    parse = lambda txt: tuple(float(v) for v in txt.replace(';', ',').split(',') if v.strip())
+                    costs = {grp: {row['Option']: row['Cost'] for _, row in cost_df[cost_df['Measure'] == grp.upper()].iterrows()}
+                             for grp in DEFAULT_PROTECTION_COSTS}
+                    sweep_ng = float(ng_map.lookup(site_x, site_y)[0]) if ng_map is not None else 0.1 * td_days
+                    if 'sweep_cache' not in st.session_state:
+                        st.session_state.sweep_cache = {}
+                    sweep = LightningRiskSweep(st.session_state.sweep_cache)
+                    st.session_state.sweep_results = sweep.run(
+                        length, width, height, sweep_ng, costs, sweep_envs or [environment],
+                        parse(sweep_c2), parse(sweep_c3), parse(sweep_c4), parse(sweep_c5), sweep_pareto_only
+                    )
+                except Exception as e:
+                    st.error(f"Sweep failed: {str(e)}")
+            
+            if st.session_state.get('sweep_results') is not None:
+                st.dataframe(st.session_state.sweep_results, use_container_width=True, hide_index=True)
     
     # TAB 2: Protection Design
     with lp_tabs[1]:
@@ -2324,6 +4798,78 @@ elif st.session_state.selected_calculator == "Lightning Protection":
                 else:
                     st.metric("Rod Diameter", "9.5 mm")
                     st.metric("Down Conductor", "29 mm²")
+            
+            st.markdown("---")
+            st.markdown("### Down Conductors & Separation Distance (IEC 62305-3 Clause 6.3)")
+            inputs = st.session_state.input_values
+            col_d1, col_d2, col_d3 = st.columns(3)
+            with col_d1:
+                dc_area = st.number_input("Conductor Cross-Section (mm²)", value=50.0, min_value=16.0, step=10.0, key="dc_mm2")
+            with col_d2:
+                dc_earth = st.number_input("Earth Resistance per Down Conductor (Ω)", value=10.0, min_value=0.1, step=1.0, key="dc_re")
+            with col_d3:
+                st.metric("ki", LPL_KI[results['lpl']])
+                dc_impulse_kc = st.checkbox("kc from impulse split (R + L at 25 kHz)", value=True, key="dc_impulse_kc")
+            
+            st.caption("Metal installations: X along length, Y along width from the structure corner, Z = height above ground.")
+            if 'lps_installations' not in st.session_state:
+                st.session_state.lps_installations = pd.DataFrame({
+                    'Name': ['Gas Pipe', 'Cable Tray'],
+                    'X (m)': [0.5, 10.0], 'Y (m)': [0.3, 1.0], 'Z (m)': [5.0, 3.0],
+                    'Medium': ['Air', 'Concrete/Bricks']
+                })
+            st.session_state.lps_installations = st.data_editor(
+                st.session_state.lps_installations, num_rows="dynamic", use_container_width=True,
+                column_config={"Medium": st.column_config.SelectboxColumn("Medium", options=list(SEPARATION_KM))},
+                key="lps_inst_editor"
+            )
+            
+            if st.button("CALCULATE SEPARATION DISTANCES", use_container_width=True):
+                try:
+                    network = LPSNetwork(inputs['length'], inputs['width'], inputs['height'], results['lpl'], dc_area, earth_resistance=dc_earth)
+                    sep_calc = SeparationDistanceCalculator(network, IMPULSE_EQUIVALENT_FREQ_HZ if dc_impulse_kc else 0.0)
+                    installations = st.session_state.lps_installations.dropna(subset=['X (m)', 'Y (m)', 'Z (m)'])
+                    st.session_state.lps_separation = {
+                        'n_dc': network.n_down_conductors,
+                        'down_conductors': sep_calc.down_conductor_table(),
+                        'pairs': sep_calc.evaluate(installations) if len(installations) else pd.DataFrame()
+                    }
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+            
+            if st.session_state.get('lps_separation'):
+                sep = st.session_state.lps_separation
+                perimeter = 2 * (inputs['length'] + inputs['width'])
+                st.markdown(f"**Down conductors:** perimeter {perimeter:.1f} m / {LPL_DOWN_CONDUCTOR_SPACING[results['lpl']]} m spacing → **{sep['n_dc']}**")
+                st.dataframe(sep['down_conductors'], use_container_width=True, hide_index=True)
+                st.markdown("**Separation distance:** s = ki × kc × l / km")
+                st.dataframe(sep['pairs'], use_container_width=True, hide_index=True)
+            
+            st.markdown("---")
+            st.markdown("### Lightning Current Distribution (10/350 µs First Stroke)")
+            st.caption("Roof mesh and down conductors solved as an R-L network at the 25 kHz front-time equivalent "
+                       "frequency; one factorisation serves all four LPL current levels.")
+            col_s1, col_s2 = st.columns(2)
+            with col_s1:
+                strike_x = st.number_input("Strike Point X (m)", value=0.0, step=1.0, key="lps_strike_x")
+            with col_s2:
+                strike_y = st.number_input("Strike Point Y (m)", value=0.0, step=1.0, key="lps_strike_y")
+            
+            if st.button("SOLVE CURRENT DISTRIBUTION", use_container_width=True):
+                try:
+                    network = LPSNetwork(inputs['length'], inputs['width'], inputs['height'], results['lpl'], dc_area, earth_resistance=dc_earth)
+                    solver = LightningCurrentSolver(network)
+                    st.session_state.lps_current_split = solver.solve(network.nearest_node(strike_x, strike_y))
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+            
+            if st.session_state.get('lps_current_split'):
+                split = st.session_state.lps_current_split
+                st.markdown(f"Strike at roof node ({split['strike_xy'][0]:.1f}, {split['strike_xy'][1]:.1f}) m | "
+                            f"largest down-conductor share = **{split['max_share']:.1%}**")
+                st.dataframe(split['table'], use_container_width=True, hide_index=True)
+                st.markdown("**Maximum roof conductor current:** " + " | ".join(
+                    f"{lvl}: {i_ka:.1f} kA" for lvl, i_ka in split['max_mesh_current_ka'].items()))
     
     # TAB 3: Calculations
     with lp_tabs[2]:
@@ -2364,7 +4910,10 @@ elif st.session_state.selected_calculator == "Lightning Protection":
             
             with st.expander("4. Lightning Density (NG)"):
                 st.markdown('<div class="formula-box">', unsafe_allow_html=True)
-                st.markdown("**Formula:** NG = 0.1 × Td")
+                if inputs.get('ng_source'):
+                    st.markdown(f"**Source:** {inputs['ng_source']}")
+                else:
+                    st.markdown("**Formula:** NG = 0.1 × Td")
                 st.markdown(f"**Result:** NG = **{results.get('ng', 1)} flashes/km²/year**")
                 st.markdown('</div>', unsafe_allow_html=True)
             
@@ -2385,8 +4934,45 @@ elif st.session_state.selected_calculator == "Lightning Protection":
                 st.markdown(f"**Result:** **{results.get('lpl', 'Class III')}**")
                 st.markdown('</div>', unsafe_allow_html=True)
     
-    # TAB 4: Download Report - Word Only
+    # TAB 4: Strike Simulation (Monte Carlo EGM)
     with lp_tabs[3]:
+        st.markdown("## STRIKE SIMULATION (MONTE CARLO)")
+        
+        if not st.session_state.calc_done:
+            st.warning("⚠️ Please complete Risk Assessment first!")
+        else:
+            results = st.session_state.calc_results
+            inputs = st.session_state.input_values
+            st.info("Strike points are sampled uniformly over the site area at NG, peak currents from the IEC 62305-1 "
+                    "first-stroke distribution, and each strike is assigned by the electro-geometric model (r = 10 x I^0.65).")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                mc_samples = st.number_input("Number of Strikes", value=1_000_000, min_value=10_000, max_value=50_000_000, step=100_000, key="mc_samples")
+            with col2:
+                mc_seed = st.number_input("Random Seed", value=0, min_value=0, step=1, key="mc_seed")
+            with col3:
+                mc_workers = st.number_input("Parallel Workers", value=1, min_value=1, max_value=max(1, os.cpu_count() or 1), step=1, key="mc_workers",
+                                             help=f"Worker processes are used only from {STRIKE_MC_PARALLEL_MIN_SAMPLES:,} strikes up")
+            
+            if st.button("🎯 RUN SIMULATION", type="primary", use_container_width=True):
+                structure = {
+                    'name': 'Structure', 'x': 0.0, 'y': 0.0,
+                    'length': inputs['length'], 'width': inputs['width'], 'height': inputs['height'],
+                    'lpl': results['lpl']
+                }
+                with st.spinner("Simulating strikes..."):
+                    sim = LightningStrikeSimulator([structure], results['ng'])
+                    st.session_state.mc_results = sim.run(int(mc_samples), seed=int(mc_seed), workers=int(mc_workers))
+            
+            if st.session_state.get('mc_results'):
+                mc = st.session_state.mc_results
+                st.markdown(f"Simulated **{mc['samples']:,}** strikes over **{mc['area_km2']:.4f} km²** "
+                            f"(≈ {mc['years']:,.0f} years at NG = {results['ng']})")
+                st.dataframe(mc['table'], use_container_width=True, hide_index=True)
+    
+    # TAB 5: Download Report - Word Only
+    with lp_tabs[4]:
         st.markdown("## DOWNLOAD REPORT")
         
         if not st.session_state.calc_done:
@@ -2700,6 +5286,11 @@ elif st.session_state.selected_calculator == "Cable Sizing":
                     has_error = True
             
             if not has_error:
+                harmonic_factors = st.session_state.get('harmonic_cable_factors', {'loads': {}, 'buses': {}})
+                if harmonic_factors['loads'] or harmonic_factors['buses']:
+                    st.caption("Harmonic cable factors - loads: " + (", ".join(
+                        f"{n}: {f:.3f}" for n, f in harmonic_factors['loads'].items()) or "none") + " | bus feeders: " + (", ".join(
+                        f"{v} V: {f:.3f}" for v, f in harmonic_factors['buses'].items()) or "none"))
                 if st.button("🔧 Calculate with derating factors (auto selection)", type="primary", use_container_width=True):
                     with st.spinner("Calculating with automatic cable selection..."):
                         # (The cable calculation logic remains the same as in the original code)
@@ -2715,6 +5306,8 @@ elif st.session_state.selected_calculator == "Cable Sizing":
                                 load['Power (kW)'], load['Voltage (V)'], load['Power Factor'], 
                                 load['Efficiency'], load['Phase']
                             )
+                            # Harmonic rms / neutral current uplift from the Transformer page harmonic study
+                            current = current / harmonic_factors['loads'].get(str(load['Load Name']), 1.0)
                             
                             selected_size, cable_data, base_amp, derated_amp, vd_pct, total_k, factors, success, _ = select_cable_automatically(
                                 load, cable_calc, ambient_temp,
@@ -2827,7 +5420,7 @@ elif st.session_state.selected_calculator == "Cable Sizing":
                             st.session_state.loads_df, 1.25, manufacturer
                         )
                         main_cbs_by_voltage, main_cb_details_by_voltage = cb_calc.calculate_main_cb_by_voltage(
-                            st.session_state.loads_df, 1.25
+                            st.session_state.loads_df, 1.25, harmonic_factors['buses']
                         )
                         st.session_state.cb_results = cb_results
                         st.session_state.cb_details = cb_details
@@ -3052,6 +5645,51 @@ Isc = **{calc['sc']:.2f} kA**
                     st.dataframe(pd.DataFrame(main_cb_summary), use_container_width=True, hide_index=True)
             else:
                 st.info("No main circuit breaker calculations available.")
+            
+            with st.expander("⚡ Fault Level & Breaking Capacity (from transformer)"):
+                st.info("Prospective fault current is carried from the transformer terminals through each feeder cable (R/X from the "
+                        "BS 7671 mV/A/m tables). Each breaker's breaking capacity Icu must cover the fault level on its board.")
+                tx_res = st.session_state.get('tx_results') or {}
+                fl1, fl2, fl3, fl4 = st.columns(4)
+                with fl1:
+                    fl_kva = st.selectbox("Transformer (kVA)", R10_SERIES, index=R10_SERIES.index(tx_res['selected_kva'])
+                                          if tx_res.get('selected_kva') in R10_SERIES else R10_SERIES.index(1000), key="cb_fl_kva")
+                with fl2:
+                    fl_z = st.number_input("Transformer Z (%)", value=float(st.session_state.get('tx_z', 5.0)), min_value=2.0, max_value=15.0, step=0.5, key="cb_fl_z")
+                with fl3:
+                    fl_v = st.number_input("LV Voltage (V)", value=int(st.session_state.get('tx_lv_v', 433)), step=1, key="cb_fl_v")
+                with fl4:
+                    fl_xr = st.number_input("Transformer X/R", value=TX_XR_RATIO, min_value=1.0, max_value=30.0, step=0.5, key="cb_fl_xr")
+                
+                if st.button("CHECK BREAKING CAPACITY", use_container_width=True, key="cb_fl_run"):
+                    calcs = pd.DataFrame(st.session_state.detailed_calcs)
+                    cbs = pd.DataFrame(st.session_state.cb_results)
+                    # Both come from the same pass over the load list, so rows line up by position even when names repeat
+                    if len(calcs) != len(cbs):
+                        st.session_state.cb_fault = None
+                        st.error("Cable and breaker results are out of step - recalculate cable sizes first.")
+                    else:
+                        feeders = pd.DataFrame({
+                            'Load': calcs['load_name'], 'Voltage (V)': calcs['voltage'], 'Phase': calcs['phase'],
+                            'Cable Type': calcs['cable_type'], 'Size (mm²)': calcs['size'], 'Length (m)': calcs['length'],
+                            'Formation': calcs['formation'],
+                            'Selected CB (A)': cbs['Selected CB (A)'].to_numpy(), 'Breaker Type': cbs['Breaker Type'].to_numpy()
+                        })
+                        flp = FaultLevelPropagation(fl_kva, fl_z, fl_v, fl_xr)
+                        st.session_state.cb_fault = {'table': flp.feeder_faults(feeders), 'busbar_ka': flp.busbar_fault_ka(),
+                                                     'sc_current_a': flp.sc_current_a}
+                
+                if st.session_state.get('cb_fault'):
+                    fr = st.session_state.cb_fault
+                    fm1, fm2 = st.columns(2)
+                    fm1.metric("Transformer Isc", f"{fr['sc_current_a']/1000:.2f} kA")
+                    fm2.metric("LV Board Fault Level (c = 1.10)", f"{fr['busbar_ka']:.2f} kA")
+                    st.dataframe(fr['table'], hide_index=True, use_container_width=True)
+                    exceed = fr['table']['Status'].str.startswith("EXCEEDS")
+                    if exceed.any():
+                        st.error(f"{int(exceed.sum())} breaker(s) cannot break the board fault level - use a higher breaking capacity type or cascading.")
+                    else:
+                        st.success("All LV breakers have adequate breaking capacity.")
         else:
             st.info("👈 Calculate cable sizes first to see circuit breaker results")
     
@@ -3130,24 +5768,169 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
     st.markdown("### Step 1: Enter Load Data")
     st.info("Enter P (kW) and System PF - Q and S auto-calculated")
     
+    sheet_key, sheet_agg = LoadSheetAggregator.cached(st.session_state.universal_loads, st.session_state.load_agg_cache)
+    with st.expander("Load Sheet Aggregation (per voltage bus)"):
+        st.dataframe(sheet_agg, hide_index=True, use_container_width=True)
+        tx_buses = sheet_agg['Bus (V)'].tolist()
+        tx_lv = [b for b in tx_buses if b <= 1000]
+        tx_sheet_bus = st.selectbox("Bus Fed by Transformer (V)", tx_buses, index=tx_buses.index(tx_lv[0]) if tx_lv else 0, key="tx_sheet_bus") if tx_buses else None
+        tx_sheet_follow = st.checkbox("Feed load data from the load sheet", value=True, key="tx_sheet_follow")
+    # Re-feed only when the load sheet or the bus changes, so manual edits stick until then
+    if tx_sheet_follow and tx_sheet_bus is not None and st.session_state.get('tx_sheet_fed') != (sheet_key, tx_sheet_bus):
+        st.session_state.tx_feed = LoadSheetAggregator.bus_feed(sheet_agg, tx_sheet_bus)
+        for k in ['tx_op_p', 'tx_pk_p', 'tx_pf', 'tx_motor_kw', 'tx_motor_pf']:
+            st.session_state.pop(k, None)
+        st.session_state.tx_sheet_fed = (sheet_key, tx_sheet_bus)
+    
+    with st.expander("Harmonic Derating (K-factor / Factor-K)"):
+        st.info("Set the harmonic source of each load - VFD loads are the main source. Harmonic phasors are summed per bus; "
+                "Factor-K (BS 7821) derates the transformer; the cable factor (BS 7671 Appendix 4) is applied in Cable Sizing "
+                "to harmonic-source load cables and to the bus feeder main breaker only.")
+        loads_now = st.session_state.universal_loads
+        if st.session_state.get('tx_harm_key') != sheet_key:
+            # Motors already set to VFD in the start sequence default to the VFD spectrum
+            seq = st.session_state.get('tx_motor_seq')
+            vfd = set() if seq is None else {str(m).split(" #")[0] for m, sm in zip(seq['Motor'], seq['Start Method'])
+                                             if HARMONIC_SOURCE_BY_START.get(sm) == 'VFD'}
+            st.session_state.tx_harm_loads = pd.DataFrame({
+                'Load': loads_now['Load Description'].astype(str),
+                'Bus (V)': loads_now['Voltage (V)'],
+                'kW': loads_now['Rating (kW)'] * loads_now['Quantity'] * loads_now['Load Type'].map(lambda t: LOAD_TYPE_FACTORS.get(t, LOAD_TYPE_FACTORS['Continuous'])['diversity']),
+                'PF': loads_now['Power Factor'],
+                'Harmonic Source': ['VFD' if d in vfd else 'Linear' for d in loads_now['Load Description'].astype(str)]
+            })
+            st.session_state.tx_harm_key = sheet_key
+        harm_df = st.data_editor(st.session_state.tx_harm_loads, hide_index=True, use_container_width=True,
+                                 column_config={'Harmonic Source': st.column_config.SelectboxColumn(options=list(HARMONIC_SPECTRA))},
+                                 key="tx_harm_editor")
+        if st.button("CALCULATE HARMONICS", use_container_width=True, key="tx_harm_run"):
+            harm_df = harm_df.dropna(subset=['Bus (V)', 'kW', 'PF'])
+            st.session_state.tx_harm_loads = harm_df
+            st.session_state.tx_harmonics = HarmonicAnalysis(harm_df[harm_df['Bus (V)'] > 0]).evaluate()
+        
+        if st.session_state.get('tx_harmonics'):
+            hr = st.session_state.tx_harmonics
+            st.dataframe(hr['table'], hide_index=True, use_container_width=True)
+            if len(hr.get('loads', [])):
+                st.dataframe(hr['loads'], hide_index=True, use_container_width=True)
+            st.bar_chart(hr['spectrum'].T, x_label="Harmonic order", y_label="% of fundamental")
+            ht = hr['table'].set_index('Bus (V)')
+            harm_bus = int(tx_sheet_bus) if tx_sheet_bus is not None and int(tx_sheet_bus) in ht.index else None
+            if harm_bus is None:
+                st.warning("The bus fed by the transformer (Load Sheet Aggregation) is not in this study - Factor-K cannot be applied.")
+            else:
+                st.caption(f"Factor-K is taken from the {harm_bus} V bus fed by the transformer: {ht.loc[harm_bus, 'Factor-K']:.3f}")
+            if st.button("Apply Derating to Transformer & Cable Sizing", key="tx_harm_apply", disabled=harm_bus is None):
+                st.session_state.tx_feed = dict(st.session_state.get('tx_feed', {}), factor_k=float(ht.loc[harm_bus, 'Factor-K']))
+                st.session_state.pop('tx_factor_k', None)
+                st.session_state.harmonic_cable_factors = {
+                    'loads': {str(n): float(f) for n, f in zip(hr['loads']['Load'], hr['loads']['Cable Factor'])},
+                    'buses': {int(v): float(f) for v, f in ht['Cable Factor'].items()}
+                }
+                st.rerun()
+    
+    with st.expander("Batch Sizing (many substations from a table)"):
+        st.info("One row per substation. Upload CSV / Excel with the columns below or edit the table directly.")
+        if 'tx_batch' not in st.session_state:
+            st.session_state.tx_batch = pd.DataFrame({
+                'Substation': ['SS-01', 'SS-02', 'SS-03'],
+                'Op P (kW)': [447.0, 820.0, 150.0], 'Peak P (kW)': [507.0, 950.0, 190.0], 'PF': [0.84, 0.88, 0.82],
+                'Margin (%)': [20, 20, 20], 'Loading Factor': [1.2, 1.2, 1.2], 'Z (%)': [5.0, 6.0, 4.5],
+                'LV Voltage (V)': [433, 433, 433], 'Largest Motor (kW)': [75.0, 160.0, 30.0], 'Motor PF': [0.85, 0.85, 0.85],
+                'Start Method': ['Star-Delta (Y-Delta)', 'Soft Starter', 'DOL'],
+            })
+        batch_file = st.file_uploader("Substation Table (CSV / XLSX)", type=['csv', 'xlsx'], key="tx_batch_file")
+        batch_key = hashlib.sha1(batch_file.getvalue()).hexdigest() if batch_file is not None else None
+        if batch_key is not None and st.session_state.get('tx_batch_key') != batch_key:
+            st.session_state.tx_batch = pd.read_csv(batch_file) if batch_file.name.lower().endswith('.csv') else pd.read_excel(batch_file)
+            st.session_state.tx_batch_key = batch_key
+        batch = st.data_editor(st.session_state.tx_batch, num_rows="dynamic", hide_index=True, use_container_width=True,
+                               column_config={'Start Method': st.column_config.SelectboxColumn(options=list(MOTOR_START_OPTIONS))},
+                               key="tx_batch_editor")
+        if st.button("SIZE ALL SUBSTATIONS", use_container_width=True, key="tx_batch_run"):
+            st.session_state.tx_batch = batch
+            try:
+                st.session_state.tx_batch_result = TransformerSizingCalculator.size_batch(batch.dropna(subset=['Peak P (kW)']))
+            except ValueError as e:
+                st.session_state.tx_batch_result = None
+                st.error(str(e))
+        if st.session_state.get('tx_batch_result') is not None:
+            br = st.session_state.tx_batch_result
+            st.dataframe(br, hide_index=True, use_container_width=True)
+            st.caption(f"{(br['Status'] == 'PASS').sum()} of {len(br)} substations pass | "
+                       f"total installed {br['Selected (kVA)'].sum():,.0f} kVA")
+            b64 = base64.b64encode(br.to_csv(index=False).encode()).decode()
+            st.markdown(f'<a href="data:text/csv;base64,{b64}" download="Transformer_Batch_Sizing.csv" class="download-btn">Download Results (CSV)</a>', unsafe_allow_html=True)
+    
+    with st.expander("Profile-Driven Sizing (hourly / 15-minute SCADA data)"):
+        st.info("Upload a year of kW (and optionally kvar) readings. The design demand is taken from a percentile of S "
+                "instead of a single peak value; the loading factor and 80% loading headroom are applied as in the manual mode.")
+        prof_file = st.file_uploader("Load Profile CSV (timestamp, kW, kvar)", type=['csv'], key="tx_profile_file")
+        pc1, pc2, pc3 = st.columns(3)
+        with pc1:
+            prof_pct = st.selectbox("Design Percentile", [90.0, 95.0, 99.0, 99.5, 99.9, 100.0], index=2, key="tx_profile_pct")
+        with pc2:
+            prof_pf = st.number_input("PF (if no kvar column)", value=0.85, min_value=0.5, max_value=1.0, step=0.01, key="tx_profile_pf")
+        with pc3:
+            prof_lf = st.number_input("Loading Factor", value=1.0, min_value=1.0, max_value=2.0, step=0.05, key="tx_profile_lf")
+        
+        if prof_file is not None:
+            # Keyed on the file contents so a corrected file re-uploaded under the same name is reparsed
+            prof_key = hashlib.sha1(prof_file.getvalue()).hexdigest()
+            if st.session_state.get('tx_profile_key') != prof_key:
+                try:
+                    st.session_state.tx_profile = LoadProfile.from_csv(prof_file)
+                    st.session_state.tx_profile_key = prof_key
+                except Exception as e:
+                    st.session_state.tx_profile = None
+                    st.error(f"Could not read load profile: {e}")
+            lp = st.session_state.get('tx_profile')
+            if lp is not None:
+                if lp.q.sum() == 0 and prof_pf < 1.0:
+                    lp = LoadProfile(lp.p, pf=prof_pf, step_h=lp.step_h, source=lp.source)
+                summ = lp.summary()
+                sz = lp.size(prof_pct, prof_lf)
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Points", f"{summ['points']:,} @ {summ['step_h']*60:.0f} min")
+                m2.metric("Peak S", f"{summ['peak_s']:.0f} kVA")
+                m3.metric("Load Factor", f"{summ['load_factor']:.2f}")
+                m4.metric("Energy", f"{summ['energy_kwh']/1000:.0f} MWh")
+                st.line_chart(lp.duration_curve(), x_label="Hours", y_label="S (kVA)")
+                st.dataframe(lp.percentiles(), hide_index=True, use_container_width=True)
+                st.markdown(f"""
+<div class="calc-step">
+    <h4>Profile Sizing ({prof_pct:g}th percentile)</h4>
+    <p>Design Demand S<sub>{prof_pct:g}</sub> = <b>{sz['s_design']:.1f} kVA</b></p>
+    <p>Transformer Size (kVA) = 1.2 x {prof_lf:.2f} x {sz['s_design']:.1f} = <b>{sz['required_kva']:.1f} kVA</b></p>
+    <p>Recommended Transformer Size = <b>{sz['selected_kva']} kVA</b> | Peak loading {sz['peak_loading_pct']:.0f}% | {sz['hours_over_rating']:.1f} h above rating</p>
+</div>
+""", unsafe_allow_html=True)
+                if st.button("Use Profile for Load Data", key="tx_profile_apply"):
+                    st.session_state.tx_feed = {'op_p': round(summ['mean_p'], 1), 'pk_p': round(sz['s_design'] * summ['pf'], 1),
+                                                'pf': round(min(max(summ['pf'], 0.5), 1.0), 2)}
+                    for k in ['tx_op_p', 'tx_pk_p', 'tx_pf']:
+                        st.session_state.pop(k, None)
+                    st.rerun()
+    
     col1, col2, col3 = st.columns([1, 1, 1])
     
     with col1:
         st.markdown("**Operating Load**")
-        op_p = st.number_input("Operating P (kW)", value=447.0, step=1.0, key="tx_op_p")
+        op_p = st.number_input("Operating P (kW)", value=st.session_state.get('tx_feed', {}).get('op_p', 447.0), step=1.0, key="tx_op_p")
     
     with col2:
         st.markdown("**Peak Load**")
-        pk_p = st.number_input("Peak P (kW)", value=507.0, step=1.0, key="tx_pk_p")
+        pk_p = st.number_input("Peak P (kW)", value=st.session_state.get('tx_feed', {}).get('pk_p', 507.0), step=1.0, key="tx_pk_p")
     
     with col3:
         st.markdown("**System PF & Parameters**")
-        pf = st.number_input("System Power Factor", value=0.84, min_value=0.5, max_value=1.0, step=0.01, key="tx_pf")
+        pf = st.number_input("System Power Factor", value=st.session_state.get('tx_feed', {}).get('pf', 0.84), min_value=0.5, max_value=1.0, step=0.01, key="tx_pf")
         spare_margin_pct = st.number_input("Spare Margin (%)", value=20, step=5, key="tx_margin")
         loading_factor = st.number_input("Loading Factor", value=1.2, min_value=1.0, max_value=2.0, step=0.05, key="tx_loading")
         st.markdown(f"Spare Margin = {spare_margin_pct}% | Loading Factor = {loading_factor:.2f}")
         tx_impedance = st.number_input("Transformer Z (%)", value=5.0, min_value=2.0, max_value=15.0, step=0.5, key="tx_z")
         lv_voltage = st.number_input("LV Voltage (V)", value=433, step=1, key="tx_lv_v")
+        factor_k = st.number_input("Harmonic Factor-K", value=st.session_state.get('tx_feed', {}).get('factor_k', 1.0), min_value=1.0, max_value=3.0, step=0.01, format="%.3f", key="tx_factor_k")
     
     op_s = op_p / pf
     op_q = math.sqrt(op_s**2 - op_p**2)
@@ -3173,16 +5956,13 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
     col_m1, col_m2 = st.columns([1, 1])
     
     with col_m1:
-        motor_power = st.number_input("Largest Motor Power (kW)", value=75.0, step=1.0, key="tx_motor_kw")
-        motor_pf = st.number_input("Motor PF", value=0.85, min_value=0.5, max_value=1.0, step=0.01, key="tx_motor_pf")
+        motor_power = st.number_input("Largest Motor Power (kW)", value=st.session_state.get('tx_feed', {}).get('motor_kw', 75.0), step=1.0, key="tx_motor_kw")
+        motor_pf = st.number_input("Motor PF", value=st.session_state.get('tx_feed', {}).get('motor_pf', 0.85), min_value=0.5, max_value=1.0, step=0.01, key="tx_motor_pf")
+        if st.session_state.get('tx_feed', {}).get('no_motor'):
+            st.caption(f"No motor loads are flagged on the {tx_sheet_bus} V bus - Largest Motor set to 0 kW.")
     
     with col_m2:
-        start_options = {
-            "DOL": 650,
-            "Star-Delta (Y-Delta)": 350,
-            "Soft Starter": 400,
-            "VFD": 150
-        }
+        start_options = MOTOR_START_OPTIONS
         motor_start_method = st.selectbox(
             "Starting Method", list(start_options.keys()), index=1, key="tx_start_method"
         )
@@ -3191,7 +5971,7 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
     
     if st.button("CALCULATE TRANSFORMER SIZE", type="primary", use_container_width=True):
         peak_with_margin_kva = pk_s * loading_factor
-        tx_required_kva = peak_with_margin_kva * 1.2
+        tx_required_kva = tx_calc.harmonic_derated_kva(peak_with_margin_kva * 1.2, factor_k)
         selected_kva = tx_calc.get_r10_rating(tx_required_kva)
         motor_start = tx_calc.calc_motor_starting_vd(
             selected_kva, tx_impedance, peak_with_margin_kva,
@@ -3211,7 +5991,8 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
             "motor_power": motor_power,
             "start_pct": start_pct,
             "lv_voltage": lv_voltage,
-            "motor_start_method": motor_start_method
+            "motor_start_method": motor_start_method,
+            "factor_k": factor_k
         }
         st.session_state.tx_calc_done = True
         st.rerun()
@@ -3260,7 +6041,7 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
 <div class="calc-step">
     <h4>Sizing Calculation</h4>
     <p>Considering that Transformer shall not be loaded more than 80% at Demand Load with {r['spare_margin_pct']}% spare margin,</p>
-    <p>Transformer Size (kVA) = 1.2 x {r['peak_with_margin_kva']:.1f} = <b>{r['tx_required_kva']:.1f} kVA</b></p>
+    <p>Transformer Size (kVA) = 1.2 x {r['peak_with_margin_kva']:.1f}{f" x {r['factor_k']:.3f} (Factor-K)" if r.get('factor_k', 1.0) > 1 else ""} = <b>{r['tx_required_kva']:.1f} kVA</b></p>
     <p>Recommended Transformer Size = <b>{r['selected_kva']} kVA</b></p>
 </div>
 """, unsafe_allow_html=True)
@@ -3339,6 +6120,145 @@ elif st.session_state.selected_calculator == "Transformer Sizing":
                     except Exception as e:
                         st.error(f"Error generating Word document: {str(e)}")
                         st.code(traceback.format_exc())
+    
+    st.markdown("---")
+    with st.expander("Thermal Ageing Check (IEC 60076-7) - daily cyclic loading"):
+        st.info("Top-oil and hot-spot temperatures are simulated for every R10 rating at once with the IEC 60076-7 difference "
+                "equations. The smallest rating within the hot-spot / top-oil limits and the ageing target is selected.")
+        th1, th2, th3 = st.columns(3)
+        with th1:
+            th_cooling = st.selectbox("Cooling", list(IEC60076_7_COOLING), key="tx_th_cooling")
+            th_paper = st.checkbox("Thermally upgraded paper", key="tx_th_paper")
+        with th2:
+            th_target = st.number_input("Max Mean Ageing Rate V", value=1.0, min_value=0.1, step=0.1, key="tx_th_target")
+            th_src_opts = ["Daily cycle (table)"] + (["Uploaded load profile"] if st.session_state.get('tx_profile') is not None else [])
+            th_src = st.radio("Load Source", th_src_opts, key="tx_th_src")
+        with th3:
+            th_amb = st.number_input("Ambient Offset (°C)", value=0.0, step=1.0, key="tx_th_amb",
+                                     help="Added to the ambient column; applied as a constant for uploaded profiles")
+            th_warm = st.number_input("Warm-up Cycles", value=3, min_value=0, max_value=10, step=1, key="tx_th_warm")
+        if 'tx_daily_cycle' not in st.session_state:
+            hrs = np.arange(24)
+            st.session_state.tx_daily_cycle = pd.DataFrame({
+                'Hour': hrs,
+                'Load (% of peak S)': np.round(60 + 40 * np.clip(np.sin(np.pi * (hrs - 7) / 14), 0, None), 0),
+                'Ambient (°C)': np.round(30 + 8 * np.sin(np.pi * (hrs - 9) / 12), 1),
+            })
+        if th_src == "Daily cycle (table)":
+            cycle = st.data_editor(st.session_state.tx_daily_cycle, hide_index=True, use_container_width=True,
+                                   disabled=['Hour'], key="tx_th_cycle")
+        
+        if st.button("RUN THERMAL SIMULATION", use_container_width=True, key="tx_th_run"):
+            model = TransformerThermalModel(th_cooling, th_paper)
+            with st.spinner("Simulating hot-spot temperatures..."):
+                if th_src == "Daily cycle (table)":
+                    s_series = cycle['Load (% of peak S)'].to_numpy(dtype=float) / 100.0 * pk_s
+                    amb = cycle['Ambient (°C)'].to_numpy(dtype=float) + th_amb
+                    res = model.evaluate(s_series, amb, R10_SERIES, 1.0, th_target, int(th_warm))
+                else:
+                    lp = st.session_state.tx_profile
+                    res = model.evaluate(lp.s, 30.0 + th_amb, R10_SERIES, lp.step_h, th_target)
+            st.session_state.tx_thermal = res
+        
+        if st.session_state.get('tx_thermal'):
+            th = st.session_state.tx_thermal
+            st.dataframe(th['table'], hide_index=True, use_container_width=True)
+            if th['selected_kva'] is None:
+                st.error("No R10 rating meets the thermal limits for this loading.")
+            else:
+                st.success(f"Smallest rating meeting IEC 60076-7 limits: {th['selected_kva']} kVA")
+                b = th['best_index']
+                st.line_chart(pd.DataFrame({'Hot-Spot (°C)': th['hot_spot'][:, b], 'Top-Oil (°C)': th['top_oil'][:, b]}))
+    
+    with st.expander("Motor Starting Sequence (transformer and generator sources)"):
+        st.info("Motors are taken from the load sheet (one row per unit). Start time slots are kept; the simulator tries "
+                "thousands of motor orders over those slots and keeps the one with the lowest worst-case voltage dip.")
+        # Reseeded whenever the load sheet changes so deleted or renamed motors drop out
+        if st.session_state.get('tx_motor_seq_key') != sheet_key:
+            rows = []
+            sheet = st.session_state.universal_loads
+            for (_, load), is_motor in zip(sheet.iterrows(), LoadSheetAggregator.motor_mask(sheet)):
+                if is_motor and load['Voltage (V)'] <= 1000:
+                    for u in range(int(load['Quantity'])):
+                        rows.append({'Motor': f"{load['Load Description']}" + (f" #{u+1}" if load['Quantity'] > 1 else ""),
+                                     'kW': float(load['Rating (kW)']), 'PF': float(load['Power Factor']),
+                                     'Start Method': "Star-Delta (Y-Delta)", 'Start Time (s)': 10.0 * len(rows)})
+            st.session_state.tx_motor_seq = pd.DataFrame(rows, columns=['Motor', 'kW', 'PF', 'Start Method', 'Start Time (s)'])
+            st.session_state.tx_motor_seq_key = sheet_key
+            st.session_state.pop('tx_seq_editor', None)
+            st.session_state.pop('tx_seq_result', None)
+        seq_df = st.data_editor(st.session_state.tx_motor_seq, num_rows="dynamic", hide_index=True, use_container_width=True,
+                                column_config={'Start Method': st.column_config.SelectboxColumn(options=list(MOTOR_START_OPTIONS))},
+                                key="tx_seq_editor")
+        gen_res = st.session_state.get('gen_results') or {}
+        sq1, sq2, sq3 = st.columns(3)
+        with sq1:
+            seq_base = st.number_input("Base Load Before Sequence (kVA)", value=0.0, min_value=0.0, step=10.0, key="tx_seq_base")
+            seq_tx_kva = st.selectbox("Transformer (kVA)", R10_SERIES, index=R10_SERIES.index(st.session_state.tx_results['selected_kva'])
+                                      if st.session_state.get('tx_results') else R10_SERIES.index(630), key="tx_seq_kva")
+        with sq2:
+            seq_gen_kva = st.selectbox("Generator (kVA)", GEN_RATINGS, index=GEN_RATINGS.index(gen_res['selected_kva'])
+                                       if gen_res.get('selected_kva') in GEN_RATINGS else GEN_RATINGS.index(500), key="tx_seq_gen_kva")
+            seq_xd = st.number_input("Generator Xd'' (%)", value=float(gen_res.get('xd_pct', 15.0)), min_value=8.0, max_value=30.0, step=0.5, key="tx_seq_xd")
+        with sq3:
+            seq_tx_lim = st.number_input("Transformer Dip Limit (%)", value=15.0, min_value=1.0, step=1.0, key="tx_seq_txlim")
+            seq_gen_lim = st.number_input("Generator Dip Limit (%)", value=float(gen_res.get('vd_limit', 20.0)), min_value=1.0, step=1.0, key="tx_seq_genlim")
+            seq_n = st.number_input("Orders to Evaluate", value=5000, min_value=100, max_value=200000, step=1000, key="tx_seq_n")
+        
+        if st.button("OPTIMISE START SEQUENCE", use_container_width=True, key="tx_seq_run"):
+            seq_df = seq_df.dropna(subset=['kW', 'PF', 'Start Time (s)'])
+            if seq_df.empty:
+                st.warning("Add at least one motor.")
+            else:
+                st.session_state.tx_motor_seq = seq_df
+                seq = MotorStartSequence(seq_df, seq_base, seq_tx_kva, tx_impedance, lv_voltage, seq_gen_kva, seq_xd, seq_tx_lim, seq_gen_lim)
+                st.session_state.tx_seq_result = seq.optimise(int(seq_n), seed=1)
+        
+        if st.session_state.get('tx_seq_result'):
+            sr = st.session_state.tx_seq_result
+            q1, q2, q3 = st.columns(3)
+            q1.metric("Orders Evaluated", f"{sr['evaluated']:,}", f"{sr['feasible']:,} within limits")
+            q2.metric("Worst Transformer Dip", f"{sr['worst_tx']:.2f} %", f"{sr['worst_tx'] - sr['as_entered_worst'][0]:+.2f} vs as entered", delta_color="inverse")
+            q3.metric("Worst Generator Dip", f"{sr['worst_gen']:.2f} %", f"{sr['worst_gen'] - sr['as_entered_worst'][1]:+.2f} vs as entered", delta_color="inverse")
+            st.dataframe(sr['table'], hide_index=True, use_container_width=True)
+            if sr['feasible'] == 0:
+                st.error("No evaluated order keeps every step within the limits - consider soft starters / VFDs or a larger source.")
+    
+    with st.expander("Transformer Losses & TCO (load profile)"):
+        st.info("No-load and load losses per rating come from the local catalogue file (or an uploaded one) and are integrated "
+                "over the uploaded load profile - or a flat year at the operating load when no profile is loaded.")
+        tco_file = st.file_uploader("Loss Catalogue CSV (Rating (kVA), No-Load Loss (W), Load Loss (W), Price)", type=['csv'], key="tx_tco_cat")
+        tc1, tc2, tc3, tc4 = st.columns(4)
+        with tc1:
+            tco_price = st.number_input("Energy Price (per kWh)", value=0.15, min_value=0.0, step=0.01, format="%.3f", key="tx_tco_price")
+        with tc2:
+            tco_rate = st.number_input("Discount Rate (%)", value=8.0, min_value=0.0, max_value=30.0, step=0.5, key="tx_tco_rate")
+        with tc3:
+            tco_years = st.number_input("Evaluation Period (years)", value=25, min_value=1, max_value=60, step=1, key="tx_tco_years")
+        with tc4:
+            tco_larger = st.number_input("Larger Ratings to Compare", value=4, min_value=0, max_value=10, step=1, key="tx_tco_larger")
+        
+        if st.button("COMPARE TCO", use_container_width=True, key="tx_tco_run"):
+            try:
+                loss_model = TransformerLossModel.load(tco_file) if tco_file is not None else TransformerLossModel.load()
+                lp = st.session_state.get('tx_profile') or LoadProfile(np.full(8760, op_p), pf=pf, source="Flat operating load")
+                if lp.q.sum() == 0 and pf < 1.0:
+                    lp = LoadProfile(lp.p, pf=pf, step_h=lp.step_h, source=lp.source)
+                # Candidates start from the page's required kVA - the profile only integrates the losses
+                req = tx_calc.harmonic_derated_kva(pk_s * loading_factor * 1.2, factor_k)
+                st.session_state.tx_tco = loss_model.evaluate(lp, req, tco_price, tco_rate, int(tco_years), int(tco_larger))
+                st.session_state.tx_tco['source'] = lp.source
+            except Exception as e:
+                st.error(f"Error evaluating losses: {str(e)}")
+        
+        if st.session_state.get('tx_tco'):
+            tco = st.session_state.tx_tco
+            st.caption(f"Profile: {tco['source']}")
+            st.dataframe(tco['table'], hide_index=True, use_container_width=True)
+            if tco['tco_kva'] is not None:
+                st.success(f"R10 selection {tco['selected_kva']} kVA | Lowest TCO: {tco['tco_kva']} kVA")
+                st.bar_chart(tco['table'].set_index('Rating (kVA)')[['Price', 'Capitalised Losses']])
+
 # ========== GENERATOR SIZING TAB ==========
 
 elif st.session_state.selected_calculator == "Generator Sizing":
@@ -3347,22 +6267,37 @@ elif st.session_state.selected_calculator == "Generator Sizing":
     st.markdown("### Step 1: Enter Load Data")
     st.info("Enter total Running Load (kW) and System PF - kVA auto-calculated")
     
+    sheet_key, sheet_agg = LoadSheetAggregator.cached(st.session_state.universal_loads, st.session_state.load_agg_cache)
+    with st.expander("Load Sheet Aggregation (per voltage bus)"):
+        st.dataframe(sheet_agg, hide_index=True, use_container_width=True)
+        gen_buses = sheet_agg['Bus (V)'].tolist()
+        gen_lv = [b for b in gen_buses if b <= 1000]
+        gen_sheet_bus = st.selectbox("Bus Fed by Generator (V)", gen_buses, index=gen_buses.index(gen_lv[0]) if gen_lv else 0, key="gen_sheet_bus") if gen_buses else None
+        gen_sheet_follow = st.checkbox("Feed load data from the load sheet", value=True, key="gen_sheet_follow")
+    if gen_sheet_follow and gen_sheet_bus is not None and st.session_state.get('gen_sheet_fed') != (sheet_key, gen_sheet_bus):
+        st.session_state.gen_feed = LoadSheetAggregator.bus_feed(sheet_agg, gen_sheet_bus)
+        for k in ['gen_rp', 'gen_pf', 'gen_mp', 'gen_mpf']:
+            st.session_state.pop(k, None)
+        st.session_state.gen_sheet_fed = (sheet_key, gen_sheet_bus)
+    
     col1, col2, col3 = st.columns([1, 1, 1])
     
     with col1:
         st.markdown("**Running Load**")
-        gen_running_p = st.number_input("Running Load P (kW)", value=300.0, step=10.0, key="gen_rp")
+        gen_running_p = st.number_input("Running Load P (kW)", value=st.session_state.get('gen_feed', {}).get('op_p', 300.0), step=10.0, key="gen_rp")
         gen_efficiency = st.number_input("Generator Efficiency", value=0.95, min_value=0.7, max_value=1.0, step=0.01, format="%.2f", key="gen_eff")
         st.caption("Efficiency = Mechanical Power / Electrical Power")
     
     with col2:
         st.markdown("**Standby/Largest Motor**")
-        gen_motor_p = st.number_input("Largest Motor P (kW)", value=75.0, step=1.0, key="gen_mp")
-        gen_motor_pf = st.number_input("Motor PF", value=0.85, min_value=0.5, max_value=1.0, step=0.01, key="gen_mpf")
+        gen_motor_p = st.number_input("Largest Motor P (kW)", value=st.session_state.get('gen_feed', {}).get('motor_kw', 75.0), step=1.0, key="gen_mp")
+        gen_motor_pf = st.number_input("Motor PF", value=st.session_state.get('gen_feed', {}).get('motor_pf', 0.85), min_value=0.5, max_value=1.0, step=0.01, key="gen_mpf")
+        if st.session_state.get('gen_feed', {}).get('no_motor'):
+            st.caption(f"No motor loads are flagged on the {gen_sheet_bus} V bus - Largest Motor set to 0 kW.")
     
     with col3:
         st.markdown("**System PF & Parameters**")
-        gen_pf = st.number_input("System Power Factor", value=0.84, min_value=0.5, max_value=1.0, step=0.01, key="gen_pf")
+        gen_pf = st.number_input("System Power Factor", value=st.session_state.get('gen_feed', {}).get('pf', 0.84), min_value=0.5, max_value=1.0, step=0.01, key="gen_pf")
         gen_spare_margin_pct = st.number_input("Spare Margin (%)", value=20, step=5, key="gen_margin")
         gen_loading_factor = st.number_input("Loading Factor", value=1.2, min_value=1.0, max_value=2.0, step=0.05, key="gen_loading")
         st.markdown(f"Spare Margin = {gen_spare_margin_pct}% | Loading Factor = {gen_loading_factor:.2f}")
@@ -3388,27 +6323,13 @@ elif st.session_state.selected_calculator == "Generator Sizing":
 </div>
 """, unsafe_allow_html=True)
     
-    # Standard generator ratings
-    GEN_RATINGS = [10, 15, 20, 30, 40, 50, 63, 75, 100, 125, 150, 200, 250, 315, 400, 500, 625, 750, 1000, 1250, 1500, 1875, 2000, 2500]
-    
-    def get_gen_rating(required_kva):
-        for rating in GEN_RATINGS:
-            if rating >= required_kva:
-                return rating
-        return GEN_RATINGS[-1]
-    
     st.markdown("---")
     st.markdown("### Step 2: Motor Starting Check")
     
     col_m1, col_m2 = st.columns([1, 1])
     
     with col_m1:
-        gen_start_options = {
-            "DOL": 650,
-            "Star-Delta (Y-Delta)": 350,
-            "Soft Starter": 400,
-            "VFD": 150
-        }
+        gen_start_options = MOTOR_START_OPTIONS
         gen_start_method = st.selectbox(
             "Starting Method", list(gen_start_options.keys()), index=1, key="gen_start_method"
         )
@@ -3666,6 +6587,83 @@ elif st.session_state.selected_calculator == "Generator Sizing":
                     except Exception as e:
                         st.error(f"Error generating Word document: {str(e)}")
                         st.code(traceback.format_exc())
+    
+    with st.expander("Step-Load Transient Simulation (governor, AVR, Xd'')"):
+        st.info("Every standard rating is simulated together through the load acceptance sequence: a PI governor with engine lag "
+                "drives the swing equation, the AVR restores the Xd'' voltage dip. Limits default to ISO 8528-5 class G2.")
+        gr = st.session_state.get('gen_results') or {}
+        if 'gen_steps' not in st.session_state:
+            base_kw = gr.get('input_p', 300.0) - gr.get('motor_power', 75.0)
+            st.session_state.gen_steps = pd.DataFrame({
+                'Step': ["Base load", "Largest motor"],
+                'Time (s)': [1.0, 11.0],
+                'Load (kW)': [round(base_kw, 1), gr.get('motor_power', 75.0)],
+                'Step kVA': [round(base_kw / gr.get('pf', 0.84), 1), round(gr.get('starting_kva', 75.0 / 0.85 * 3.5), 1)]
+            })
+        steps_df = st.data_editor(st.session_state.gen_steps, num_rows="dynamic", hide_index=True, use_container_width=True, key="gen_steps_editor")
+        gt1, gt2, gt3, gt4 = st.columns(4)
+        with gt1:
+            gt_xd = st.number_input("Xd'' (%)", value=float(gr.get('xd_pct', 15.0)), min_value=8.0, max_value=30.0, step=0.5, key="gen_tr_xd")
+            gt_H = st.number_input("Inertia Constant H (s)", value=1.0, min_value=0.1, max_value=10.0, step=0.1, key="gen_tr_h")
+        with gt2:
+            gt_te = st.number_input("Engine Time Constant (s)", value=0.25, min_value=0.05, max_value=5.0, step=0.05, key="gen_tr_te")
+            gt_tavr = st.number_input("AVR Time Constant (s)", value=0.4, min_value=0.05, max_value=5.0, step=0.05, key="gen_tr_tavr")
+        with gt3:
+            gt_kp = st.number_input("Governor Kp", value=8.0, min_value=0.1, step=0.5, key="gen_tr_kp")
+            gt_ki = st.number_input("Governor Ki", value=4.0, min_value=0.0, step=0.5, key="gen_tr_ki")
+        with gt4:
+            gt_fdip = st.number_input("Frequency Dip Limit (%)", value=ISO8528_G2_LIMITS['freq_dip'], min_value=1.0, step=0.5, key="gen_tr_fdip")
+            gt_vdip = st.number_input("Voltage Dip Limit (%)", value=float(gr.get('vd_limit', ISO8528_G2_LIMITS['volt_dip'])), min_value=1.0, step=1.0, key="gen_tr_vdip")
+        
+        if st.button("SIMULATE LOAD ACCEPTANCE", use_container_width=True, key="gen_tr_run"):
+            steps_df = steps_df.dropna(subset=['Time (s)', 'Load (kW)', 'Step kVA'])
+            if steps_df.empty:
+                st.warning("Add at least one load step.")
+            else:
+                st.session_state.gen_steps = steps_df
+                sim = GeneratorTransientSimulator(xd_pct=gt_xd, H=gt_H, T_engine=gt_te, Kp=gt_kp, Ki=gt_ki, T_avr=gt_tavr,
+                                                  limits={'freq_dip': gt_fdip, 'volt_dip': gt_vdip})
+                st.session_state.gen_transient = sim.evaluate(steps_df)
+        
+        if st.session_state.get('gen_transient'):
+            tr = st.session_state.gen_transient
+            st.dataframe(tr['table'], hide_index=True, use_container_width=True)
+            if tr['selected_kva'] is None:
+                st.error("No standard rating accepts this load sequence - split the load into smaller steps.")
+            else:
+                st.success(f"Smallest rating accepting the load sequence: {tr['selected_kva']} kVA")
+                b = tr['best_index']
+                st.line_chart(pd.DataFrame({'Frequency (%)': tr['freq'][:, b] * 100.0, 'Voltage (%)': tr['volt'][:, b] * 100.0},
+                                           index=pd.Index(np.round(tr['t'], 2), name='Time (s)')))
+    
+    with st.expander("Paralleled Generators & N+1 Redundancy"):
+        st.info("Searches every standard unit rating and unit count for the cheapest paralleled sets that carry the load "
+                "and keep the motor starting dip within limit with the redundant units out of service.")
+        gr = st.session_state.get('gen_results') or {}
+        gp1, gp2, gp3 = st.columns(3)
+        with gp1:
+            gp_req = st.number_input("Required Running kVA", value=float(round(gr.get('required_kva', 500.0), 1)), min_value=1.0, step=10.0, key="gen_par_req")
+            gp_start = st.number_input("Largest Starting kVA", value=float(round(gr.get('starting_kva', 300.0), 1)), min_value=0.0, step=10.0, key="gen_par_start")
+        with gp2:
+            gp_red = st.selectbox("Redundancy", [0, 1, 2], index=1, format_func=lambda n: f"N+{n}" if n else "N (none)", key="gen_par_red")
+            gp_max = st.number_input("Max Units per Bus", value=8, min_value=1, max_value=16, step=1, key="gen_par_max")
+        with gp3:
+            gp_xd = st.number_input("Xd'' (%)", value=float(gr.get('xd_pct', 15.0)), min_value=8.0, max_value=30.0, step=0.5, key="gen_par_xd")
+            gp_lim = st.number_input("Voltage Dip Limit (%)", value=float(gr.get('vd_limit', 20.0)), min_value=1.0, step=1.0, key="gen_par_lim")
+        gp_sync = st.number_input("Synchronising Gear Cost per Paralleled Unit", value=GEN_PARALLEL_COST_PER_UNIT, min_value=0.0, step=500.0, key="gen_par_sync")
+        
+        if st.button("FIND PARALLEL CONFIGURATIONS", use_container_width=True, key="gen_par_run"):
+            sizer = GeneratorParallelSizer(gp_req, gp_start, gp_xd, gp_lim, gp_red, gp_max, parallel_cost=gp_sync)
+            st.session_state.gen_parallel = sizer.search()
+        
+        if st.session_state.get('gen_parallel'):
+            gpr = st.session_state.gen_parallel
+            st.caption(f"{gpr['evaluated']} of {gpr['combinations']} rating/count combinations checked after bounding")
+            if gpr['table'].empty:
+                st.error("No configuration within the unit limit - allow more units per bus or relax the dip limit.")
+            else:
+                st.dataframe(gpr['table'], hide_index=True, use_container_width=True)
+                st.success(f"Cheapest: {gpr['table']['Configuration'].iloc[0]}")
 
 # Init session state for Generator
 if 'gen_calc_done' not in st.session_state:
@@ -3687,16 +6685,20 @@ elif st.session_state.selected_calculator == "Earthing":
         st.session_state.ear_cond = None
     if 'ear_results' not in st.session_state:
         st.session_state.ear_results = None
+    if 'ear_details' not in st.session_state:
+        st.session_state.ear_details = None
+    if 'ear_trace' not in st.session_state:
+        st.session_state.ear_trace = []
     
-    ear_tabs = st.tabs(["Input Data", "Detailed Calculations", "Results Summary", "Download Report"])
+    ear_tabs = st.tabs(["Input Data", "Detailed Calculations", "Results Summary", "Grid Design (IEEE 80)", "Download Report"])
     
     with ear_tabs[0]:
         st.markdown("### \u2460 Conductor Sizing Inputs")
         col1, col2, col3 = st.columns(3)
         with col1:
             mat = st.selectbox("Conductor Material", ["Copper", "Aluminium", "Steel"], key="ear_mat")
-            mat_k = {"Copper": 226, "Aluminium": 148, "Steel": 78}
-            mat_beta = {"Copper": 234.5, "Aluminium": 228, "Steel": 202}
+            mat_k = EARTH_MAT_K
+            mat_beta = EARTH_MAT_BETA
             st.info(f"K = {mat_k[mat]}, \u03b2 = {mat_beta[mat]}")
         with col2:
             T1 = st.number_input("T\u2081 - Initial Temp (\u00b0C)", value=30.0, step=5.0, key="ear_t1")
@@ -3705,6 +6707,33 @@ elif st.session_state.selected_calculator == "Earthing":
             I_f = st.number_input("Fault Current I (kA)", value=25.0, step=1.0, key="ear_if")
             t_f = st.number_input("Fault Duration t (sec)", value=0.5, min_value=0.1, step=0.1, key="ear_tf")
         
+        with st.expander("Conductor Sizing Sweep (fault levels / clearing times)"):
+            if 'ear_buses' not in st.session_state:
+                st.session_state.ear_buses = pd.DataFrame({
+                    'Bus': ['MV Switchboard', 'LV Main', 'MCC-1'],
+                    'Material': ['Copper', 'Copper', 'Steel'],
+                    'I (kA)': [25.0, 40.0, 15.0], 't (s)': [1.0, 0.5, 0.5],
+                })
+            sw1, sw2 = st.columns(2)
+            with sw1:
+                st.markdown("**Per-Bus Sizing**")
+                buses = st.data_editor(st.session_state.ear_buses, num_rows="dynamic", hide_index=True, use_container_width=True,
+                                       column_config={'Material': st.column_config.SelectboxColumn(options=list(EARTH_MAT_K))},
+                                       key="ear_bus_editor")
+                buses = buses.dropna(subset=['Material', 'I (kA)', 't (s)'])
+                if not buses.empty:
+                    st.dataframe(EarthingCalculator.conductor_size_table(buses, T1, T2), hide_index=True, use_container_width=True)
+            with sw2:
+                st.markdown(f"**Sweep Table - {mat}** (selected size, mm\u00b2)")
+                r1, r2, r3 = st.columns(3)
+                i_lo = r1.number_input("I from (kA)", value=5.0, min_value=0.1, step=5.0, key="ear_sw_ilo")
+                i_hi = r2.number_input("I to (kA)", value=50.0, min_value=0.1, step=5.0, key="ear_sw_ihi")
+                i_st = r3.number_input("I step (kA)", value=5.0, min_value=0.1, step=1.0, key="ear_sw_ist")
+                sw_t = st.multiselect("Durations (s)", [0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 3.0], default=[0.2, 0.5, 1.0, 3.0], key="ear_sw_t")
+                if sw_t and i_hi >= i_lo:
+                    currents = np.round(np.arange(i_lo, i_hi + i_st / 2, i_st), 3)
+                    st.dataframe(EarthingCalculator.conductor_size_sweep(mat, T1, T2, currents, sorted(sw_t)), use_container_width=True)
+        
         st.markdown("---")
         st.markdown("### \u2461 Area / Structure Inputs")
         st.info("Add areas below. Each area gets its own earthing calculation. Click CALCULATE when done.")
@@ -3721,7 +6750,7 @@ elif st.session_state.selected_calculator == "Earthing":
                     st.session_state.ear_areas = st.session_state.ear_areas[:-1]
                     st.rerun()
         
-        method_opts = ["Hollow Square", "Multiple Rods in Line", "Single Rod", "Plate Earthing"]
+        method_opts = ["Hollow Square", "Multiple Rods in Line", "Single Rod", "Plate Earthing", "Rod Grid (Matrix)"]
         df = st.session_state.ear_areas
         
         for idx in range(len(df)):
@@ -3736,12 +6765,12 @@ elif st.session_state.selected_calculator == "Earthing":
                 Lv = st.number_input("L (m)", value=float(a['L']), step=0.5, key=f"eaL_{idx}")
                 dv = st.number_input("d (mm)", value=float(a['d']), step=1.0, key=f"ead_{idx}")
             with c3:
-                if meth == "Hollow Square":
+                if meth in ["Hollow Square", "Rod Grid (Matrix)"]:
                     pl = st.number_input("Plot L (m)", value=float(a['Plot_L']) if a['Plot_L']>0 else 70.0, step=5.0, key=f"eapl_{idx}")
                     pw = st.number_input("Plot W (m)", value=float(a['Plot_W']) if a['Plot_W']>0 else 40.0, step=5.0, key=f"eapw_{idx}")
                 else:
                     pl, pw = 0.0, 0.0
-                if meth in ["Hollow Square", "Multiple Rods in Line"]:
+                if meth in ["Hollow Square", "Multiple Rods in Line", "Rod Grid (Matrix)"]:
                     sv = st.number_input("Spacing s (m)", value=float(a['s']), min_value=1.0, step=1.0, key=f"eas_{idx}")
                 else:
                     sv = 0.0
@@ -3761,47 +6790,122 @@ elif st.session_state.selected_calculator == "Earthing":
         st.session_state.ear_areas = df
         
         if st.button("CALCULATE EARTHING", type="primary", use_container_width=True):
-            K = mat_k[mat]; beta = mat_beta[mat]
-            k_val = K * math.sqrt(math.log((T2 + beta) / (T1 + beta)))
-            s_req = (I_f * 1000 * math.sqrt(t_f)) / k_val
-            avail = [16, 25, 35, 50, 70, 95, 120, 150, 185, 240, 300, 400]
-            sel_s = next((s for s in avail if s >= s_req), avail[-1])
+            st.session_state.ear_cond = EarthingCalculator.conductor_size(mat, T1, T2, I_f, t_f)
+            st.session_state.ear_results, st.session_state.ear_details = EarthingCalculator.calculate_areas(df)
+            st.session_state.ear_trace = EarthingTrace.from_calculation(st.session_state.ear_results, st.session_state.ear_details)
+            st.session_state.ear_mc = None
+            st.session_state.ear_epr = None
+            st.session_state.ear_bond = None
+            st.success("Calculation complete! View results in other tabs.")
+        
+        with st.expander("Layout Optimizer (minimum-cost passing design)"):
+            st.info("Searches rod length, diameter, count, spacing and method for the cheapest layout that meets the target resistance. "
+                    "Grid candidates can also be checked against IEEE 80 touch/step limits using the fault inputs above.")
+            oc1, oc2, oc3 = st.columns(3)
+            with oc1:
+                opt_area = st.selectbox("Area", list(range(len(df))), format_func=lambda i: df.iloc[i]['Name'], key="opt_area")
+                opt_target = st.number_input("Target R (Ω)", value=EARTH_RESISTANCE_LIMIT, min_value=0.1, step=0.5, key="opt_target")
+                opt_methods = st.multiselect("Methods", ["Single Rod", "Multiple Rods in Line", "Hollow Square", "Grid (IEEE 80)"],
+                                             default=["Single Rod", "Multiple Rods in Line", "Hollow Square"], key="opt_methods")
+            with oc2:
+                opt_pit = st.number_input("Cost per Rod / Pit", value=EARTH_PIT_COST, min_value=0.0, step=10.0, key="opt_pit")
+                opt_cond = st.number_input("Conductor Cost per m", value=EARTH_CONDUCTOR_COST_PER_M, min_value=0.0, step=1.0, key="opt_cond")
+                opt_max_n = st.number_input("Max Rods", value=60, min_value=2, step=5, key="opt_max_n")
+            with oc3:
+                opt_rod_cost = st.data_editor(pd.DataFrame({'d (mm)': list(EARTH_ROD_COST_PER_M), 'Cost per m': list(EARTH_ROD_COST_PER_M.values())}),
+                                              hide_index=True, use_container_width=True, key="opt_rod_cost")
+                opt_touch = st.checkbox("Apply IEEE 80 touch/step limits to grids", key="opt_touch")
             
-            st.session_state.ear_cond = {
-                "mat": mat, "K": K, "beta": beta, "T1": T1, "T2": T2,
-                "k_val": round(k_val, 1), "I": I_f, "t": t_f,
-                "s_req": round(s_req, 1), "selected": sel_s
-            }
+            if st.button("FIND CHEAPEST LAYOUT", use_container_width=True, key="opt_run"):
+                a = df.iloc[opt_area]
+                fault = None
+                if opt_touch:
+                    grid_cond = EarthingCalculator.conductor_size(mat, T1, T2, I_f, t_f)
+                    fault = {'I_g': I_f * 1000 * st.session_state.get('grid_sf', 0.6) * st.session_state.get('grid_df', 1.0), 't_s': t_f,
+                             'rho_s': st.session_state.get('grid_rhos', 2500.0), 'h_s': st.session_state.get('grid_hs', 0.102),
+                             'h': st.session_state.get('grid_h', 0.5), 'd_c': float(GroundingGridDesigner.conductor_diameter(grid_cond['selected'])),
+                             'body_kg': st.session_state.get('grid_body', 70)}
+                optimizer = EarthingLayoutOptimizer(float(a['rho']), opt_target, float(a['Plot_L']), float(a['Plot_W']),
+                                                    dict(zip(opt_rod_cost['d (mm)'], opt_rod_cost['Cost per m'])), opt_pit, opt_cond, fault)
+                with st.spinner("Searching layouts..."):
+                    st.session_state.ear_opt = optimizer.search(methods=opt_methods, diameters=tuple(opt_rod_cost['d (mm)']),
+                                                                counts=tuple(range(0, int(opt_max_n) + 1)))
+                st.session_state.ear_opt['area'] = opt_area
             
-            results = []
-            for idx, area in df.iterrows():
-                rho_v = area['rho']; L_v = area['L']; d_m = area['d'] / 1000.0
-                s_v = area['s']; method = area['Method']
-                pl = area['Plot_L']; pw = area['Plot_W']; n_r = int(area['n_rods'])
-                
-                Rr = (rho_v / (2 * math.pi * L_v)) * (math.log(8 * L_v / d_m) - 1) if L_v > 0 and d_m > 0 else 0
-                
-                if method == "Single Rod":
-                    Rf = Rr
-                elif method == "Hollow Square":
-                    perim = 2 * (pl + pw); N_val = perim / s_v; n_small = N_val / 4 + 1
-                    nf = int(n_small); lt = {2:2.71,3:4.51,4:5.46,5:6.14,6:6.63,7:7.03,8:7.30,9:7.65,10:7.90,12:8.22,14:8.67,16:8.95,18:9.22,20:9.40}
-                    lam = lt.get(nf, 5.46) if nf <= 20 else 2 * math.log(1.781 * nf / 2.718)
-                    alpha = rho_v / (2 * math.pi * Rr * s_v) if s_v > 0 else 0
-                    Rf = Rr * ((1 + lam * alpha) / N_val)
-                elif method == "Multiple Rods in Line":
-                    lam = 2 * sum(1/i for i in range(2, n_r + 1))
-                    Rf = (1/n_r) * (rho_v / (2 * math.pi * L_v)) * (math.log(8 * L_v / d_m) - 1 + (lam * L_v / s_v))
-                elif method == "Plate Earthing":
-                    Rf = (rho_v / 4) * math.sqrt(math.pi / 1.0)
+            if st.session_state.get('ear_opt'):
+                res = st.session_state.ear_opt
+                st.caption(f"{res['candidates']} candidate layouts, {res['evaluated']} evaluated after pruning")
+                if res['table'].empty:
+                    st.warning("No layout in the search space meets the target. Increase Max Rods or check the plot size.")
                 else:
-                    Rf = 0
-                
-                status = "PASS" if Rf < 5 else "FAIL"
-                results.append({"Area": area['Name'], "Method": method, "R": round(Rf, 3), "Status": status})
+                    st.dataframe(res['table'], hide_index=True, use_container_width=True)
+                    rod_rows = res['table'][res['table']['Method'] != "Grid (IEEE 80)"]
+                    if not rod_rows.empty and st.button("Apply Cheapest Rod Layout to Area", key="opt_apply"):
+                        best = rod_rows.iloc[0]
+                        i = res['area']
+                        df.at[i, 'Method'] = best['Method']; df.at[i, 'L'] = best['L (m)']; df.at[i, 'd'] = best['d (mm)']
+                        df.at[i, 's'] = best['s (m)'] if best['s (m)'] > 0 else df.at[i, 's']
+                        df.at[i, 'n_rods'] = int(best['Rods'])
+                        st.session_state.ear_areas = df
+                        # Widget state would otherwise override the applied values on rerun
+                        for k in [f"eam_{i}", f"eaL_{i}", f"ead_{i}", f"eas_{i}", f"eanr_{i}"]:
+                            st.session_state.pop(k, None)
+                        st.rerun()
+        
+        with st.expander("Soil Model from Wenner Survey (two-layer)"):
+            st.info("Enter Wenner four-pin readings (spacing and measured resistance). A two-layer model (ρ₁, ρ₂, h) is fitted "
+                    "and its equivalent resistivity over the electrode depth is applied to the selected area or the grid design.")
+            if 'soil_survey' not in st.session_state:
+                st.session_state.soil_survey = pd.DataFrame({
+                    'Spacing a (m)': [0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0],
+                    'Resistance R (Ω)': [29.5, 15.4, 8.6, 6.6, 5.1, 4.3, 3.7, 3.0, 2.4],
+                })
+            if 'soil_fit_cache' not in st.session_state:
+                st.session_state.soil_fit_cache = {}
+            sv_file = st.file_uploader("Survey CSV (Spacing a (m), Resistance R (Ω) or Apparent ρ (Ω.m))", type=['csv'], key="soil_file")
+            if sv_file is not None:
+                st.session_state.soil_survey = pd.read_csv(sv_file)
+            survey = st.data_editor(st.session_state.soil_survey, num_rows="dynamic", hide_index=True, use_container_width=True, key="soil_editor")
             
-            st.session_state.ear_results = pd.DataFrame(results)
-            st.success("Calculation complete! View results in other tabs.")
+            if st.button("FIT SOIL MODEL", use_container_width=True, key="soil_fit_btn"):
+                a_s, rho_s = TwoLayerSoilModel.survey_to_rho(survey)
+                if len(a_s) < 3:
+                    st.error("At least three valid readings are needed for a two-layer fit.")
+                else:
+                    st.session_state.soil_survey = survey
+                    st.session_state.soil_model = TwoLayerSoilModel.fit(a_s, rho_s, st.session_state.soil_fit_cache)
+                    st.session_state.soil_points = (a_s, rho_s)
+            
+            if st.session_state.get('soil_model'):
+                sm = st.session_state.soil_model
+                a_s, rho_s = st.session_state.soil_points
+                s1, s2, s3, s4 = st.columns(4)
+                s1.metric("ρ₁ (Ω.m)", f"{sm.rho1:.1f}")
+                s2.metric("ρ₂ (Ω.m)", f"{sm.rho2:.1f}")
+                s3.metric("Top Layer h (m)", f"{sm.h:.2f}")
+                s4.metric("RMS Error", f"{sm.rms_pct:.1f} %")
+                a_plot = np.geomspace(a_s.min(), a_s.max(), 60)
+                st.line_chart(pd.DataFrame({'Fitted ρa': sm.curve(a_plot),
+                                            'Measured ρa': np.interp(a_plot, a_s, rho_s)}, index=a_plot))
+                
+                ap1, ap2 = st.columns(2)
+                with ap1:
+                    soil_area = st.selectbox("Area", list(range(len(df))), format_func=lambda i: df.iloc[i]['Name'], key="soil_area")
+                    rho_area = sm.equivalent_rho(float(df.iloc[soil_area]['L']))
+                    st.caption(f"Equivalent ρ over rod length {df.iloc[soil_area]['L']} m = {rho_area:.2f} Ω.m")
+                    if st.button("Apply to Area", key="soil_apply_area"):
+                        df.at[soil_area, 'rho'] = round(rho_area, 2)
+                        st.session_state.ear_areas = df
+                        st.session_state.pop(f"ear_{soil_area}", None)
+                        st.rerun()
+                with ap2:
+                    grid_depth = st.session_state.get('grid_h', 0.5) + st.session_state.get('grid_lr', 7.5)
+                    rho_grid = sm.equivalent_rho(grid_depth)
+                    st.caption(f"Equivalent ρ over grid depth + rod length {grid_depth:.2f} m = {rho_grid:.2f} Ω.m")
+                    if st.button("Apply to Grid Design", key="soil_apply_grid"):
+                        st.session_state.grid_rho_fitted = round(rho_grid, 2)
+                        st.session_state.pop('grid_rho', None)
+                        st.rerun()
     
     with ear_tabs[1]:
         st.markdown("### Detailed Calculations")
@@ -3813,88 +6917,31 @@ elif st.session_state.selected_calculator == "Earthing":
                 with st.expander("Conductor Sizing (BS 7430 Section 9.7)", expanded=True):
                     st.markdown(f'<div class="formula-box">', unsafe_allow_html=True)
                     st.markdown(f"**Material:** {c['mat']} (K = {c['K']}, \u03b2 = {c['beta']})")
-                    st.markdown("---")
-                    st.markdown(f"**Step 1: Current Density Factor k**")
-                    st.markdown(f"**Formula:** k = K x \u221a(ln((T\u2082 + \u03b2)/(T\u2081 + \u03b2)))")
-                    st.markdown(f"k = {c['K']} x \u221a(ln(({c['T2']} + {c['beta']})/({c['T1']} + {c['beta']})))")
-                    st.markdown(f"**k = {c['k_val']} A/mm\u00b2**")
-                    st.markdown("---")
-                    st.markdown(f"**Step 2: Minimum Cross-Sectional Area s**")
-                    st.markdown(f"**Formula:** s = (I x 1000 x \u221at) / k")
-                    st.markdown(f"s = ({c['I']} x 1000 x \u221a{c['t']}) / {c['k_val']}")
-                    st.markdown(f"**s = {c['s_req']} mm\u00b2**")
+                    for i, step in enumerate(EarthingTrace.conductor_steps(c, EARTH_TRACE_UNICODE)):
+                        st.markdown("---")
+                        st.markdown(f"**Step {i+1}: {step['title']}**")
+                        st.markdown(f"**Formula:** {step['formula']}")
+                        for line in step['lines']:
+                            st.markdown(line)
+                        st.markdown(f"**{step['result']}**")
                     st.markdown(f"**Selected Conductor = {c['selected']} mm\u00b2 {c['mat']}**")
                     st.markdown('</div>', unsafe_allow_html=True)
             
-            df = st.session_state.ear_areas
-            for idx, row in st.session_state.ear_results.iterrows():
-                a = df.iloc[idx] if idx < len(df) else None
-                with st.expander(f"{row['Area']} - {row['Method']} - {row['R']} \u03a9", expanded=True):
+            for tr in st.session_state.ear_trace:
+                with st.expander(f"{tr.area} - {tr.method} - {tr.R} \u03a9", expanded=True):
                     st.markdown(f'<div class="formula-box">', unsafe_allow_html=True)
-                    
-                    if row['Method'] == "Hollow Square" and a is not None:
-                        rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                        s_v = a['s']; pl = a['Plot_L']; pw = a['Plot_W']
-                        perim = 2*(pl+pw); N_val = perim/s_v; ns = N_val/4+1
-                        nf = int(ns); lt = {2:2.71,3:4.51,4:5.46,5:6.14,6:6.63,7:7.03,8:7.30,9:7.65,10:7.90,12:8.22,14:8.67,16:8.95,18:9.22,20:9.40}
-                        lam = lt.get(nf,5.46) if nf<=20 else 2*math.log(1.781*nf/2.718)
-                        Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                        alpha = rho_v/(2*math.pi*Rr*s_v) if s_v>0 else 0
-                        
-                        st.markdown(f"**Method:** Hollow Square (BS 7430 Section 9.5.8.5)")
-                        st.markdown(f"**Plot Plan:** {pl:.0f}m x {pw:.0f}m")
-                        st.markdown(f"**Perimeter** = 2 x ({pl:.0f} + {pw:.0f}) = **{perim:.0f} m**")
-                        st.markdown(f"**N** = Perimeter / s = {perim:.0f} / {s_v} = **{N_val:.1f}**")
-                        st.markdown(f"**n** = N/4 + 1 = {N_val:.1f}/4 + 1 = **{ns:.1f}**")
-                        st.markdown(f"**\u03bb** (from Table 2, n={ns:.0f}) = **{lam:.3f}**")
+                    st.markdown(f"**Method:** {tr.standard}")
+                    st.markdown(" | ".join(tr.inputs(EARTH_TRACE_UNICODE)))
+                    for step in tr.steps(EARTH_TRACE_UNICODE):
                         st.markdown("---")
-                        st.markdown(f"**Step 1: Single Rod Resistance Rr**")
-                        st.markdown(f"Rr = \u03c1/(2\u03c0L) x [ln(8L/d) - 1]")
-                        st.markdown(f"Rr = {rho_v}/(2\u03c0 x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1] = **{Rr:.3f} \u03a9**")
-                        st.markdown("---")
-                        st.markdown(f"**Step 2: Factor \u03b1**")
-                        st.markdown(f"\u03b1 = \u03c1/(2\u03c0 x Rr x s)")
-                        st.markdown(f"\u03b1 = {rho_v}/(2\u03c0 x {Rr:.3f} x {s_v}) = **{alpha:.4f}**")
-                        st.markdown("---")
-                        st.markdown(f"**Step 3: Total Resistance R\u1d40\u2099\u209c**")
-                        st.markdown(f"R\u1d40\u2099\u209c = Rr x (1 + \u03bb x \u03b1) / N")
-                        st.markdown(f"R\u1d40\u2099\u209c = {Rr:.3f} x (1 + {lam:.3f} x {alpha:.4f}) / {N_val:.1f} = **{row['R']} \u03a9**")
-                    
-                    elif row['Method'] == "Multiple Rods in Line" and a is not None:
-                        rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                        s_v = a['s']; n_r = int(a['n_rods'])
-                        lam = 2*sum(1/i for i in range(2, n_r+1))
-                        Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                        
-                        st.markdown(f"**Method:** Multiple Rods in Line (BS 7430 Section 9.5.4)")
-                        st.markdown(f"**Number of Rods:** n = {n_r} | **Spacing:** s = {s_v} m")
-                        st.markdown("---")
-                        st.markdown(f"**Step 1: Group Factor \u03bb**")
-                        st.markdown(f"\u03bb = 2 x \u03a3(1/2 + 1/3 + ... + 1/{n_r})")
-                        parts = " + ".join([f"1/{i}" for i in range(2, n_r+1)])
-                        st.markdown(f"\u03bb = 2 x ({parts}) = **{lam:.5f}**")
-                        st.markdown("---")
-                        st.markdown(f"**Step 2: Single Rod Resistance Rr**")
-                        st.markdown(f"Rr = \u03c1/(2\u03c0L) x [ln(8L/d) - 1]")
-                        st.markdown(f"Rr = {rho_v}/(2\u03c0 x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1] = **{Rr:.3f} \u03a9**")
-                        st.markdown("---")
-                        st.markdown(f"**Step 3: Total Resistance R\u209c**")
-                        st.markdown(f"R\u209c = 1/n x \u03c1/(2\u03c0L) x [ln(8L/d) - 1 + \u03bbL/s]")
-                        st.markdown(f"R\u209c = 1/{n_r} x {rho_v}/(2\u03c0 x {L_v}) x [ln(8L/d) - 1 + {lam:.5f} x {L_v}/{s_v}] = **{row['R']} \u03a9**")
-                    
-                    elif row['Method'] == "Single Rod" and a is not None:
-                        rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                        Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                        st.markdown(f"**Method:** Single Rod (BS 7430 Section 9.5.3)")
-                        st.markdown(f"Rr = \u03c1/(2\u03c0L) x [ln(8L/d) - 1]")
-                        st.markdown(f"Rr = {rho_v}/(2\u03c0 x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1] = **{Rr:.3f} \u03a9**")
-                    
-                    elif row['Method'] == "Plate Earthing":
-                        st.markdown(f"**Method:** Plate Earthing (BS 7430 Section 9.5.2)")
-                        st.markdown(f"R = \u03c1/4 x \u221a(\u03c0/A)")
-                        st.markdown(f"R = {a['rho']}/4 x \u221a(\u03c0/1.00) = **{row['R']} \u03a9**")
-                    
-                    st.markdown(f"**Status:** {row['R']} \u03a9 < 5 \u03a9 → {'✅ PASS' if row['Status']=='PASS' else '❌ FAIL'}")
+                        st.markdown(f"**{step['title']}**")
+                        if step['formula']:
+                            st.markdown(f"**Formula:** {step['formula']}")
+                        for line in step['lines']:
+                            st.markdown(line)
+                        if step['result']:
+                            st.markdown(f"**{step['result']}**")
+                    st.markdown(f"**{tr.status_line(EARTH_TRACE_UNICODE)}** {'✅' if tr.status == 'PASS' else '❌'}")
                     st.markdown('</div>', unsafe_allow_html=True)
     
     with ear_tabs[2]:
@@ -3915,8 +6962,122 @@ elif st.session_state.selected_calculator == "Earthing":
     <p>Target: < 5 \u03a9 → {'✅ SYSTEM PASS' if all_pass else '❌ FAIL'}</p>
 </div>
 """, unsafe_allow_html=True)
+            
+            with st.expander("Seasonal Resistivity Monte Carlo (probability of exceeding the limit)"):
+                st.info("Soil resistivity is sampled per area (lognormal scatter about the entered ρ) and optionally scaled by a "
+                        "monthly seasonal factor common to the whole site. Resistance scales linearly with ρ for every method.")
+                res_df = st.session_state.ear_results
+                mc1, mc2 = st.columns(2)
+                with mc1:
+                    if 'ear_mc_cov' not in st.session_state or len(st.session_state.ear_mc_cov) != len(res_df):
+                        st.session_state.ear_mc_cov = pd.DataFrame({'Area': res_df['Area'], 'CoV of ρ': 0.3})
+                    mc_cov = st.data_editor(st.session_state.ear_mc_cov, hide_index=True, use_container_width=True,
+                                            disabled=['Area'], key="ear_mc_cov_editor")
+                    mc_n = st.number_input("Samples", value=100_000, min_value=1_000, max_value=5_000_000, step=100_000, key="ear_mc_n")
+                    mc_seed = st.number_input("Random Seed", value=1, min_value=0, step=1, key="ear_mc_seed")
+                with mc2:
+                    mc_season = st.checkbox("Apply seasonal factors", value=True, key="ear_mc_season")
+                    mc_factors = st.data_editor(pd.DataFrame({'Month': list(SEASONAL_RHO_FACTORS), 'Factor': list(SEASONAL_RHO_FACTORS.values())}),
+                                                hide_index=True, use_container_width=True, disabled=['Month'], key="ear_mc_factors")
+                
+                if st.button("RUN MONTE CARLO", use_container_width=True, key="ear_mc_run"):
+                    seasonal = dict(zip(mc_factors['Month'], mc_factors['Factor'])) if mc_season else None
+                    mc = EarthingReliabilityMC(res_df, st.session_state.ear_details, mc_cov['CoV of ρ'].to_numpy(dtype=float), seasonal)
+                    with st.spinner("Sampling soil resistivity..."):
+                        st.session_state.ear_mc = mc.run(int(mc_n), int(mc_seed))
+                
+                if st.session_state.get('ear_mc'):
+                    mc_res = st.session_state.ear_mc
+                    st.dataframe(mc_res['table'], hide_index=True, use_container_width=True)
+                    st.metric("P(bonded system R ≥ limit)", f"{mc_res['system_exceed']:.5f}", help=f"{mc_res['samples']:,} samples")
+            
+            with st.expander("Bonding Network (areas bonded with buried conductors)"):
+                st.info("Each area is a node tied to remote earth through its own resistance. Bonding conductors add series "
+                        "resistance between areas; the combined site resistance and current share are seen from the MET area.")
+                area_names = list(st.session_state.ear_results['Area'])
+                if 'ear_links' not in st.session_state or not set(st.session_state.ear_links['From']).issubset(area_names):
+                    cond_size = st.session_state.ear_cond['selected'] if st.session_state.ear_cond else 70
+                    st.session_state.ear_links = pd.DataFrame({
+                        'From': area_names[:-1], 'To': area_names[1:], 'Length (m)': 50.0,
+                        'Size (mm²)': float(cond_size), 'Material': 'Copper'})
+                links = st.data_editor(st.session_state.ear_links, num_rows="dynamic", hide_index=True, use_container_width=True,
+                                       column_config={'From': st.column_config.SelectboxColumn(options=area_names),
+                                                      'To': st.column_config.SelectboxColumn(options=area_names),
+                                                      'Material': st.column_config.SelectboxColumn(options=list(EARTH_MAT_RESISTIVITY))},
+                                       key="ear_links_editor")
+                bond_met = st.selectbox("Main Earthing Terminal (MET) Area", list(range(len(area_names))),
+                                        format_func=lambda i: area_names[i], key="ear_bond_met")
+                if st.button("SOLVE BONDING NETWORK", use_container_width=True, key="ear_bond_run"):
+                    st.session_state.ear_links = links
+                    try:
+                        net = EarthBondingNetwork(area_names, st.session_state.ear_details['R'], links.dropna())
+                        st.session_state.ear_bond = net.solve(bond_met)
+                    except ValueError as e:
+                        st.session_state.ear_bond = None
+                        st.error(str(e))
+                
+                if st.session_state.get('ear_bond'):
+                    bond = st.session_state.ear_bond
+                    b1, b2 = st.columns(2)
+                    b1.metric(f"Combined R at {bond['met']}", f"{bond['R_combined']:.3f} Ω")
+                    b2.metric("Ideal Parallel R", f"{bond['R_parallel']:.3f} Ω")
+                    st.dataframe(bond['table'], hide_index=True, use_container_width=True)
+                    st.dataframe(bond['links'], hide_index=True, use_container_width=True)
+                    if (bond['table']['Bonding'] != 'OK').any():
+                        st.warning(f"Some areas are not bonded or exceed {BONDING_CONTINUITY_LIMIT} Ω continuity to the MET.")
+            
+            with st.expander("Earth Potential Rise Map Export"):
+                det = st.session_state.ear_details
+                sources_opts = list(range(len(det)))
+                if st.session_state.get('ear_grid'):
+                    sources_opts.append(-1)
+                pm1, pm2, pm3 = st.columns(3)
+                with pm1:
+                    epr_src = st.selectbox("Electrode", sources_opts, key="epr_src",
+                                           format_func=lambda i: "Grid Design (IEEE 80)" if i < 0 else f"{st.session_state.ear_results.iloc[i]['Area']} ({st.session_state.ear_results.iloc[i]['Method']})")
+                    if epr_src >= 0:
+                        epr_i = st.number_input("Earth Fault Current (A)", value=1000.0, min_value=1.0, step=100.0, key="epr_i")
+                with pm2:
+                    epr_n = st.number_input("Grid Points per Side", value=300, min_value=20, max_value=1000, step=50, key="epr_n")
+                    epr_margin = st.number_input("Margin Around Electrode (m)", value=10.0, min_value=1.0, step=5.0, key="epr_margin")
+                with pm3:
+                    epr_fmt = st.radio("Export Format", ["PNG", "NPZ (compressed arrays)"], key="epr_fmt")
+                
+                if st.button("GENERATE EPR MAP", use_container_width=True, key="epr_run"):
+                    with st.spinner("Superposing electrode sources over the map..."):
+                        if epr_src < 0:
+                            gi = st.session_state.ear_grid['inputs']
+                            sources = GroundingGridDesigner.line_sources(gi['Lx'], gi['Ly'], gi['D'], gi['h'], gi['n_rods'], gi['L_rod'])
+                            rho_m, gpr, d_c = gi['rho'], st.session_state.ear_grid['eval']['GPR'], gi['d_c']
+                        else:
+                            a = det.iloc[epr_src].copy()
+                            a['Method'] = st.session_state.ear_results.iloc[epr_src]['Method']
+                            sources = EarthPotentialMap.area_sources(a)
+                            rho_m, gpr, d_c = float(a['rho']), epr_i * float(a['R']), float(a['d_m'])
+                        st.session_state.ear_epr = EarthPotentialMap.compute(sources, rho_m, gpr, int(epr_n), int(epr_n), epr_margin, d_c)
+                
+                if st.session_state.get('ear_epr'):
+                    epr = st.session_state.ear_epr
+                    e1, e2, e3 = st.columns(3)
+                    e1.metric("GPR", f"{epr['gpr']:.0f} V")
+                    e2.metric("Max Touch (footprint)", f"{epr['max_touch']:.0f} V")
+                    e3.metric("Max Step (1 m)", f"{epr['max_step']:.0f} V")
+                    st.image(EarthPotentialMap.colourise(epr['V'], 0.0, epr['gpr']), caption="Surface potential (blue 0 V → red GPR)", use_container_width=True)
+                    
+                    ext = 'png' if epr_fmt == "PNG" else 'npz'
+                    fn = f"EPR_Map_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+                    out = os.path.join(tempfile.gettempdir(), fn)
+                    if ext == 'png':
+                        EarthPotentialMap.save_png(out, epr)
+                    else:
+                        EarthPotentialMap.save_npz(out, epr)
+                    with open(out, "rb") as f:
+                        b64 = base64.b64encode(f.read()).decode()
+                    os.remove(out)
+                    mime = 'image/png' if ext == 'png' else 'application/octet-stream'
+                    st.markdown(f'<a href="data:{mime};base64,{b64}" download="{fn}" class="download-btn">Download EPR Map ({ext.upper()})</a>', unsafe_allow_html=True)
     
-        with ear_tabs[3]:
+        with ear_tabs[4]:
             st.markdown("## Download Report")
             if st.session_state.ear_results is None:
                 st.warning("Calculate first.")
@@ -3974,8 +7135,9 @@ elif st.session_state.selected_calculator == "Earthing":
                                         cl.paragraphs[0].runs[0].bold = True
                             doc.add_paragraph()
                             
+                            cs = EarthingTrace.conductor_steps(c, EARTH_TRACE_TEXT)
                             doc.add_heading('1.2 Current Density Factor k', level=2)
-                            doc.add_paragraph('Formula: k = K x sqrt(ln((T2 + beta)/(T1 + beta)))')
+                            doc.add_paragraph(f'Formula: {cs[0]["formula"]}')
                             doc.add_paragraph('Where:')
                             doc.add_paragraph(f'  K = {c["K"]} A/mm2 (for {c["mat"]})')
                             doc.add_paragraph(f'  beta = {c["beta"]} degC')
@@ -3983,26 +7145,24 @@ elif st.session_state.selected_calculator == "Earthing":
                             doc.add_paragraph(f'  T2 = {c["T2"]} degC (Final temperature)')
                             doc.add_paragraph('')
                             doc.add_paragraph('Calculation:')
-                            doc.add_paragraph(f'  k = {c["K"]} x sqrt(ln(({c["T2"]} + {c["beta"]})/({c["T1"]} + {c["beta"]})))')
-                            doc.add_paragraph(f'  k = {c["K"]} x sqrt(ln({c["T2"]+c["beta"]}/{c["T1"]+c["beta"]}))')
-                            doc.add_paragraph(f'  k = {c["K"]} x sqrt(ln({(c["T2"]+c["beta"])/(c["T1"]+c["beta"]):.4f}))')
+                            for line in cs[0]['lines']:
+                                doc.add_paragraph(f'  {line}')
                             p = doc.add_paragraph()
-                            p.add_run(f'  k = {c["k_val"]} A/mm2').bold = True
+                            p.add_run(f'  {cs[0]["result"]}').bold = True
                             
                             doc.add_paragraph()
                             doc.add_heading('1.3 Minimum Cross-Sectional Area', level=2)
-                            doc.add_paragraph('Formula: s = (I x 1000 x sqrt(t)) / k')
+                            doc.add_paragraph(f'Formula: {cs[1]["formula"]}')
                             doc.add_paragraph('Where:')
                             doc.add_paragraph(f'  I = {c["I"]} kA (Fault current)')
                             doc.add_paragraph(f'  t = {c["t"]} sec (Fault duration)')
                             doc.add_paragraph(f'  k = {c["k_val"]} A/mm2 (Current density factor)')
                             doc.add_paragraph('')
                             doc.add_paragraph('Calculation:')
-                            doc.add_paragraph(f'  s = ({c["I"]} x 1000 x sqrt({c["t"]})) / {c["k_val"]}')
-                            doc.add_paragraph(f'  s = ({c["I"]*1000} x {math.sqrt(c["t"]):.4f}) / {c["k_val"]}')
-                            doc.add_paragraph(f'  s = {c["I"]*1000*math.sqrt(c["t"]):.2f} / {c["k_val"]}')
+                            for line in cs[1]['lines']:
+                                doc.add_paragraph(f'  {line}')
                             p = doc.add_paragraph()
-                            p.add_run(f'  s = {c["s_req"]} mm2').bold = True
+                            p.add_run(f'  {cs[1]["result"]}').bold = True
                             doc.add_paragraph('')
                             p = doc.add_paragraph()
                             p.add_run(f'Selected Conductor = {c["selected"]} mm2 {c["mat"]}').bold = True
@@ -4015,132 +7175,30 @@ elif st.session_state.selected_calculator == "Earthing":
                             p.add_run('Reference: ').bold = True
                             p.add_run('BS 7430 Sections 9.5.2 - 9.5.8.5')
                             
-                            df = st.session_state.ear_areas
-                            for idx, row in st.session_state.ear_results.iterrows():
-                                a = df.iloc[idx] if idx < len(df) else None
-                                
-                                doc.add_heading(f'2.{idx+1} {row["Area"]} - {row["Method"]}', level=2)
+                            for idx, tr in enumerate(st.session_state.ear_trace):
+                                doc.add_heading(f'2.{idx+1} {tr.area} - {tr.method}', level=2)
+                                doc.add_paragraph(f'Standard: {tr.standard}')
+                                doc.add_paragraph('')
+                                p = doc.add_paragraph()
+                                p.add_run('Input Data:').bold = True
+                                for line in tr.inputs(EARTH_TRACE_TEXT):
+                                    doc.add_paragraph(f'  {line}')
+                                doc.add_paragraph('')
                                 
-                                if row['Method'] == "Hollow Square" and a is not None:
-                                    rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                                    s_v = a['s']; pl = a['Plot_L']; pw = a['Plot_W']
-                                    perim = 2*(pl+pw); N_val = perim/s_v; ns = N_val/4+1
-                                    nf = int(ns); lt = {2:2.71,3:4.51,4:5.46,5:6.14,6:6.63,7:7.03,8:7.30,9:7.65,10:7.90,12:8.22,14:8.67,16:8.95,18:9.22,20:9.40}
-                                    lam = lt.get(nf,5.46) if nf<=20 else 2*math.log(1.781*nf/2.718)
-                                    Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                                    alpha = rho_v/(2*math.pi*Rr*s_v) if s_v>0 else 0
-                                    
-                                    doc.add_paragraph('Standard: BS 7430 Section 9.5.8.5 - Vertical rods in a hollow square')
-                                    doc.add_paragraph('')
-                                    p = doc.add_paragraph()
-                                    p.add_run('Input Data:').bold = True
-                                    doc.add_paragraph(f'  Soil Resistivity rho = {rho_v} ohm.m')
-                                    doc.add_paragraph(f'  Rod Length L = {L_v} m')
-                                    doc.add_paragraph(f'  Rod Diameter d = {a["d"]} mm')
-                                    doc.add_paragraph(f'  Rod Spacing s = {s_v} m')
-                                    doc.add_paragraph(f'  Plot Plan: {pl:.0f}m x {pw:.0f}m')
-                                    doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 1 - Perimeter and Number of Electrodes:').bold = True
-                                    doc.add_paragraph(f'  Perimeter = 2 x (L + W) = 2 x ({pl:.0f} + {pw:.0f}) = {perim:.0f} m')
-                                    doc.add_paragraph(f'  N = Perimeter / s = {perim:.0f} / {s_v} = {N_val:.1f} electrodes')
-                                    doc.add_paragraph(f'  n = N/4 + 1 = {N_val:.1f}/4 + 1 = {ns:.1f}')
-                                    doc.add_paragraph(f'  lambda (from Table 2, n={ns:.0f}) = {lam:.3f}')
-                                    doc.add_paragraph('')
-                                    
+                                for step in tr.steps(EARTH_TRACE_TEXT):
                                     p = doc.add_paragraph()
-                                    p.add_run('Step 2 - Single Rod Resistance (BS 7430 Section 9.5.3):').bold = True
-                                    doc.add_paragraph('  Formula: Rr = rho/(2piL) x [ln(8L/d) - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v}/(2pi x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v}/{6.283*L_v:.3f} x [ln({8*L_v/d_m:.2f}) - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v/(2*math.pi*L_v):.3f} x [{math.log(8*L_v/d_m):.4f} - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v/(2*math.pi*L_v):.3f} x {math.log(8*L_v/d_m)-1:.4f}')
-                                    doc.add_paragraph(f'  Rr = {Rr:.3f} ohm')
+                                    p.add_run(f'{step["title"]}:').bold = True
+                                    if step['formula']:
+                                        doc.add_paragraph(f'  Formula: {step["formula"]}')
+                                    for line in step['lines']:
+                                        doc.add_paragraph(f'  {line}')
+                                    if step['result']:
+                                        p = doc.add_paragraph()
+                                        p.add_run(f'  {step["result"]}').bold = True
                                     doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 3 - Factor alpha:').bold = True
-                                    doc.add_paragraph('  Formula: alpha = rho/(2pi x Rr x s)')
-                                    doc.add_paragraph(f'  alpha = {rho_v}/(2pi x {Rr:.3f} x {s_v})')
-                                    doc.add_paragraph(f'  alpha = {rho_v}/{2*math.pi*Rr*s_v:.3f}')
-                                    doc.add_paragraph(f'  alpha = {alpha:.4f}')
-                                    doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 4 - Total Resistance:').bold = True
-                                    doc.add_paragraph('  Formula: RTOT = Rr x (1 + lambda x alpha) / N')
-                                    doc.add_paragraph(f'  RTOT = {Rr:.3f} x (1 + {lam:.3f} x {alpha:.4f}) / {N_val:.1f}')
-                                    doc.add_paragraph(f'  RTOT = {Rr:.3f} x (1 + {lam*alpha:.4f}) / {N_val:.1f}')
-                                    doc.add_paragraph(f'  RTOT = {Rr:.3f} x {1+lam*alpha:.4f} / {N_val:.1f}')
-                                    p = doc.add_paragraph()
-                                    p.add_run(f'  RTOT = {row["R"]} ohm').bold = True
-                                    
-                                elif row['Method'] == "Multiple Rods in Line" and a is not None:
-                                    rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                                    s_v = a['s']; n_r = int(a['n_rods'])
-                                    lam = 2*sum(1/i for i in range(2, n_r+1))
-                                    Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                                    
-                                    doc.add_paragraph('Standard: BS 7430 Section 9.5.4 - Multiple rods in a line')
-                                    doc.add_paragraph('')
-                                    p = doc.add_paragraph()
-                                    p.add_run('Input Data:').bold = True
-                                    doc.add_paragraph(f'  Soil Resistivity rho = {rho_v} ohm.m')
-                                    doc.add_paragraph(f'  Rod Length L = {L_v} m')
-                                    doc.add_paragraph(f'  Rod Diameter d = {a["d"]} mm')
-                                    doc.add_paragraph(f'  Number of Rods n = {n_r}')
-                                    doc.add_paragraph(f'  Rod Spacing s = {s_v} m')
-                                    doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 1 - Group Factor lambda:').bold = True
-                                    doc.add_paragraph('  Formula: lambda = 2 x Sum(1/2 + 1/3 + ... + 1/n)')
-                                    parts_str = " + ".join([f"1/{i}" for i in range(2, n_r+1)])
-                                    doc.add_paragraph(f'  lambda = 2 x ({parts_str})')
-                                    doc.add_paragraph(f'  lambda = 2 x {lam/2:.5f}')
-                                    doc.add_paragraph(f'  lambda = {lam:.5f}')
-                                    doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 2 - Single Rod Resistance:').bold = True
-                                    doc.add_paragraph('  Formula: Rr = rho/(2piL) x [ln(8L/d) - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v}/(2pi x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1]')
-                                    doc.add_paragraph(f'  Rr = {Rr:.3f} ohm')
-                                    doc.add_paragraph('')
-                                    
-                                    p = doc.add_paragraph()
-                                    p.add_run('Step 3 - Total Resistance:').bold = True
-                                    doc.add_paragraph('  Formula: Rt = 1/n x rho/(2piL) x [ln(8L/d) - 1 + lambda x L/s]')
-                                    doc.add_paragraph(f'  Rt = 1/{n_r} x {rho_v}/(2pi x {L_v}) x [ln(8L/d) - 1 + {lam:.5f} x {L_v}/{s_v}]')
-                                    doc.add_paragraph(f'  Rt = 1/{n_r} x {rho_v/(2*math.pi*L_v):.3f} x [{math.log(8*L_v/d_m)-1:.4f} + {lam*L_v/s_v:.4f}]')
-                                    doc.add_paragraph(f'  Rt = 1/{n_r} x {rho_v/(2*math.pi*L_v):.3f} x {math.log(8*L_v/d_m)-1+lam*L_v/s_v:.4f}')
-                                    p = doc.add_paragraph()
-                                    p.add_run(f'  Rt = {row["R"]} ohm').bold = True
-                                    
-                                elif row['Method'] == "Single Rod" and a is not None:
-                                    rho_v = a['rho']; L_v = a['L']; d_m = a['d']/1000.0
-                                    Rr = (rho_v/(2*math.pi*L_v))*(math.log(8*L_v/d_m)-1)
-                                    
-                                    doc.add_paragraph('Standard: BS 7430 Section 9.5.3 - Rod electrode')
-                                    doc.add_paragraph('')
-                                    doc.add_paragraph(f'  rho = {rho_v} ohm.m | L = {L_v} m | d = {d_m:.4f} m')
-                                    doc.add_paragraph('  Formula: Rr = rho/(2piL) x [ln(8L/d) - 1]')
-                                    doc.add_paragraph(f'  Rr = {rho_v}/(2pi x {L_v}) x [ln(8 x {L_v}/{d_m:.4f}) - 1]')
-                                    doc.add_paragraph(f'  Rr = {Rr:.3f} ohm')
-                                    
-                                elif row['Method'] == "Plate Earthing" and a is not None:
-                                    doc.add_paragraph('Standard: BS 7430 Section 9.5.2 - Plate electrode')
-                                    doc.add_paragraph('')
-                                    doc.add_paragraph('  Formula: R = rho/4 x sqrt(pi/A)')
-                                    doc.add_paragraph('  A = 1.0 x 1.0 = 1.0 m2 (plate area)')
-                                    doc.add_paragraph(f'  R = {a["rho"]}/4 x sqrt(pi/1.0)')
-                                    doc.add_paragraph(f'  R = {a["rho"]/4:.3f} x {math.sqrt(math.pi):.4f}')
-                                    p = doc.add_paragraph()
-                                    p.add_run(f'  R = {row["R"]} ohm').bold = True
                                 
                                 p = doc.add_paragraph()
-                                p.add_run(f'Status: {row["R"]} ohm < 5 ohm -> {"PASS" if row["Status"]=="PASS" else "FAIL"}').bold = True
+                                p.add_run(tr.status_line(EARTH_TRACE_TEXT)).bold = True
                                 doc.add_paragraph()
                             
                             # ===== 3. COMBINED RESISTANCE =====
@@ -4204,5 +7262,74 @@ elif st.session_state.selected_calculator == "Earthing":
                             st.success("Professional report generated successfully!")
                         except Exception as e:
                             st.error(str(e))
+    with ear_tabs[3]:
+        st.markdown("### Substation Grounding Grid (IEEE Std 80)")
+        st.info("Mesh grid with perimeter rods. Fault current and duration are taken from the Conductor Sizing inputs; "
+                "conductor diameter from the selected conductor size.")
+        grid_cond = EarthingCalculator.conductor_size(mat, T1, T2, I_f, t_f)
+        gc1, gc2, gc3, gc4 = st.columns(4)
+        with gc1:
+            g_lx = st.number_input("Grid Length Lx (m)", value=70.0, min_value=5.0, step=5.0, key="grid_lx")
+            g_ly = st.number_input("Grid Width Ly (m)", value=70.0, min_value=5.0, step=5.0, key="grid_ly")
+            g_d = st.number_input("Mesh Spacing D (m)", value=7.0, min_value=1.0, step=0.5, key="grid_d")
+        with gc2:
+            g_h = st.number_input("Burial Depth h (m)", value=0.5, min_value=0.25, max_value=2.5, step=0.05, key="grid_h")
+            g_nr = st.number_input("Number of Rods", value=20, min_value=0, step=1, key="grid_nr")
+            g_lr = st.number_input("Rod Length (m)", value=7.5, min_value=0.0, step=0.5, key="grid_lr")
+        with gc3:
+            g_rho = st.number_input("Soil \u03c1 (\u03a9.m)", value=st.session_state.get('grid_rho_fitted', 400.0), min_value=1.0, step=10.0, key="grid_rho")
+            g_rhos = st.number_input("Surface Layer \u03c1s (\u03a9.m)", value=2500.0, min_value=1.0, step=100.0, key="grid_rhos")
+            g_hs = st.number_input("Surface Layer hs (m)", value=0.102, min_value=0.0, step=0.01, format="%.3f", key="grid_hs")
+        with gc4:
+            g_sf = st.number_input("Split Factor Sf", value=0.6, min_value=0.05, max_value=1.0, step=0.05, key="grid_sf")
+            g_df = st.number_input("Decrement Factor Df", value=1.0, min_value=1.0, max_value=1.7, step=0.01, key="grid_df")
+            g_body = st.selectbox("Body Weight (kg)", [70, 50], key="grid_body")
+        g_res = st.slider("Surface Map Resolution (points per side)", 20, 200, 60, key="grid_res")
+        
+        if st.button("CALCULATE GRID", type="primary", use_container_width=True):
+            with st.spinner("Evaluating grid and surface potentials..."):
+                d_c = float(GroundingGridDesigner.conductor_diameter(grid_cond['selected']))
+                I_g = I_f * 1000 * g_sf * g_df
+                ev = GroundingGridDesigner.evaluate(g_lx, g_ly, g_d, g_h, d_c, g_nr, g_lr, g_rho, I_g)
+                tol = GroundingGridDesigner.tolerable_voltages(g_rho, g_rhos, g_hs, t_f, g_body)
+                smap = GroundingGridDesigner.surface_map(g_lx, g_ly, g_d, g_h, d_c, g_nr, g_lr, g_rho, float(ev['GPR']), g_res, g_res)
+                st.session_state.ear_grid = {
+                    'inputs': {'Lx': g_lx, 'Ly': g_ly, 'D': g_d, 'h': g_h, 'd_c': d_c, 'n_rods': g_nr, 'L_rod': g_lr,
+                               'rho': g_rho, 'rho_s': g_rhos, 'h_s': g_hs, 'I_g': I_g, 't_s': t_f, 'conductor': grid_cond['selected']},
+                    'eval': {k: float(v) for k, v in ev.items()},
+                    'tolerable': {k: float(v) for k, v in tol.items()},
+                    'map': smap
+                }
+        
+        if st.session_state.get('ear_grid'):
+            g = st.session_state.ear_grid
+            ev, tol, smap = g['eval'], g['tolerable'], g['map']
+            m1, m2, m3, m4 = st.columns(4)
+            with m1:
+                st.metric("Grid Resistance Rg", f"{ev['Rg']:.3f} \u03a9")
+                st.metric("GPR", f"{ev['GPR']:.0f} V")
+            with m2:
+                st.metric("Mesh Voltage Em", f"{ev['Em']:.0f} V")
+                st.metric("Tolerable Touch", f"{tol['E_touch']:.0f} V")
+            with m3:
+                st.metric("Step Voltage Es", f"{ev['Es']:.0f} V")
+                st.metric("Tolerable Step", f"{tol['E_step']:.0f} V")
+            with m4:
+                st.metric("Max Touch (map)", f"{smap['max_touch']:.0f} V")
+                st.metric("Max Step (map)", f"{smap['max_step']:.0f} V")
+            
+            touch_ok = ev['Em'] <= tol['E_touch']
+            step_ok = ev['Es'] <= tol['E_step']
+            gpr_ok = ev['GPR'] <= tol['E_touch']
+            st.markdown(f"""
+<div class="calc-step">
+    <h4>IEEE 80 Checks</h4>
+    <p>Conductor: {g['inputs']['conductor']} mm\u00b2 (d = {g['inputs']['d_c']*1000:.1f} mm) | L<sub>C</sub> = {ev['L_C']:.0f} m | L<sub>R</sub> = {ev['L_R']:.0f} m | n = {ev['n']:.2f}</p>
+    <p>K<sub>m</sub> = {ev['Km']:.3f} | K<sub>i</sub> = {ev['Ki']:.3f} | K<sub>s</sub> = {ev['Ks']:.3f} | C<sub>s</sub> = {tol['Cs']:.3f} | I<sub>G</sub> = {g['inputs']['I_g']:.0f} A</p>
+    <p>Touch: E<sub>m</sub> = {ev['Em']:.0f} V {'&le;' if touch_ok else '>'} {tol['E_touch']:.0f} V → <b>{'PASS' if touch_ok else 'FAIL'}</b></p>
+    <p>Step: E<sub>s</sub> = {ev['Es']:.0f} V {'&le;' if step_ok else '>'} {tol['E_step']:.0f} V → <b>{'PASS' if step_ok else 'FAIL'}</b></p>
+    <p>GPR {'&le;' if gpr_ok else '>'} tolerable touch → {'no further analysis required' if gpr_ok else 'mesh and step voltages govern'}</p>
+</div>
+""", unsafe_allow_html=True)
 st.markdown("---")
 st.markdown(f"<div style='text-align: center; color: gray; font-size: 16px;'>🔌 CES-Electrical | Version 3.0 | {format_pakistan_datetime()} (Pakistan Time)</div>", unsafe_allow_html=True)